@@ -1,78 +1,144 @@
+"""
+Purges every comment of a user, see bandapi.purge.
+
+    python -m application.purge --user-key USER_KEY [--band BAND_KEY ...]
+        [--token-file PATH ...] [--checkpoint purge.db] [--dry-run]
+
+Each --token-file is one account (a token store holding its tokens,
+see bandapi.tokens, written by `python get_token.py PATH`), bands are
+shared out between them. A missing or empty token file is an error.
+Without one, the account of the BANDAPI_* env vars is used. Progress is printed as
+one json object per line. The exit code is 1 if a comment could not be
+deleted, or a band or post could not be listed.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
 from bandapi import client
-import pandas as pd
-import time
+from bandapi import tokens
+from bandapi.config import Config
+from bandapi.pool import ClientPool
+from bandapi.purge import PurgeCheckpoint, PurgeRunner
 
 
 def delete_all_comments(band_key, user_key):
-    c = client.APIClient()
-    
-    for post_df, _after in c.get_posts(band_key, limit=None):
-        for post in post_df.itertuples():
-            post_key = post.post_key
-            try:
-                post.latest_comments
-            except AttributeError:
-                pass
-            else:
-                comments = c.get_comments(band_key, post_key)
-                for i, comment in enumerate(comments['items']):
-                    if comment['author']['user_key'] == user_key:
-                        res = c.delete_comment(band_key,
-                                               post_key,
-                                               comment['comment_key'])
-                        msg = res['message']
-                        if msg == 'success':
-                            print(f'Deleted comment {comment["content"]}')
-                        else:
-                            print(
-                                f'Failed to delete comment {comment["content"]},')
-                            print(f'reason: {msg}')
-                        if i < (len(comments['items'])):
-                            time.sleep(10.1)
+    delete_all_comments_in_bands([band_key], user_key)
+
+
+def delete_all_comments_in_bands(band_keys, user_key, checkpoint=None):
     """
-    Tried to make all posts / comment remover, but
-    turns out that posts written on the web cannot be deleted using api.
-    
-    for post_df, _after in c.get_posts(band_key, limit=None):
-        for post in post_df.itertuples():
-            post_key = post.post_key
-            if post.author['user_key'] == user_key:
-                print(band_key, post_key)
-                res = c.delete_post(band_key, post_key)
-                msg = res['message']
-                if msg == 'success':
-                    print(f'Deleted post {post.content}')
-                else:
-                    print(
-                        f'Failed to delete post {post.content},\nreason: {res}')
-                time.sleep(10.1)
-            else:
-                try:
-                    post.latest_comments
-                except AttributeError:
-                    pass
-                else:
-                    comments = c.get_comments(band_key, post_key)
-                    for comment in comments['items']:
-                        if comment['author']['user_key'] == user_key:
-                            res = c.delete_comment(band_key,
-                                                post_key,
-                                                comment['comment_key'])
-                            msg = res['message']
-                            if msg == 'success':
-                                print(f'Deleted comment {comment["content"]}')
-                            else:
-                                print(
-                                    f'Failed to delete comment {comment["content"]},')
-                                print(f'reason: {msg}')
-                        time.sleep(10.1)
+    Deletes every comment of user_key in band_keys.
+
+    Posts and every comment page are listed concurrently, and deletes
+    are queued on the client's write scheduler while listing goes on.
+    Each band keeps its own cooldown, so N bands are purged about
+    N times faster than one after another.
     """
+    c = client.APIClient(output='dict')
+
+    def report(event, data):
+        if event != 'result':
+            return
+        if data['ok']:
+            print(f'Deleted comment {data["comment_key"]}')
+        else:
+            print(f'Failed to delete comment {data["comment_key"]},')
+            print(f'reason: {data["message"]}')
+
+    runner = PurgeRunner(c, user_key, checkpoint=checkpoint, on_progress=report)
+    results = runner.run(band_keys)
+    print(results.summary())
+    for error in runner.progress.listing_errors:
+        where = error['post_key'] or error['band_key']
+        print(f'Failed to list comments of {where},')
+        print(f'reason: {error["message"]}')
+
+    c.close()
+
+
+def check_token_file(path):
+    """
+    Makes sure path is a token store holding a token pair.
+
+    Description
+        Config falls back to the BANDAPI_* tokens when its store is
+        empty, which would make every such --token-file the same
+        account.
+
+    Raise
+        ValueError
+            if path is missing, unreadable or has no refresh_token.
+    """
+    if not os.path.exists(path):
+        raise ValueError(f'Token file {path} does not exist, '
+                         f'write it with: python get_token.py {path}')
+    store = tokens.open_store(path)
+    try:
+        profile = store.load()
+    except (ValueError, sqlite3.DatabaseError) as e:
+        raise ValueError(f'Token file {path} cannot be read: {e}')
+    finally:
+        if hasattr(store, 'close'):
+            store.close()
+    if not profile or not profile.get('refresh_token'):
+        raise ValueError(f'Token file {path} holds no refresh_token, '
+                         f'write it with: python get_token.py {path}')
+
+
+def print_event(event, data):
+    print(json.dumps({'event': event, **data}, ensure_ascii=False), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--user-key', required=True,
+                        help='author whose comments are deleted')
+    parser.add_argument('--band', action='append', dest='band_keys',
+                        metavar='BAND_KEY',
+                        help='band to purge, repeatable (default: every band)')
+    parser.add_argument('--token-file', action='append', dest='token_files',
+                        metavar='PATH', help='token store of an account, repeatable')
+    parser.add_argument('--checkpoint', default='purge.db',
+                        help='SQLite file of deleted comment_keys (default: %(default)s)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only list what would be deleted and estimate the time')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='bands / posts listed at once')
+    parser.add_argument('--max-attempts', type=int, default=3)
+    args = parser.parse_args(argv)
+    for path in args.token_files or ():
+        try:
+            check_token_file(path)
+        except ValueError as e:
+            parser.error(str(e))
+
+    configs = [Config(token_file=path) for path in args.token_files or ()]
+    pool = ClientPool(configs or [Config()], output='dict')
+    checkpoint = PurgeCheckpoint(args.checkpoint)
+    runner = PurgeRunner(pool, args.user_key,
+                         checkpoint=checkpoint,
+                         max_workers=args.workers,
+                         max_attempts=args.max_attempts,
+                         on_progress=print_event,
+                         )
+    try:
+        if args.dry_run:
+            plan = runner.plan(args.band_keys)
+            print_event('plan', plan)
+            return 0 if not plan['listing_errors'] else 1
+        results = runner.run(args.band_keys)
+        listing_errors = runner.progress.listing_errors
+        print_event('summary', {**results.summary(),
+                                'listing_errors': listing_errors})
+        return 0 if not results.failed and not listing_errors else 1
+    finally:
+        pool.close()
+        checkpoint.close()
 
 
 if __name__ == "__main__":
-    uk = ''
-    bk = ''
-    
-    print('Start deleting all comments')
-    delete_all_comments(bk, uk)
-    print('Finished deleting all comments')
\ No newline at end of file
+    sys.exit(main())
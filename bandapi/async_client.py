@@ -0,0 +1,516 @@
+"""
+asyncio version of client.APIClient.
+
+Requires aiohttp.
+"""
+
+import asyncio
+import time
+from urllib.parse import urlencode, urlsplit
+
+import aiohttp
+
+from bandapi import tokens
+from bandapi.config import Config, default_config
+from bandapi.decoding import get_decoder
+from bandapi.client import request_params, parse_result
+from bandapi import ratelimit
+from bandapi.metrics import RequestEvent, call_hooks
+from bandapi.paging import apaginate
+from bandapi.records import check_output, to_output, to_single_output
+
+
+class AsyncAPIClient:
+    """
+    The band API client for asyncio.
+
+    Has the same endpoints as client.APIClient as coroutines (list
+    endpoints are async generators), and parses responses the same way.
+
+    All requests share one aiohttp connection pool, and at most
+    max_concurrency requests are in flight at once, so many bands can be
+    crawled from one event loop with asyncio.gather.
+
+    Use as async context manager, or await close() when done.
+        async with AsyncAPIClient() as c:
+            profile = await c.get_profile()
+    """
+
+    def __init__(self,
+                 base_url: str = None,
+                 max_concurrency: int = 32,
+                 pool_maxsize: int = 32,
+                 connect_timeout: float = 5,
+                 read_timeout: float = 30,
+                 output: str = 'dataframe',
+                 prefetch: int = 0,
+                 token_manager: tokens.TokenManager = None,
+                 config: Config = None,
+                 decoder='auto',
+                 hooks=None,
+                 metrics=None,
+                 ):
+        """
+        AsyncAPIClient init.
+
+        Parameter
+            base_url: str
+                if not base_url, config.api_url.
+
+            max_concurrency: int
+                requests allowed in flight at once.
+
+            pool_maxsize: int
+                keep-alive connections kept per host.
+
+            connect_timeout: float
+            read_timeout: float
+                seconds, passed on to every request.
+
+            output: str
+                'dataframe', 'dict' or 'record', see client.APIClient.
+
+            prefetch: int
+                pages list endpoints read ahead in a task while the
+                caller processes the current one.
+
+            token_manager: tokens.TokenManager
+                if not token_manager, tokens.default_manager(config),
+                shared with every other client of the config.
+
+            config: config.Config
+                see client.APIClient.
+
+            decoder: str or decoder
+                see client.APIClient. Bodies are read whole first,
+                a 'stream' decoder parses them like its fallback.
+
+            hooks: dict
+            metrics: metrics.Metrics or metrics.OpenTelemetryRecorder
+                see client.APIClient. aiohttp does not tell tls apart,
+                so new connections are timed as dns and connect only.
+        """
+        self.config = config or default_config()
+        self.base_url = (base_url or self.config.api_url).rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.pool_maxsize = pool_maxsize
+        self.output = check_output(output)
+        self.prefetch = prefetch
+        self.decoder = get_decoder(decoder)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                             sock_read=read_timeout,
+                                             )
+        self.token_manager = (token_manager
+                              or tokens.default_manager(self.config))
+        self._session = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._token_task = None  # load or refresh in flight
+
+        self.hooks = {'pre_request': [], 'post_request': []}
+        for name, functions in (hooks or {}).items():
+            if name not in self.hooks:
+                raise ValueError(f'Param hooks keys must be one of {list(self.hooks)}')
+            self.hooks[name].extend(functions)
+        self.metrics = metrics
+        if metrics is not None:
+            self.hooks['post_request'].append(metrics.record)
+            if metrics.on_token_refresh not in self.token_manager.on_refresh:
+                self.token_manager.on_refresh.append(metrics.on_token_refresh)
+
+    @property
+    def access_token(self):
+        """
+        Current access_token. May load or refresh it on the spot, which
+        blocks the event loop: coroutines await get_access_token instead.
+        """
+        return self.token_manager.access_token()
+
+    @property
+    def session(self):
+        # aiohttp sessions have to be made inside a running loop.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize,
+                                             limit_per_host=self.pool_maxsize,
+                                             )
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=self.timeout,
+                                                  trace_configs=[_trace_config()],
+                                                  )
+        return self._session
+
+    async def close(self):
+        """
+        Closes every pooled connection.
+        """
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def get(self, url, kwargs, event=None, access_token=None):
+        params = {'access_token': access_token or await self.get_access_token(),
+                  **kwargs}
+        return await self.session.get(url, params=params,
+                                      trace_request_ctx=event)
+
+    async def post(self, url, kwargs, event=None, access_token=None):
+        params = {'access_token': access_token or await self.get_access_token(),
+                  **kwargs}
+        return await self.session.post(url, data=params,
+                                       trace_request_ctx=event)
+
+    async def get_access_token(self):
+        """
+        Gets the current access_token without blocking the event loop.
+
+        Description
+            A token that is not loaded yet or close to expiry is loaded /
+            refreshed in a thread. Coroutines that need it meanwhile
+            await the same one.
+        """
+        if self.token_manager.expiring():
+            await self._single_flight(self.token_manager.access_token)
+        return self.token_manager.access_token()
+
+    async def refresh_access_token(self, stale_token=None):
+        """
+        Gets new access_token from token_manager.
+
+        Description
+            The refresh request runs in a thread so the event loop goes
+            on. Coroutines (and threads of other clients) that got
+            unauthorized with the same stale_token wait for one refresh
+            instead of each sending their own.
+        """
+        return await self._single_flight(self.token_manager.refresh,
+                                         stale_token)
+
+    async def _single_flight(self, function, *args):
+        # runs function in a thread, or awaits the call already running:
+        # any load or refresh in flight gives the token to use next
+        task = self._token_task
+        if task is None or task.done():
+            loop = asyncio.get_running_loop()
+            task = asyncio.ensure_future(
+                loop.run_in_executor(None, function, *args))
+            self._token_task = task
+        # a cancelled waiter does not cancel the others' refresh
+        return await asyncio.shield(task)
+
+    async def api_request(self, method, url, kwargs):
+        """
+        Does actual band API request.
+
+        Same as client.APIClient.api_request.
+        """
+        event = RequestEvent(method.lower(), url, urlsplit(url).path,
+                             request_params(kwargs))
+        call_hooks(self.hooks, 'pre_request', event)
+        try:
+            result_data = await self._api_request(method, url, kwargs, event)
+        except BaseException as e:
+            status = ('unauthorized' if isinstance(e, ConnectionRefusedError)
+                      else 'error')
+            event.finish(status, error=e)
+            call_hooks(self.hooks, 'post_request', event)
+            raise
+        call_hooks(self.hooks, 'post_request', event)
+        return result_data
+
+    async def _api_request(self, method, url, kwargs, event):
+        method_dict = {
+            'get': self.get,
+            'post': self.post,
+        }
+
+        # if method not in method_dict.keys(), throws ValueError
+        try:
+            send_request = method_dict[method.lower()]
+        except KeyError:
+            methods = str(list(method_dict.keys()))
+            raise ValueError(f'Method must be one of: {methods}')
+
+        params = request_params(kwargs)
+
+        async def do_call(access_token):
+            connected = _connecting(event)
+            async with self._semaphore:
+                sent = time.perf_counter()
+                response = await send_request(url, params, event, access_token)
+                headers_at = time.perf_counter()
+                async with response:
+                    content = await response.read()
+                read_at = time.perf_counter()
+            content_dict = self.decoder.decode(content)
+
+            # connection phases were added by the trace config
+            connecting = _connecting(event) - connected
+            body = urlencode(params) if method.lower() == 'post' else ''
+            event.add_attempt(response.status,
+                              {'ttfb': max(0.0, headers_at - sent - connecting),
+                               'download': read_at - headers_at,
+                               'decode': time.perf_counter() - read_at},
+                              len(str(response.url)) + len(body),
+                              len(content))
+            reason = response.reason.lower()
+            return content_dict, reason
+
+        # got before the semaphore, a refresh does not hold a slot
+        stale_token = await self.get_access_token()
+        content_dict, reason = await do_call(stale_token)
+        if reason == 'unauthorized':
+            # unauthorized -> refresh token and try again.
+            #   if fail, throw ConnectionRefusedError
+            event.refreshed = True
+            access_token = await self.refresh_access_token(stale_token)
+            content_dict, reason = await do_call(access_token)
+            if reason != 'ok':
+                raise ConnectionRefusedError(
+                    'Invalid access token. \
+                    Try to check if all of env var is correct.')
+
+        result_code = int(content_dict['result_code'])
+        if result_code == 1:
+            event.finish('ok', result_code)
+        elif ratelimit.is_rate_limited(content_dict):
+            event.finish('rate_limited', result_code)
+        else:
+            event.finish('failed', result_code)
+        result_data = parse_result(content_dict)
+        return result_data
+
+    def _to_output(self, data, single=False):
+        """
+        See client.APIClient._to_output.
+        """
+        convert = to_single_output if single else to_output
+        if self.metrics is None:
+            return convert(data, self.output)
+        start = time.perf_counter()
+        data = convert(data, self.output)
+        self.metrics.record_convert(self.output, time.perf_counter() - start)
+        return data
+
+    def _paginate(self, url, kwargs):
+        """
+        Streams a list endpoint with paging.apaginate.
+        """
+        kwargs = dict(kwargs)
+        after = kwargs.pop('after')
+        limit = kwargs.pop('limit')
+
+        async def fetch(after):
+            return await self.api_request('get', url, {**kwargs, 'after': after})
+
+        def to_page(result_data):
+            return self._to_output(result_data['items'])
+
+        return apaginate(fetch, to_page,
+                         after=after,
+                         limit=limit,
+                         prefetch=self.prefetch,
+                         )
+
+    async def get_profile(self,
+                          band_key: str = None,
+                          ):
+        """
+        See client.APIClient.get_profile.
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/profile"
+        result_data = await self.api_request('get', url, kwargs)
+        result_data = self._to_output(result_data, single=True)
+        return result_data
+
+    async def get_bands(self,
+                        ):
+        """
+        See client.APIClient.get_bands.
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2.1/bands"
+        result_data = await self.api_request('get', url, kwargs)
+        result_data = self._to_output(result_data['bands'])
+        return result_data
+
+    def get_posts(self,
+                  band_key: str,
+                  locale: str = 'ko_KR',
+                  after: str = None,
+                  limit: int = 20,
+                  ):
+        """
+        See client.APIClient.get_posts.
+
+        Async generator of (page, after).
+            async for posts, after in c.get_posts(band_key, limit=None):
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/band/posts"
+        return self._paginate(url, kwargs)
+
+    async def get_specific_post(self,
+                                band_key: str,
+                                post_key: str,
+                                ):
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2.1/band/post"
+        result_data = await self.api_request('get', url, kwargs)
+
+        return result_data
+
+    async def write_post(self,
+                         band_key: str,
+                         content: str,
+                         do_push: bool = None):
+        """
+        cooldown = 10 seconds
+
+        See client.APIClient.write_post.
+        """
+        kwargs = locals()  # function param=arg dict
+        kwargs['content'] = kwargs['content'].replace(
+            ' ', '%20')  # all space = %20
+
+        if kwargs['do_push'] is True:
+            kwargs['do_push'] = 'true'
+        elif kwargs['do_push'] is False:
+            kwargs['do_push'] = 'false'
+
+        url = f"{self.base_url}/v2.2/band/post/create"
+        result_data = await self.api_request('post', url, kwargs)
+        return result_data
+
+    async def delete_post(self,
+                          band_key: str,
+                          post_key: str,
+                          ):
+        """
+        cooldown = 10 seconds
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/band/post/remove"
+        result_data = await self.api_request('post', url, kwargs)
+
+        return result_data
+
+    def get_comments(self,
+                     band_key: str,
+                     post_key: str,
+                     sortby: str = '+created_at',
+                     after: str = None,
+                     limit: int = None,
+                     ):
+        """
+        Async generator of (page, after), see get_posts.
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/band/post/comments"
+        return self._paginate(url, kwargs)
+
+    async def write_comment(self,
+                            band_key: str,
+                            post_key: str,
+                            body: str,
+                            ):
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/band/post/comment/create"
+        result_data = await self.api_request('post', url, kwargs)
+
+        return result_data
+
+    async def delete_comment(self,
+                             band_key: str,
+                             post_key: str,
+                             comment_key: str,  # post_key on api doc
+                             ):
+        """
+        cooldown = 10 seconds
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/band/post/comment/remove"
+        result_data = await self.api_request('post', url, kwargs)
+
+        return result_data
+
+    async def check_permission(self,
+                               band_key: str,
+                               permissions: str,  # posting, commenting, contents_deletion
+                               ):
+        """
+        See client.APIClient.check_permission.
+        """
+        kwargs = locals()  # function param=arg dict
+        perm_list = ['posting', 'commenting', 'contents_deletion']
+        if permissions not in perm_list:
+            raise ValueError(f'Param permissions must be one of {perm_list}')
+
+        url = f"{self.base_url}/v2/band/permissions"
+        result_data = await self.api_request('get', url, kwargs)
+        has_permission = bool(result_data['permissions'])
+
+        return has_permission
+
+    def get_albums(self,
+                   band_key: str,
+                   after: str = None,
+                   limit: int = None,
+                   ):
+        """
+        Async generator of (page, after), see get_posts.
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/band/albums"
+        return self._paginate(url, kwargs)
+
+    def get_photos(self,
+                   band_key: str,
+                   photo_album_key: str = None,
+                   after: str = None,
+                   limit: int = None,
+                   ):
+        """
+        Async generator of (page, after), see get_posts.
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/band/album/photos"
+        return self._paginate(url, kwargs)
+
+
+def _connecting(event):
+    return event.timings.get('dns', 0) + event.timings.get('connect', 0)
+
+
+def _trace_config():
+    # times new connections of requests sent with a RequestEvent
+    # as trace_request_ctx; the host is resolved within the connection
+    async def on_connection_start(session, context, params):
+        context.connection_start = time.perf_counter()
+        context.dns = 0
+
+    async def on_dns_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def on_dns_end(session, context, params):
+        event = context.trace_request_ctx
+        if event is not None:
+            context.dns = time.perf_counter() - context.dns_start
+            event.add_timing('dns', context.dns)
+
+    async def on_connection_end(session, context, params):
+        event = context.trace_request_ctx
+        if event is not None:
+            event.add_timing('connect', time.perf_counter()
+                             - context.connection_start - context.dns)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(on_connection_start)
+    trace_config.on_dns_resolvehost_start.append(on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_end)
+    trace_config.on_connection_create_end.append(on_connection_end)
+    return trace_config
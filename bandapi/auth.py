@@ -1,12 +1,13 @@
-from bandapi import config
+from bandapi.config import auth_secret_header, default_config
 from urllib.parse import urlparse
 
 import requests
 import json
 
 
-def get_new_auth_code(client_id=config.CLIENT_ID,
-                      client_redirect_url=config.CLIENT_REDIRECT_URL,
+def get_new_auth_code(client_id=None,
+                      client_redirect_url=None,
+                      config=None,
                       ):
     """
     Gets authorization code to use to get access_token.
@@ -14,6 +15,10 @@ def get_new_auth_code(client_id=config.CLIENT_ID,
     Parameter
         client_id: str
         client_redirect_url:str
+            if not given, taken from config.
+
+        config: config.Config
+            if not config, config.default_config().
 
     Description
         Gets autho_code from http request.
@@ -24,8 +29,12 @@ def get_new_auth_code(client_id=config.CLIENT_ID,
         auth_code: str
     """
 
+    config = config or default_config()
+    client_id = client_id or config.client_id
+    client_redirect_url = client_redirect_url or config.redirect_url
+
     print("Open this link on your browser:")
-    auth_url = f"https://auth.band.us/oauth2/authorize?response_type=code&client_id={client_id}&redirect_uri={client_redirect_url}"
+    auth_url = f"{config.auth_url}/oauth2/authorize?response_type=code&client_id={client_id}&redirect_uri={client_redirect_url}"
     print(f'{auth_url}')
 
     full_url = input("Paste redirected full url: \n")
@@ -40,6 +49,15 @@ def get_new_auth_code(client_id=config.CLIENT_ID,
     return auth_code
 
 
+def _auth_headers(client_id, client_secret, config):
+    header = auth_secret_header(client_id or config.client_id,
+                                client_secret or config.client_secret,
+                                )
+    return {
+        "Authorization": f"Basic {header}"
+    }
+
+
 def _check_token_profile_error(token_profile):
     # error catch
     if 'error' in token_profile.keys():
@@ -57,8 +75,11 @@ def _check_token_profile_error(token_profile):
 
 
 def get_new_auth_profile(auth_code=None,
-                         client_id=config.CLIENT_ID,
-                         client_secret=config.CLIENT_SECRET,
+                         client_id=None,
+                         client_secret=None,
+                         session=None,
+                         timeout=None,
+                         config=None,
                          ):
     """
     Gets band authorization profile dictionary.
@@ -69,6 +90,16 @@ def get_new_auth_profile(auth_code=None,
 
         client_id: str
         client_secret: str
+            if not given, taken from config.
+
+        session: requests.Session
+            pooled session to send the request on (ex. APIClient.session).
+            if not session, a one-off connection is used.
+
+        timeout: float or (connect, read) tuple
+
+        config: config.Config
+            if not config, config.default_config().
 
     Description
         This method gets band auth profile by asking for
@@ -97,21 +128,19 @@ def get_new_auth_profile(auth_code=None,
             "user_key": "{user_key_str}"
         }
     """
+    config = config or default_config()
     if not auth_code:
-        auth_code = get_new_auth_code()
-
-    auth_secret_header = config.AUTH_SECRET_HEADER
+        auth_code = get_new_auth_code(client_id=client_id, config=config)
 
     query = {
         "grant_type": "authorization_code",
         "code": auth_code,
     }
-    url = "https://auth.band.us/oauth2/token"
+    url = f"{config.auth_url}/oauth2/token"
 
-    headers = {
-        "Authorization": f"Basic {auth_secret_header}"
-    }
-    res = requests.get(url, params=query, headers=headers)
+    headers = _auth_headers(client_id, client_secret, config)
+    session = session or requests
+    res = session.get(url, params=query, headers=headers, timeout=timeout)
 
     message = res.text
     token_profile = json.loads(message)
@@ -122,8 +151,11 @@ def get_new_auth_profile(auth_code=None,
 
 
 def get_refreshed_auth_profile(refresh_token,
-                               client_id=config.CLIENT_ID,
-                               client_secret=config.CLIENT_SECRET,
+                               client_id=None,
+                               client_secret=None,
+                               session=None,
+                               timeout=None,
+                               config=None,
                                ):
     """
     Gets band authorization profile dictionary.
@@ -135,6 +167,11 @@ def get_refreshed_auth_profile(refresh_token,
         client_id: str
         client_secret: str
 
+        session: requests.Session
+        timeout: float or (connect, read) tuple
+        config: config.Config
+            see get_new_auth_profile.
+
     Description
         Requests new auth_profile using refresh_token aquired.
 
@@ -159,18 +196,17 @@ def get_refreshed_auth_profile(refresh_token,
             "user_key": "{user_key_str}"
         }
     """
-    auth_secret_header = config.AUTH_SECRET_HEADER
+    config = config or default_config()
 
     query = {
         "grant_type": "refresh_token",
         "refresh_token": refresh_token,
     }
-    url = "https://auth.band.us/oauth2/token"
+    url = f"{config.auth_url}/oauth2/token"
 
-    headers = {
-        "Authorization": f"Basic {auth_secret_header}"
-    }
-    res = requests.get(url, params=query, headers=headers)
+    headers = _auth_headers(client_id, client_secret, config)
+    session = session or requests
+    res = session.get(url, params=query, headers=headers, timeout=timeout)
 
     message = res.text
     token_profile = json.loads(message)
@@ -181,44 +217,50 @@ def get_refreshed_auth_profile(refresh_token,
 
 
 def get_access_token(refreshed=False,
-                     client_id=config.CLIENT_ID,
-                     client_secret=config.CLIENT_SECRET,
+                     client_id=None,
+                     client_secret=None,
+                     session=None,
+                     timeout=None,
+                     config=None,
                      ):
     """
-    Gets access_token.
+    Gets access_token from the shared tokens.default_manager().
+
+    Parameter
+        refreshed: bool
+            if True, rotates the token with the refresh token first.
+
+        client_id: str
+        client_secret: str
+            not used, the manager refreshes with its config's.
+
+        session: requests.Session
+        timeout: float or (connect, read) tuple
+            see get_new_auth_profile.
+
+        config: config.Config
+            takes tokens.default_manager(config) instead.
 
     Description
-        TODO:
+        The manager starts from BANDAPI_ACCESS_TOKEN /
+        BANDAPI_REFRESH_TOKEN and keeps every rotated pair in its
+        store, see tokens.py.
 
-    Return
-        dict
-            "access_token": {str},
-            "token_type": {str},
-            "refresh_token": {str},
-            "expires_in": {int},
-            "scope": {str},
-            "user_key": {str}
+    Raise
+        KeyError
+            if BANDAPI_ACCESS_TOKEN (BANDAPI_REFRESH_TOKEN if refreshed)
+            is missing.
 
+    Return
+        str
     """
+    # tokens imports this module
+    from bandapi import tokens
 
+    manager = tokens.default_manager(config)
     if refreshed:
-        if config.REFRESH_TOKEN:
-            auth_profile = get_refreshed_auth_profile(config.REFRESH_TOKEN,
-                                                      client_id=client_id,
-                                                      client_secret=client_secret,
-                                                      )
-            print(auth_profile)
-            access_token = auth_profile['access_token']
-        else:
-            raise KeyError('BANDAPI_REFRESH_TOKEN')
-
-    elif not refreshed:
-        if config.ACCESS_TOKEN:
-            access_token = config.ACCESS_TOKEN
-        else:
-            raise KeyError('BANDAPI_ACCESS_TOKEN')
-
-    return access_token
+        return manager.refresh(session=session, timeout=timeout)
+    return manager.access_token(session=session, timeout=timeout)
 
 
 if __name__ == "__main__":
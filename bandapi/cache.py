@@ -0,0 +1,395 @@
+"""
+Cache of read (get) responses for APIClient.
+
+    client = APIClient(cache=ResponseCache())
+    client = APIClient(cache=ResponseCache(DiskCache('cache.db')))
+"""
+
+import copy
+import hashlib
+from collections import OrderedDict
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+# seconds a response of each endpoint path stays fresh.
+# 0 means not cached: paginated crawls want fresh pages.
+DEFAULT_TTLS = {
+    '/v2/profile': 3600,
+    '/v2.1/bands': 600,
+    '/v2/band/permissions': 600,
+    '/v2.1/band/post': 60,
+    '/v2/band/post/comments': 60,
+    '/v2/band/albums': 300,
+    '/v2/band/album/photos': 0,
+    '/v2/band/posts': 0,
+}
+
+
+class MemoryCache:
+    """
+    In-memory LRU backend, holds at most maxsize entries.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at, band_key, post_key)
+
+    def get(self, key):
+        """
+        Return
+            value, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(entry[0])
+
+    def set(self, key, value, expires_at, band_key=None, post_key=None):
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(value), expires_at,
+                                  band_key, post_key)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, band_key, post_key=None):
+        """
+        Drops entries of band_key. With post_key, keeps entries of
+        the band's other posts.
+        """
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry[2] != band_key:
+                    continue
+                if post_key is None or entry[3] is None or entry[3] == post_key:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """
+    SQLite backend, survives restarts. Holds at most maxsize entries,
+    least recently used are dropped first.
+    """
+
+    def __init__(self, path, maxsize: int = 100000):
+        self.path = path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    used_at REAL NOT NULL,
+                    band_key TEXT,
+                    post_key TEXT
+                )''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_band '
+                               'ON responses (band_key, post_key)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_used '
+                               'ON responses (used_at)')
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM responses WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            self._conn.execute('UPDATE responses SET used_at = ? WHERE key = ?',
+                               (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, expires_at, band_key=None, post_key=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(key, value, expires_at, used_at, band_key, post_key) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, json.dumps(value), expires_at, time.time(),
+                 band_key, post_key))
+            self._conn.execute(
+                'DELETE FROM responses WHERE key IN ('
+                'SELECT key FROM responses ORDER BY used_at DESC '
+                'LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def invalidate(self, band_key, post_key=None):
+        with self._lock, self._conn:
+            if post_key is None:
+                self._conn.execute('DELETE FROM responses WHERE band_key = ?',
+                                   (band_key,))
+            else:
+                self._conn.execute(
+                    'DELETE FROM responses WHERE band_key = ? '
+                    'AND (post_key IS NULL OR post_key = ?)',
+                    (band_key, post_key))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM responses')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+class ResponseCache:
+    """
+    Caches result_data of successful get requests.
+
+    Description
+        Entries are keyed by endpoint path and request parameters
+        (access_token left out) and expire after the endpoint's ttl.
+        Writes to a band drop the band's entries, see invalidate.
+
+    Attribute
+        hits: int
+        misses: int
+            lookups of cacheable endpoints, to size the cache with.
+    """
+
+    def __init__(self,
+                 backend=None,
+                 ttls: dict = None,
+                 ):
+        """
+        ResponseCache init.
+
+        Parameter
+            backend: MemoryCache or DiskCache
+                if not backend, MemoryCache().
+
+            ttls: dict
+                {endpoint path: seconds}, merged over DEFAULT_TTLS.
+        """
+        self.backend = backend if backend is not None else MemoryCache()
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def ttl(self, url):
+        return self.ttls.get(urlparse(url).path, 0)
+
+    @staticmethod
+    def key(url, params):
+        params = {name: value for name, value in params.items()
+                  if name != 'access_token'}
+        return json.dumps([urlparse(url).path, params],
+                          sort_keys=True, default=str)
+
+    def lookup(self, url, params):
+        """
+        Return
+            cached result_data, or None.
+        """
+        if not self.ttl(url):
+            return None
+        result_data = self.backend.get(self.key(url, params))
+        with self._lock:
+            if result_data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result_data
+
+    def store(self, url, params, result_data):
+        ttl = self.ttl(url)
+        if not ttl:
+            return
+        self.backend.set(self.key(url, params), result_data, time.time() + ttl,
+                         band_key=params.get('band_key'),
+                         post_key=params.get('post_key'),
+                         )
+
+    def invalidate(self, band_key, post_key=None):
+        """
+        Drops cached responses a write to band_key (post_key) changes:
+        every band level list (posts, albums, permissions, ...) and,
+        with post_key, that post and its comments.
+        """
+        if band_key is None:
+            return
+        self.backend.invalidate(band_key, post_key)
+
+    def stats(self):
+        """
+        Return
+            dict
+                hits, misses, hit_rate, size
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.backend),
+        }
+
+
+# list endpoints whose pages are revalidated by ValidatorStore
+REVALIDATED_PATHS = (
+    '/v2/band/posts',
+    '/v2/band/post/comments',
+    '/v2/band/album/photos',
+)
+
+
+class Unchanged(dict):
+    """
+    result_data of a page identical to its last fetch.
+
+    The page is not parsed again. Only 'paging' of the last fetch is
+    kept so pagination can go on, and count is the number of items
+    the page had.
+
+    Unchanged only means the caller saw these items before. Callers
+    that need them anyway call refetch().
+    """
+
+    def __init__(self, paging, count):
+        super().__init__(paging=paging)
+        self.count = count
+        self._refetch = None
+
+    def refetch(self):
+        """
+        Requests the page again, without validators.
+
+        Raise
+            ValueError
+                if the page did not come from an APIClient list endpoint.
+
+        Return
+            the page in the client's output format.
+        """
+        if self._refetch is None:
+            raise ValueError('Unchanged page cannot be fetched again')
+        return self._refetch()
+
+    def __repr__(self):
+        return f'Unchanged(count={self.count})'
+
+
+class ValidatorStore:
+    """
+    Remembers a validator of the last response of each list page.
+
+    Description
+        The validator is the server's ETag / Last-Modified when the API
+        sends them, which are sent back as If-None-Match /
+        If-Modified-Since, and a hash of the body otherwise. A 304 or a
+        body with the same hash makes APIClient.api_request return
+        Unchanged instead of decoding the page.
+
+        client = APIClient(validators=ValidatorStore())
+    """
+
+    def __init__(self,
+                 paths=REVALIDATED_PATHS,
+                 maxsize: int = 100000,
+                 ):
+        """
+        ValidatorStore init.
+
+        Parameter
+            paths: iterable of str
+                endpoint paths to revalidate.
+
+            maxsize: int
+                pages remembered, least recently used are dropped first.
+        """
+        self.paths = set(paths)
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _key(self, url, params):
+        if urlparse(url).path not in self.paths:
+            return None
+        return ResponseCache.key(url, params)
+
+    def _entry(self, url, params):
+        key = self._key(url, params)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def headers(self, url, params):
+        """
+        Return
+            dict
+                conditional request headers for the page.
+        """
+        entry = self._entry(url, params)
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def unchanged(self, url, params, response):
+        """
+        Return
+            Unchanged if response says the page did not change, else None.
+        """
+        entry = self._entry(url, params)
+        if entry is None:
+            return None
+        if (response.status_code == 304
+                or hashlib.blake2b(response.content,
+                                   digest_size=16).digest() == entry['digest']):
+            return Unchanged(entry['paging'], entry['count'])
+        return None
+
+    def update(self, url, params, response, result_data):
+        """
+        Remembers response as the page's last version.
+        """
+        key = self._key(url, params)
+        if key is None:
+            return
+        entry = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'digest': hashlib.blake2b(response.content, digest_size=16).digest(),
+            'paging': result_data.get('paging', {}),
+            'count': len(result_data.get('items', ())),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
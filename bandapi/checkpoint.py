@@ -0,0 +1,125 @@
+"""
+Crawl checkpoints, the last 'after' cursor per endpoint and band.
+
+Both stores have the same interface:
+    get(endpoint, band_key, parent_key='') -> dict or None
+        {'after': str or None, 'done': bool, 'mark': dict or None}
+
+    set(endpoint, band_key, after, done=False, parent_key='', mark=None)
+    delete(endpoint, band_key, parent_key='')
+
+endpoint is the list endpoint ('posts', 'comments', 'albums', 'photos'),
+parent_key the post_key / photo_album_key the list belongs to, if any.
+mark is a small json-able dict, ex. the newest post seen by a sync.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+from bandapi import util
+
+
+def _entry_key(endpoint, band_key, parent_key):
+    return f'{endpoint}/{band_key}/{parent_key}'
+
+
+class FileCheckpointStore:
+    """
+    Checkpoints in one JSON file.
+
+    Every set() rewrites the file with util.atomic_write_json, so it is
+    always either the old or the new version, never a partial write.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+
+    def get(self, endpoint, band_key, parent_key=''):
+        with self._lock:
+            entry = self._entries.get(_entry_key(endpoint, band_key, parent_key))
+            if entry is None:
+                return None
+            return {'mark': None, **entry}
+
+    def set(self, endpoint, band_key, after, done=False, parent_key='',
+            mark=None):
+        with self._lock:
+            key = _entry_key(endpoint, band_key, parent_key)
+            self._entries[key] = {'after': after, 'done': done, 'mark': mark}
+            self._write()
+
+    def delete(self, endpoint, band_key, parent_key=''):
+        with self._lock:
+            key = _entry_key(endpoint, band_key, parent_key)
+            if self._entries.pop(key, None) is not None:
+                self._write()
+
+    def _write(self):
+        util.atomic_write_json(self.path, self._entries)
+
+
+class SQLiteCheckpointStore:
+    """
+    Checkpoints in a SQLite database.
+
+    Each set() is its own transaction, so a crash leaves the last
+    committed cursor. Better than FileCheckpointStore for many
+    (band, post) entries, which would rewrite a big file every page.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    endpoint TEXT NOT NULL,
+                    band_key TEXT NOT NULL,
+                    parent_key TEXT NOT NULL,
+                    after TEXT,
+                    done INTEGER NOT NULL,
+                    mark TEXT,
+                    PRIMARY KEY (endpoint, band_key, parent_key)
+                )''')
+
+    def get(self, endpoint, band_key, parent_key=''):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT after, done, mark FROM checkpoints '
+                'WHERE endpoint = ? AND band_key = ? AND parent_key = ?',
+                (endpoint, band_key, parent_key)).fetchone()
+        if row is None:
+            return None
+        mark = json.loads(row[2]) if row[2] is not None else None
+        return {'after': row[0], 'done': bool(row[1]), 'mark': mark}
+
+    def set(self, endpoint, band_key, after, done=False, parent_key='',
+            mark=None):
+        if mark is not None:
+            mark = json.dumps(mark)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO checkpoints '
+                '(endpoint, band_key, parent_key, after, done, mark) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (endpoint, band_key, parent_key, after, int(done), mark))
+
+    def delete(self, endpoint, band_key, parent_key=''):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM checkpoints '
+                'WHERE endpoint = ? AND band_key = ? AND parent_key = ?',
+                (endpoint, band_key, parent_key))
+
+    def close(self):
+        self._conn.close()
@@ -1,12 +1,57 @@
+import time
 import unittest
-import json
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from bandapi import auth
-from bandapi import config
+from bandapi import ratelimit
+from bandapi import tokens
+from bandapi.config import Config, default_config
+from bandapi.decoding import get_decoder
+from bandapi.metrics import RequestEvent, TimedHTTPAdapter, call_hooks
+from bandapi.mutations import run_bulk
+from bandapi import util
+from bandapi.cache import Unchanged
+from bandapi.paging import paginate
+from bandapi.records import check_output, to_output, to_single_output
+from bandapi.scheduler import WriteScheduler
 
-import pandas as pd
+
+def request_params(kwargs):
+    """
+    Turns endpoint method locals() into request parameters.
+
+    Drops self and arguments left as None.
+    """
+    return {key: value for key, value in kwargs.items()
+            if key != 'self' and value is not None}
+
+
+def parse_result(content_dict):
+    """
+    Gets result_data out of decoded API response.
+
+    Description
+        result_code 1 means success, anything else means fail.
+        On fail, the code is folded into result_data['message']
+        as 'code {result_code}: {message}'.
+
+    Return
+        dict
+    """
+    result_data = content_dict.get('result_data', {})
+
+    # 0 means fail, 1 means success
+    # TODO: error handler for result_code status
+    # maybe just pass result_code onto other method to deal with it?
+    code = int(content_dict['result_code'])
+    if code != 1:
+        msg = result_data['message']
+        msg = f'code {code}: {msg}'
+        result_data['message'] = msg
+
+    return result_data
 
 
 class APIClient:
@@ -16,26 +61,284 @@ class APIClient:
     If any optional argument is None, the arugment will not be
     part of url to request. (Ex. client.get_profile(get_profile=None))
 
-    Limit parameter does not work. ( fixed on 20 always )
+    Limit parameter does not work on band's side ( fixed on 20 always ),
+    so list endpoints (get_posts, get_comments, get_albums, get_photos)
+    page through 'after' cursors and apply limit themselves.
+
+    Every request, including token refresh, goes through one
+    requests.Session so TCP/TLS connections to the API host are
+    kept alive and reused between calls.
     """
 
-    def __init__(self):
+    def __init__(self,
+                 base_url: str = None,
+                 pool_connections: int = 4,
+                 pool_maxsize: int = 16,
+                 connect_timeout: float = 5,
+                 read_timeout: float = 30,
+                 session: requests.Session = None,
+                 rate_limits: ratelimit.RateLimits = None,
+                 max_retries: int = 3,
+                 cache=None,
+                 validators=None,
+                 output: str = 'dataframe',
+                 prefetch: int = 0,
+                 token_manager: tokens.TokenManager = None,
+                 config: Config = None,
+                 decoder='auto',
+                 hooks=None,
+                 metrics=None,
+                 index=None,
+                 ):
         """
         APIClient init.
+
+        Parameter
+            base_url: str
+                API host every endpoint path is joined to.
+                if not base_url, config.api_url.
+
+            pool_connections: int
+                number of hosts to keep connection pools for.
+
+            pool_maxsize: int
+                keep-alive connections kept per host.
+
+            connect_timeout: float
+            read_timeout: float
+                seconds, passed on to every request.
+
+            session: requests.Session
+                if given, used as is instead of a new pooled session.
+
+            rate_limits: ratelimit.RateLimits
+                limiters for read, write and auth requests.
+                if not rate_limits, ratelimit.RateLimits().
+                Pass the same one to clients sharing a quota.
+
+            max_retries: int
+                times a rate limited request is retried after backoff.
+
+            cache: cache.ResponseCache
+                if given, successful get results are served from it
+                until they expire, and writes drop what they change.
+
+            validators: cache.ValidatorStore
+                if given, list pages identical to their last fetch are
+                returned as cache.Unchanged, without being decoded.
+
+            output: str
+                format of get_profile, get_bands and get_posts results,
+                'dataframe', 'dict' or 'record' (see records.py).
+                pandas is only imported for 'dataframe'.
+
+            prefetch: int
+                pages list endpoints read ahead in the background while
+                the caller processes the current one, see paging.paginate.
+
+            token_manager: tokens.TokenManager
+                gives the access token and refreshes it.
+                if not token_manager, tokens.default_manager(config),
+                which every client of the config shares.
+
+            config: config.Config
+                credentials and hosts, read lazily.
+                if not config, config.default_config() (BANDAPI_* env vars).
+                Clients with different Configs coexist in one process.
+
+            decoder: str or decoder
+                json decoder of response bodies, see decoding.py.
+                'auto' uses orjson if installed. 'stream' parses list
+                pages while they download (needs ijson).
+
+            hooks: dict
+                'pre_request' / 'post_request' -> list of callables,
+                called with a metrics.RequestEvent before each
+                api_request is sent and once it is done (or raised).
+                Can also be added to client.hooks later.
+
+            metrics: metrics.Metrics or metrics.OpenTelemetryRecorder
+                if given, records every request, output conversion and
+                token refresh. A new session then also times dns,
+                connect and tls of new connections.
+
+            index: index.SQLiteIndex
+                if given, crawler.Crawler adds what it crawls to it,
+                search_posts / search_comments query it, and deletes
+                remove from it.
+        """
+        self.config = config or default_config()
+        self.base_url = (base_url or self.config.api_url).rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        if session is None:
+            session = util.new_session(pool_connections=pool_connections,
+                                       pool_maxsize=pool_maxsize,
+                                       adapter_class=(HTTPAdapter if metrics is None
+                                                      else TimedHTTPAdapter),
+                                       )
+        self.session = session
+        self.rate_limits = rate_limits or ratelimit.RateLimits()
+        self.max_retries = max_retries
+        self.cache = cache
+        self.validators = validators
+        self.output = check_output(output)
+        self.prefetch = prefetch
+        self.decoder = get_decoder(decoder)
+        self.token_manager = (token_manager
+                              or tokens.default_manager(self.config))
+        self.write_scheduler = None
+
+        self.hooks = {'pre_request': [], 'post_request': []}
+        for name, functions in (hooks or {}).items():
+            if name not in self.hooks:
+                raise ValueError(f'Param hooks keys must be one of {list(self.hooks)}')
+            self.hooks[name].extend(functions)
+        self.metrics = metrics
+        if metrics is not None:
+            self.hooks['post_request'].append(metrics.record)
+            if metrics.on_token_refresh not in self.token_manager.on_refresh:
+                self.token_manager.on_refresh.append(metrics.on_token_refresh)
+        self.index = index
+
+    @property
+    def access_token(self):
+        """
+        Current access token, refreshed ahead of expiry by token_manager.
+        """
+        return self.token_manager.access_token(session=self.session,
+                                               timeout=self.timeout,
+                                               limiter=self.rate_limits['auth'],
+                                               )
+
+    def close(self):
         """
-        self.access_token = auth.get_access_token(refreshed=False)
+        Waits for scheduled writes, then closes every pooled connection.
+        """
+        if self.write_scheduler is not None:
+            self.write_scheduler.shutdown(wait=True)
+        self.session.close()
+
+    def schedule_write(self, method, band_key, *args, **kwargs):
+        """
+        Queues a write call to run when the band's cooldown allows it.
+
+        Parameter
+            method: str
+                write_post, delete_post, write_comment or delete_comment.
+
+            band_key, *args, **kwargs
+                arguments of the method.
+
+        Description
+            Does not block. Writes on different bands are interleaved,
+            see scheduler.WriteScheduler. To change cooldown or what it
+            is kept for, set client.write_scheduler before first use.
+
+        Return
+            concurrent.futures.Future
+                resolves to the method's result_data.
+        """
+        if self.write_scheduler is None:
+            self.write_scheduler = WriteScheduler(self)
+        return self.write_scheduler.submit(method, band_key, *args, **kwargs)
+
+    def bulk_delete_comments(self, comments, max_attempts: int = 3,
+                             on_result=None):
+        """
+        Deletes many comments through the write scheduler.
+
+        Parameter
+            comments: iterable
+                (band_key, post_key, comment_key) tuples, or dicts /
+                records.Record with those fields, ex. items of
+                crawler.Crawler.crawl_comments.
+
+            max_attempts: int
+            on_result: callable
+                see mutations.run_bulk.
+
+        Return
+            mutations.BulkResult
+                a MutationResult per comment and summary().
+        """
+        return run_bulk(self, 'delete_comment', comments,
+                        max_attempts=max_attempts, on_result=on_result)
+
+    def bulk_delete_posts(self, posts, max_attempts: int = 3,
+                          on_result=None):
+        """
+        Deletes many posts through the write scheduler.
+
+        Parameter
+            posts: iterable
+                (band_key, post_key) tuples, or dicts / records.Record.
+
+            max_attempts: int
+            on_result: callable
+                see mutations.run_bulk.
+
+        Return
+            mutations.BulkResult
+        """
+        return run_bulk(self, 'delete_post', posts,
+                        max_attempts=max_attempts, on_result=on_result)
+
+    def bulk_write_comments(self, comments, max_attempts: int = 3,
+                            on_result=None):
+        """
+        Writes many comments through the write scheduler.
+
+        Parameter
+            comments: iterable
+                (band_key, post_key, body) tuples, or dicts with those keys.
+
+            max_attempts: int
+            on_result: callable
+                see mutations.run_bulk.
+
+        Return
+            mutations.BulkResult
+        """
+        return run_bulk(self, 'write_comment', comments,
+                        max_attempts=max_attempts, on_result=on_result)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-    def get(self, url, kwargs):
+    def get(self, url, kwargs, headers=None, stream=False):
         params = {'access_token': self.access_token,
                   **kwargs}
-        return requests.get(url, params=params)
+        return self.session.get(url, params=params, headers=headers,
+                                timeout=self.timeout, stream=stream)
 
-    def post(self, url, kwargs):
+    def post(self, url, kwargs, headers=None, stream=False):
         params = {'access_token': self.access_token,
                   **kwargs}
-        return requests.post(url, data=params)
+        return self.session.post(url, data=params, headers=headers,
+                                 timeout=self.timeout, stream=stream)
 
-    def api_request(self, method, url, kwargs):
+    def decode(self, response, stream=False):
+        """
+        Decodes response body with self.decoder.
+
+        Parameter
+            stream: bool
+                response was sent with stream=True and its body is
+                parsed as it is read, see decoding.StreamingDecoder.
+        """
+        if stream:
+            raw = response.raw
+            raw.decode_content = True  # gzip is undone while reading
+            try:
+                return self.decoder.decode_stream(raw)
+            finally:
+                response.close()
+        return self.decoder.decode(response.content)
+
+    def api_request(self, method, url, kwargs, revalidate=True):
         """
         Does actual band API request.
 
@@ -45,6 +348,25 @@ class APIClient:
 
             url: str
             kwargs: dict
+            revalidate: bool
+                if False, validators are not used for this request.
+
+        Description
+            get requests count against the read limiter, post requests
+            against the write limiter. Rate limited answers (see
+            ratelimit.RATE_LIMIT_CODES) are retried up to max_retries
+            times after backoff, then returned like any failure. A
+            write refused for its band's cooldown (ratelimit.COOLDOWN_CODE)
+            is returned as is, scheduler.WriteScheduler sends it again.
+
+            With a cache, get results come from it while fresh, and
+            every post request invalidates its band / post entries.
+
+            With validators, a list page identical to its last fetch
+            is returned as cache.Unchanged.
+
+            Every call makes a metrics.RequestEvent, passed to the
+            pre_request and post_request hooks.
 
         Raise
             ValueError
@@ -52,6 +374,25 @@ class APIClient:
 
             TODO: check fail cases
         """
+        event = RequestEvent(method.lower(), url, urlsplit(url).path,
+                             request_params(kwargs))
+        call_hooks(self.hooks, 'pre_request', event)
+        try:
+            result_data = self._api_request(method, url, kwargs, event,
+                                            revalidate)
+        except BaseException as e:
+            status = ('unauthorized' if isinstance(e, ConnectionRefusedError)
+                      else 'error')
+            event.finish(status, error=e)
+            call_hooks(self.hooks, 'post_request', event)
+            raise
+        call_hooks(self.hooks, 'post_request', event)
+        return result_data
+
+    def _api_request(self, method, url, kwargs, event, revalidate=True):
+        """
+        api_request, recording what it does in event.
+        """
         method_dict = {
             'get': self.get,
             'post': self.post,
@@ -64,48 +405,146 @@ class APIClient:
             methods = str(list(method_dict.keys()))
             raise ValueError(f'Method must be one of: {methods}')
 
+        is_read = method.lower() == 'get'
+        family = 'read' if is_read else 'write'
+        limiter = self.rate_limits[family]
+        params = request_params(kwargs)
+
+        if is_read and self.cache is not None:
+            result_data = self.cache.lookup(url, params)
+            if result_data is not None:
+                event.finish('cache_hit')
+                return result_data
+
+        validators = self.validators if is_read and revalidate else None
+        headers = None
+        if validators is not None:
+            headers = validators.headers(url, params)
+        # validators hash the whole body, so it is not streamed then
+        stream = is_read and validators is None and self.decoder.streaming
+
         # The reason to have do call separately as a function
         # is to use do_call when request response returned resultcode = 0
         # and try to deal with it before throwing exception.
         def do_call():
-            # request
-            response = send_request(url, kwargs)
+            # request, retried with backoff while rate limited
+            for _ in range(self.max_retries + 1):
+                limiter.acquire()
+                sent_at = time.monotonic()
+                sent = time.perf_counter()
+                response = send_request(url, params, headers=headers,
+                                        stream=stream)
+                reason = response.reason.lower()
 
-            content_str = response._content.decode('utf-8')
+                if validators is not None:
+                    unchanged = validators.unchanged(url, params, response)
+                    if unchanged is not None:
+                        event.add_response(response, sent, 0)
+                        limiter.on_success()
+                        return unchanged, reason, response
 
-            content_dict = json.loads(content_str)
-            reason = response.reason.lower()
+                decode_start = time.perf_counter()
+                content_dict = self.decode(response, stream=stream)
+                event.add_response(response, sent,
+                                   time.perf_counter() - decode_start)
 
-            return content_dict, reason
+                if ratelimit.is_rate_limited(content_dict):
+                    limiter.on_rate_limited(sent_at)
+                    continue
+                if reason == 'ok':
+                    limiter.on_success()
+                break
 
-        content_dict, reason = do_call()
-        if reason == 'ok':
-            result_data = content_dict.get('result_data', {})
-        else:
+            return content_dict, reason, response
+
+        stale_token = self.access_token
+        content_dict, reason, response = do_call()
+        if reason == 'unauthorized':
             # unauthorized -> refresh token and try again.
             #   if fail, throw ConnectionRefusedError
-            if reason == 'unauthorized':
-                self.access_token = auth.get_access_token(refreshed=True)
-                content_dict, reason = do_call()
-                if reason != 'ok':
-                    raise ConnectionRefusedError(
-                        'Invalid access token. \
-                        Try to check if all of env var is correct.')
-                else:
-                    result_data = content_dict.get('result_data', {})
-
-        # 0 means fail, 1 means success
-        # TODO: error handler for result_code status
-        # result_code = content_dict.get('result_code', 0)
-        # maybe just pass result_code onto other method to deal with it?
-        code = int(content_dict['result_code'])
-        if code != 1:
-            msg = result_data['message']
-            msg = f'code {code}: {msg}'
-            result_data['message'] = msg
+            # Workers refused with the same token share one refresh.
+            event.refreshed = True
+            self.token_manager.refresh(stale_token,
+                                       session=self.session,
+                                       timeout=self.timeout,
+                                       limiter=self.rate_limits['auth'],
+                                       )
+            content_dict, reason, response = do_call()
+            if reason != 'ok':
+                raise ConnectionRefusedError(
+                    'Invalid access token. \
+                    Try to check if all of env var is correct.')
+
+        if isinstance(content_dict, Unchanged):
+            event.finish('unchanged')
+            return content_dict
+
+        result_code = int(content_dict['result_code'])
+        succeeded = result_code == 1
+        if succeeded:
+            event.finish('ok', result_code)
+        elif ratelimit.is_rate_limited(content_dict):
+            event.finish('rate_limited', result_code)
+        else:
+            event.finish('failed', result_code)
+        result_data = parse_result(content_dict)
+
+        if validators is not None and succeeded:
+            validators.update(url, params, response, result_data)
+
+        if self.cache is not None:
+            if not is_read:
+                self.cache.invalidate(params.get('band_key'),
+                                      params.get('post_key'))
+            elif succeeded:
+                self.cache.store(url, params, result_data)
 
         return result_data
 
+    def _to_output(self, data, single=False):
+        """
+        to_output / to_single_output, timed for self.metrics.
+        """
+        convert = to_single_output if single else to_output
+        if self.metrics is None:
+            return convert(data, self.output)
+        start = time.perf_counter()
+        data = convert(data, self.output)
+        self.metrics.record_convert(self.output, time.perf_counter() - start)
+        return data
+
+    def _items_page(self, result_data):
+        if isinstance(result_data, Unchanged):
+            return result_data
+        return self._to_output(result_data['items'])
+
+    def _paginate(self, url, kwargs):
+        """
+        Streams a list endpoint with paging.paginate.
+
+        kwargs are the list method's locals(), with after and limit,
+        and revalidate for revalidated endpoints.
+        """
+        kwargs = dict(kwargs)
+        after = kwargs.pop('after')
+        limit = kwargs.pop('limit')
+        revalidate = kwargs.pop('revalidate', True)
+
+        def fetch(after):
+            params = {**kwargs, 'after': after}
+            result_data = self.api_request('get', url, params,
+                                           revalidate=revalidate)
+            if isinstance(result_data, Unchanged):
+                result_data._refetch = lambda: self._items_page(
+                    self.api_request('get', url, params, revalidate=False))
+            return result_data
+
+        return paginate(fetch, self._items_page,
+                        after=after,
+                        limit=limit,
+                        prefetch=self.prefetch,
+                        )
+
     def get_profile(self,
                     band_key: str = None,
                     ):
@@ -121,11 +560,13 @@ class APIClient:
                 if not band_key:
                     columns: [name, profile_image_url, user_key, 
                               is_app_member, message_allowed]
+
+            dict or records.Record instead with output='dict' / 'record'.
         """
         kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2/profile"
+        url = f"{self.base_url}/v2/profile"
         result_data = self.api_request('get', url, kwargs)
-        result_data = pd.DataFrame.from_records(result_data, index=[0])
+        result_data = self._to_output(result_data, single=True)
         return result_data
 
     def get_bands(self,
@@ -136,11 +577,13 @@ class APIClient:
         Return
             pd.DataFrame
                 columns: [band_key, cover, member_count, name]
+
+            list of dict or records.Record with output='dict' / 'record'.
         """
         kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2.1/bands"
+        url = f"{self.base_url}/v2.1/bands"
         result_data = self.api_request('get', url, kwargs)
-        result_data = pd.DataFrame.from_records(result_data['bands'])
+        result_data = self._to_output(result_data['bands'])
         return result_data
 
     def get_posts(self,
@@ -148,41 +591,27 @@ class APIClient:
                   locale: str = 'ko_KR',
                   after: str = None,
                   limit: int = 20,
+                  revalidate: bool = True,
                   ):
         """
         Gets list of posts.
 
         Band API only allows 20 posts to be cralwed per request.
-        "limit" parameter does not work.
+        "limit" parameter of the API does not work, so limit is applied
+        here: pages are requested until limit posts were yielded
+        (None for every post), and the last page is cut to fit.
+
+        Pages are in the client's output format (DataFrame, list of
+        dict or list of records.Record). With validators, a page
+        identical to its last fetch is yielded as cache.Unchanged,
+        unless revalidate is False.
 
         Return
-            dictionary
+            generator of (page, after), see paging.paginate
         """
         kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2/band/posts"
-        result_data = self.api_request('get', url, kwargs)
-
-        result_df = pd.DataFrame.from_records(result_data['items'])
-        after = result_data['paging'].get('next_params', None)
-        if after is not None:
-            after = after['after']
-        
-        if limit is not None and len(result_df) > limit and limit < 20:
-            result_df = result_df.iloc[:limit].copy()
-            
-        yield result_df, after
-
-        while after is not None and (limit is None or len(result_df) < limit):
-            kwargs['after'] = after
-            result_data = self.api_request('get', url, kwargs)
-            result_df = pd.DataFrame.from_records(result_data['items'])
-            #result_df = pd.concat([result_df, new_df])
-
-            after = result_data['paging'].get('next_params', None)
-            if after is not None:
-                after = after['after']
-
-            yield result_df, after
+        url = f"{self.base_url}/v2/band/posts"
+        return self._paginate(url, kwargs)
 
     def get_specific_post(self,
                           band_key: str,
@@ -193,7 +622,7 @@ class APIClient:
             dictionary
         """
         kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2.1/band/post"
+        url = f"{self.base_url}/v2.1/band/post"
         result_data = self.api_request('get', url, kwargs)
 
         return result_data
@@ -224,7 +653,7 @@ class APIClient:
         elif kwargs['do_push'] is False:
             kwargs['do_push'] = 'false'
 
-        url = "https://openapi.band.us/v2.2/band/post/create"
+        url = f"{self.base_url}/v2.2/band/post/create"
         result_data = self.api_request('post', url, kwargs)
         return result_data
 
@@ -234,11 +663,19 @@ class APIClient:
                     ):
         """
         cooldown = 10 seconds
+
+        Return
+            dict
+                {'message': 'success'} if deleted. Otherwise message
+                is 'code {result_code}: {message}', ex. for posts
+                written on the web, which the API cannot delete
+                ('Invalid response'). mutations.parse_message splits it.
         """
         kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2/band/post/remove"
+        url = f"{self.base_url}/v2/band/post/remove"
         result_data = self.api_request('post', url, kwargs)
-        # TODO: when result_data['message'] == 'Invalid response' -> failed to delete
+        if self.index is not None and result_data.get('message') == 'success':
+            self.index.remove_post(post_key)
 
         return result_data
 
@@ -247,12 +684,18 @@ class APIClient:
                      post_key: str,
                      sortby: str = '+created_at',
                      after: str = None,
+                     limit: int = None,
+                     revalidate: bool = True,
                      ):
-        kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2/band/post/comments"
-        result_data = self.api_request('get', url, kwargs)
+        """
+        Gets comments of a post, page by page.
 
-        return result_data
+        Return
+            generator of (page, after), see get_posts
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/band/post/comments"
+        return self._paginate(url, kwargs)
 
     def write_comment(self,
                       band_key: str,
@@ -263,7 +706,7 @@ class APIClient:
         Commenting korean, spaces worked.
         """
         kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2/band/post/comment/create"
+        url = f"{self.base_url}/v2/band/post/comment/create"
         result_data = self.api_request('post', url, kwargs)
 
         return result_data
@@ -279,8 +722,10 @@ class APIClient:
         Tested with comment_key as kwarg, it worked.
         """
         kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2/band/post/comment/remove"
+        url = f"{self.base_url}/v2/band/post/comment/remove"
         result_data = self.api_request('post', url, kwargs)
+        if self.index is not None and result_data.get('message') == 'success':
+            self.index.remove_comment(comment_key)
 
         return result_data
 
@@ -293,12 +738,12 @@ class APIClient:
         pass permisssion = posting,
         return posting -> has posting permission
         """
+        kwargs = locals()  # function param=arg dict
         perm_list = ['posting', 'commenting', 'contents_deletion']
         if permissions not in perm_list:
             raise ValueError(f'Param permissions must be one of {perm_list}')
-        
-        kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2/band/permissions"
+
+        url = f"{self.base_url}/v2/band/permissions"
         result_data = self.api_request('get', url, kwargs)
         has_permission = bool(result_data['permissions'])
 
@@ -307,32 +752,944 @@ class APIClient:
     def get_albums(self,
                    band_key: str,
                    after: str = None,
+                   limit: int = None,
                    ):
-        kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2/band/albums"
-        result_data = self.api_request('get', url, kwargs)
+        """
+        Gets photo albums of a band, page by page.
 
-        return result_data
+        Return
+            generator of (page, after), see get_posts
+        """
+        kwargs = locals()  # function param=arg dict
+        url = f"{self.base_url}/v2/band/albums"
+        return self._paginate(url, kwargs)
 
     def get_photos(self,
                    band_key: str,
                    photo_album_key: str = None,
                    after: str = None,
+                   limit: int = None,
+                   revalidate: bool = True,
                    ):
+        """
+        Gets photos of an album, page by page.
+
+        Return
+            generator of (page, after), see get_posts
+        """
         kwargs = locals()  # function param=arg dict
-        url = "https://openapi.band.us/v2/band/album/photos"
-        result_data = self.api_request('get', url, kwargs)
+        url = f"{self.base_url}/v2/band/album/photos"
+        return self._paginate(url, kwargs)
 
-        return result_data
+    def search_posts(self,
+                     text: str = None,
+                     band_key: str = None,
+                     author_key: str = None,
+                     since=None,
+                     until=None,
+                     limit: int = None,
+                     ):
+        """
+        Finds posts in self.index, newest first. No request is sent.
+
+        Parameter
+            see index.SQLiteIndex.search_posts.
+
+        Raise
+            ValueError
+                if the client has no index.
+
+        Return
+            posts in output format, like a get_posts page.
+        """
+        kwargs = locals()  # function param=arg dict
+        return self._search('search_posts', kwargs)
+
+    def search_comments(self,
+                        text: str = None,
+                        band_key: str = None,
+                        post_key: str = None,
+                        author_key: str = None,
+                        since=None,
+                        until=None,
+                        limit: int = None,
+                        ):
+        """
+        Finds comments in self.index, newest first. No request is sent.
+
+        Sample
+            every comment of user_key in every crawled band
+                client.search_comments(author_key=user_key)
+
+        Return
+            see search_posts.
+        """
+        kwargs = locals()  # function param=arg dict
+        return self._search('search_comments', kwargs)
+
+    def _search(self, method, kwargs):
+        if self.index is None:
+            raise ValueError(f'{method} needs APIClient(index=...)')
+        items = getattr(self.index, method)(**request_params(kwargs))
+        return self._to_output(items)
 
 
 class APIClientTest(unittest.TestCase):
+    """
+    Runs against simulator.BandSimulator, no network needed.
+    """
+
     def setUp(self):
-        self.client = APIClient()
+        from bandapi.simulator import BandSimulator
+
+        self.simulator = BandSimulator(posts_per_band=45, cooldown=0.2)
+        self.simulator.start()
+        self.client = APIClient(config=self.simulator.config(), output='dict')
+
+    def tearDown(self):
+        self.client.close()
+        self.simulator.stop()
 
     def test_get_profile(self):
         self.client.get_profile()
 
+    def test_get_posts_pages(self):
+        band_key = self.simulator.band_keys[0]
+        pages = list(self.client.get_posts(band_key, limit=None))
+        self.assertEqual([len(page) for page, _ in pages], [20, 20, 5])
+        self.assertIsNone(pages[-1][1])
+
+    def test_output_formats(self):
+        from bandapi.records import Record, iter_items
+
+        band_key = self.simulator.band_keys[0]
+        posts = [page for page, _ in self.client.get_posts(band_key, limit=None)]
+        self.assertIsInstance(posts[0][0], dict)
+        self.assertEqual(self.client.get_profile()['user_key'],
+                         self.simulator.accounts[0].user_key)
+        self.assertEqual(self.client.get_bands(), list(self.simulator.bands.values()))
+
+        client = APIClient(config=self.simulator.config(), output='record')
+        profile = client.get_profile()
+        self.assertIsInstance(profile, Record)
+        self.assertEqual(profile.user_key, self.simulator.accounts[0].user_key)
+        self.assertEqual([band.band_key for band in client.get_bands()],
+                         self.simulator.band_keys)
+        records = [page for page, _ in client.get_posts(band_key, limit=None)]
+        self.assertEqual([list(iter_items(page)) for page in records], posts)
+        # items with the same keys share one class
+        first, second = records[0][:2]
+        self.assertEqual(first.post_key, posts[0][0]['post_key'])
+        self.assertIs(type(first), type(second))
+
+        # a post without comments has no latest_comments
+        self.simulator.posts[band_key][0].pop('latest_comments', None)
+        record = next(client.get_posts(band_key))[0][0]
+        with self.assertRaises(AttributeError):
+            record.latest_comments
+        client.close()
+
+        client = APIClient(config=self.simulator.config(), output='dataframe')
+        frame = next(client.get_posts(band_key))[0]
+        self.assertEqual(frame['post_key'].tolist(),
+                         [post['post_key'] for post in posts[0]])
+        self.assertEqual(len(client.get_profile()), 1)
+        client.close()
+
+    def test_decoders(self):
+        import json
+
+        from bandapi import decoding
+        from bandapi.cache import ValidatorStore
+
+        class RawDecoder(decoding.JSONDecoder):
+            # any streaming decoder: reads the undecoded socket body
+            streaming = True
+
+            def __init__(self):
+                self.streamed = 0
+
+            def decode_stream(self, raw):
+                self.streamed += 1
+                return json.load(raw)
+
+        with self.assertRaises(ValueError):
+            get_decoder('yaml')
+        self.assertEqual(get_decoder('auto').name,
+                         'orjson' if decoding.orjson is not None else 'json')
+
+        decoders = ['json', RawDecoder()]
+        if decoding.orjson is not None:
+            decoders.append('orjson')
+        try:
+            decoders.append(decoding.StreamingDecoder(chunk_size=512))
+        except ImportError:  # no ijson
+            pass
+
+        band_key = self.simulator.band_keys[0]
+        post_key = self.simulator.posts[band_key][0]['post_key']
+        expected = None
+        for decoder in decoders:
+            client = APIClient(config=self.simulator.config(), output='dict',
+                               decoder=decoder)
+            pages = ([page for page, _ in client.get_posts(band_key, limit=None)],
+                     [page for page, _ in client.get_comments(band_key, post_key)],
+                     client.get_profile())
+            if expected is None:
+                expected = pages
+            self.assertEqual(pages, expected, client.decoder.name)
+            client.close()
+        # 3 pages of posts, 2 of comments and the profile
+        self.assertEqual(decoders[1].streamed, 6)
+
+        # bodies kept whole for validators are not streamed
+        decoder = RawDecoder()
+        client = APIClient(config=self.simulator.config(), output='dict',
+                           decoder=decoder, validators=ValidatorStore())
+        self.assertEqual(next(client.get_posts(band_key))[0], expected[0][0])
+        self.assertEqual(decoder.streamed, 0)
+        client.close()
+
+    def test_refresh_on_unauthorized(self):
+        self.simulator.accounts[0].rotate(0)  # token rotated elsewhere
+        with self.assertRaises(ValueError):
+            # the client's refresh token was rotated away too
+            self.client.get_profile()
+
+        client = APIClient(config=self.simulator.config(), output='dict')
+        self.simulator.accounts[0].expires_at = 0  # access token expired
+        client.get_profile()
+        self.assertEqual(self.simulator.counts['refresh'], 1)
+        client.close()
+
+    def test_read_rate_adapts(self):
+        limiter = self.client.rate_limits['read']
+        band_key = self.simulator.band_keys[0]
+        for _ in range(10):
+            list(self.client.get_posts(band_key, limit=None))
+        # no refusal yet: the starting rate is not a cap
+        self.assertIsNone(limiter.ceiling)
+        self.assertGreater(limiter.rate, 20)
+
+        limiter.backoff_base = 0.1
+        self.client.max_retries = 10
+        self.simulator.quota_per_second = 2
+        pages = list(self.client.get_posts(band_key, limit=None))
+        self.assertEqual(len(pages), 3)
+        self.assertIsNotNone(limiter.ceiling)
+
+    def test_token_store_processes(self):
+        import os
+        import subprocess
+        import sys
+        import tempfile
+
+        # each process refreshes the token it was given, through the store
+        code = ('import sys\n'
+                'from bandapi import tokens\n'
+                'print(tokens.default_manager().refresh(sys.argv[1]))\n')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        account = self.simulator.accounts[0]
+        self.simulator.latency = 0.3  # refreshes overlap
+
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('token.json', 'token.db'):
+                path = f'{directory}/{name}'
+                stale_token = account.access_token
+                env = dict(os.environ,
+                           PYTHONPATH=root,
+                           BANDAPI_CLIENT_ID='sim',
+                           BANDAPI_CLIENT_SECRET='sim',
+                           BANDAPI_REDIRECT_URL='http://localhost',
+                           BANDAPI_ACCESS_TOKEN=stale_token,
+                           BANDAPI_REFRESH_TOKEN=account.refresh_token,
+                           BANDAPI_API_URL=self.simulator.url,
+                           BANDAPI_AUTH_URL=self.simulator.url,
+                           BANDAPI_TOKEN_FILE=path)
+                refreshed = self.simulator.counts.get('refresh', 0)
+                processes = [subprocess.Popen([sys.executable, '-c', code,
+                                               stale_token],
+                                              env=env, stdout=subprocess.PIPE,
+                                              stderr=subprocess.PIPE, text=True)
+                             for _ in range(3)]
+                outputs = [process.communicate(timeout=60)
+                           for process in processes]
+                self.assertEqual([process.returncode for process in processes],
+                                 [0] * 3, outputs)
+
+                # one refresh, whose token every process took
+                self.assertEqual(self.simulator.counts['refresh'], refreshed + 1)
+                self.assertEqual({out.strip() for out, _ in outputs},
+                                 {account.access_token})
+                store = tokens.open_store(path)
+                self.assertEqual(store.load()['refresh_token'],
+                                 account.refresh_token)
+                if isinstance(store, tokens.SQLiteTokenStore):
+                    store.close()
+
+    def test_async_client(self):
+        import asyncio
+
+        try:
+            from bandapi.async_client import AsyncAPIClient
+        except ImportError:
+            self.skipTest('aiohttp is not installed')
+
+        band_key = self.simulator.band_keys[0]
+        post_key = self.simulator.posts[band_key][0]['post_key']
+
+        async def crawl():
+            async with AsyncAPIClient(config=self.simulator.config(),
+                                      output='dict', prefetch=1) as client:
+                profile = await client.get_profile()
+                pages = [page async for page, _ in
+                         client.get_posts(band_key, limit=None)]
+                comments = [page async for page, _ in
+                            client.get_comments(band_key, post_key)]
+                return profile, pages, comments
+
+        profile, pages, comments = asyncio.run(crawl())
+        self.assertEqual(profile['user_key'],
+                         self.simulator.accounts[0].user_key)
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+        self.assertEqual(sum(map(len, comments)),
+                         len(self.simulator.comments[post_key]))
+
+    def test_async_refresh(self):
+        import asyncio
+
+        try:
+            from bandapi.async_client import AsyncAPIClient
+        except ImportError:
+            self.skipTest('aiohttp is not installed')
+
+        account = self.simulator.accounts[0]
+
+        def token_manager(expires_in):
+            store = tokens.MemoryTokenStore()
+            store.save({'access_token': account.access_token,
+                        'refresh_token': account.refresh_token,
+                        'expires_at': time.time() + expires_in})
+            return tokens.TokenManager(store, refresh_margin=0,
+                                       config=self.simulator.config())
+
+        self.simulator.latency = 0.2
+
+        async def ticker(stop):
+            # longest the event loop was held up
+            longest = 0
+            while not stop.is_set():
+                started = time.monotonic()
+                await asyncio.sleep(0.01)
+                longest = max(longest, time.monotonic() - started)
+            return longest
+
+        async def profiles(client):
+            stop = asyncio.Event()
+            ticking = asyncio.ensure_future(ticker(stop))
+            await asyncio.gather(*[client.get_profile() for _ in range(5)])
+            stop.set()
+            return await ticking
+
+        async def run():
+            # to refresh ahead of time
+            async with AsyncAPIClient(config=self.simulator.config(),
+                                      output='dict',
+                                      token_manager=token_manager(0)) as client:
+                lags = [await profiles(client)]
+                account.expires_at = 0  # refused: refreshed after the fact
+                lags.append(await profiles(client))
+            # expiring while requests queue for the one slot
+            async with AsyncAPIClient(config=self.simulator.config(),
+                                      output='dict', max_concurrency=1,
+                                      token_manager=token_manager(0.3)) as client:
+                lags.append(await profiles(client))
+            return lags
+
+        for lag in asyncio.run(run()):
+            self.assertLess(lag, 0.15)
+        # one refresh ahead of time and one after the refusal
+        self.assertEqual(self.simulator.counts['refresh'], 2)
+        self.assertEqual(self.simulator.counts['unauthorized'], 5)
+
+    def test_checkpoint_resume(self):
+        import itertools
+
+        from bandapi.checkpoint import SQLiteCheckpointStore
+        from bandapi.crawler import Crawler
+        from bandapi.media import album_photos
+
+        store = SQLiteCheckpointStore(':memory:')
+        band_key = self.simulator.band_keys[0]
+        crawler = Crawler(self.client, checkpoint=store)
+
+        posts = crawler.crawl([band_key])
+        next(posts)
+        next(posts)  # the first page is checkpointed
+        posts.close()
+        pages = [page for _, page in crawler.crawl([band_key])]
+        self.assertEqual(sum(len(page) for page in pages), 25)
+        self.assertEqual(list(crawler.crawl([band_key])), [])
+
+        post_keys = [post['post_key'] for post in self.simulator.posts[band_key][:3]]
+        comments = crawler.crawl_comments(post_keys, band_key=band_key)
+        list(itertools.islice(comments, 26))  # the first post is done
+        comments.close()
+        comments = list(crawler.crawl_comments(post_keys, band_key=band_key))
+        self.assertEqual(len(comments), 50)
+
+        photos = album_photos(self.client, [band_key], checkpoint=store)
+        list(itertools.islice(photos, 25))  # the first page is done
+        photos.close()
+        photos = list(album_photos(self.client, [band_key], checkpoint=store))
+        self.assertEqual(len(photos), 40)
+        self.assertEqual(list(album_photos(self.client, [band_key],
+                                           checkpoint=store)), [])
+
+    def test_crawl_close(self):
+        from bandapi.crawler import Crawler
+        from bandapi.simulator import BandSimulator
+
+        with BandSimulator(bands=3, posts_per_band=40, comments_per_post=0) as simulator:
+            client = APIClient(config=simulator.config(), output='dict')
+            crawler = Crawler(client, max_workers=1, max_pending_pages=1)
+            pages = crawler.crawl(simulator.band_keys)
+            next(pages)
+            pages.close()  # the bands queued behind the first are cancelled
+            time.sleep(0.3)
+            # the first band's 2 pages only
+            self.assertEqual(simulator.counts['/v2/band/posts'], 2)
+            client.close()
+
+    def test_crawl_comments_errors(self):
+        from bandapi.crawler import Crawler
+
+        band_key = self.simulator.band_keys[0]
+        post_keys = [post['post_key'] for post in self.simulator.posts[band_key][:2]]
+        crawler = Crawler(self.client)
+        comments = list(crawler.crawl_comments(post_keys + ['deleted'],
+                                               band_key=band_key))
+        self.assertEqual(len(comments), 50)
+        self.assertEqual(list(crawler.comment_errors), [(band_key, 'deleted')])
+        self.assertEqual(crawler.comment_errors[band_key, 'deleted'].code, 60400)
+
+        # a comment the author filter cannot read fails its post only
+        self.simulator.comments[post_keys[0]][0]['author'] = None
+        comments = list(crawler.crawl_comments(post_keys, band_key=band_key,
+                                               author_key='anyone'))
+        self.assertEqual(comments, [])
+        self.assertIsInstance(crawler.comment_errors[band_key, post_keys[0]],
+                              TypeError)
+        self.assertEqual(len(crawler.comment_errors), 1)
+
+    def test_page_error(self):
+        from bandapi.paging import PageError
+
+        with self.assertRaises(PageError) as raised:
+            list(self.client.get_comments(self.simulator.band_keys[0], 'deleted'))
+        self.assertEqual(raised.exception.code, 60400)
+        with self.assertRaises(PageError):
+            list(self.client.get_albums('SIMbandBOGUS'))
+
+    def test_pool_writes(self):
+        from bandapi.pool import ClientPool
+        from bandapi.simulator import BandSimulator
+
+        with BandSimulator(bands=2, posts_per_band=1, comments_per_post=0,
+                           accounts=2, cooldown=0.05) as simulator:
+            pool = ClientPool([simulator.config(0), simulator.config(1)],
+                              output='dict')
+            for client in pool.clients:
+                client.rate_limits = ratelimit.RateLimits(write=1000)
+                client.write_scheduler = WriteScheduler(client, cooldown=0.06)
+            futures = [pool.schedule_write('write_comment', band_key,
+                                           simulator.posts[band_key][0]['post_key'],
+                                           f'comment {i}')
+                       for band_key in simulator.band_keys for i in range(2)]
+            results = [future.result() for future in futures]
+            pool.close()
+
+            self.assertEqual(results, [{'message': 'success'}] * 4)
+            # each band written by the one account it is assigned to
+            authors = {band_key: {comment['author']['user_key']
+                                  for comment in simulator.comments[
+                                      simulator.posts[band_key][0]['post_key']]}
+                       for band_key in simulator.band_keys}
+            self.assertEqual(sorted(len(users) for users in authors.values()), [1, 1])
+            self.assertNotEqual(*authors.values())
+            self.assertNotIn('cooldown', simulator.counts)
+
+    def test_pool_bulk(self):
+        from bandapi.pool import ClientPool
+        from bandapi.simulator import BandSimulator
+
+        with BandSimulator(bands=2, posts_per_band=1, comments_per_post=2,
+                           accounts=2, cooldown=0.05) as simulator:
+            pool = ClientPool([simulator.config(0), simulator.config(1)],
+                              output='dict')
+            for client in pool.clients:
+                client.rate_limits = ratelimit.RateLimits(write=1000)
+                client.write_scheduler = WriteScheduler(client, cooldown=0.06)
+            comments = [comment for post_key in list(simulator.comments)
+                        for comment in simulator.comments[post_key]]
+            missing = dict(comments[0], comment_key='missing')
+            results = pool.bulk_delete_comments(comments + [missing])
+            pool.close()
+
+            summary = results.summary()
+            self.assertEqual((summary['succeeded'], summary['failed']), (4, 1))
+            self.assertEqual(summary['failures'], {60400: 1})
+            self.assertEqual(results.results[-1].attempts, 1)
+            self.assertEqual(sum(map(len, simulator.comments.values())), 0)
+
+    def test_bulk_dead_refresh_token(self):
+        band_key = self.simulator.band_keys[0]
+        post_key = self.simulator.posts[band_key][0]['post_key']
+        comments = [(band_key, post_key, comment['comment_key'])
+                    for comment in self.simulator.comments[post_key][:5]]
+        self.client.write_scheduler = WriteScheduler(self.client, cooldown=0.25)
+        self.simulator.accounts[0].rotate(0)  # both tokens rotated elsewhere
+        with self.assertRaises(ValueError):
+            self.client.bulk_delete_comments(comments)
+        self.client.write_scheduler.shutdown()
+        # failed fast: no retries, queued deletes cancelled
+        self.assertEqual(self.simulator.counts['/oauth2/token'], 1)
+        self.assertEqual(self.simulator.counts['/v2/band/post/comment/remove'], 1)
+
+    def test_sync(self):
+        from bandapi.checkpoint import SQLiteCheckpointStore
+        from bandapi.crawler import Crawler
+
+        band_key = self.simulator.band_keys[0]
+        crawler = Crawler(self.client, checkpoint=SQLiteCheckpointStore(':memory:'))
+        posts = [post for _, page in crawler.sync([band_key]) for post in page]
+        self.assertEqual(len(posts), 45)
+
+        self.client.write_post(band_key, 'new post')
+        posts = [post for _, page in crawler.sync([band_key]) for post in page]
+        self.assertEqual([post['content'] for post in posts], ['new%20post'])
+        self.assertEqual(list(crawler.sync([band_key])), [])
+
+        # as new as the mark, but not seen
+        self.client.write_post(band_key, 'same time')
+        newest = self.simulator.posts[band_key]
+        newest[0]['created_at'] = newest[1]['created_at']
+        posts = [post for _, page in crawler.sync([band_key]) for post in page]
+        self.assertEqual([post['content'] for post in posts], ['same%20time'])
+        self.assertEqual(list(crawler.sync([band_key])), [])
+
+    def test_sync_validators(self):
+        from bandapi.cache import ValidatorStore
+        from bandapi.checkpoint import SQLiteCheckpointStore
+        from bandapi.crawler import Crawler
+
+        client = APIClient(config=self.simulator.config(), output='dict',
+                           validators=ValidatorStore())
+        band_key = self.simulator.band_keys[0]
+        list(client.get_posts(band_key, limit=None))
+        crawler = Crawler(client, checkpoint=SQLiteCheckpointStore(':memory:'))
+        # the first sync lists every post, although no page changed
+        posts = [post for _, page in crawler.sync([band_key]) for post in page]
+        self.assertEqual(len(posts), 45)
+        self.assertIsNotNone(crawler.checkpoint.get('posts_newest', band_key))
+
+        self.assertEqual(list(crawler.sync([band_key])), [])
+        client.write_post(band_key, 'new post')
+        posts = [post for _, page in crawler.sync([band_key]) for post in page]
+        self.assertEqual([post['content'] for post in posts], ['new%20post'])
+        client.close()
+
+    def test_cache_invalidation(self):
+        from bandapi.cache import ResponseCache
+
+        client = APIClient(config=self.simulator.config(), output='dict',
+                           cache=ResponseCache())
+        band_key = self.simulator.band_keys[0]
+        post_key = self.simulator.posts[band_key][0]['post_key']
+        path = '/v2/band/post/comments'
+
+        def count_comments():
+            return sum(len(page) for page, _ in client.get_comments(band_key, post_key))
+
+        self.assertEqual(count_comments(), 25)
+        self.assertEqual(count_comments(), 25)
+        self.assertEqual(self.simulator.counts[path], 2)  # 2 pages, once
+        client.write_comment(band_key, post_key, 'new comment')
+        self.assertEqual(count_comments(), 26)
+        self.assertEqual(self.simulator.counts[path], 4)
+        client.close()
+
+    def test_validators(self):
+        from bandapi.cache import ValidatorStore
+
+        client = APIClient(config=self.simulator.config(), output='dict',
+                           validators=ValidatorStore())
+        band_key = self.simulator.band_keys[0]
+        list(client.get_posts(band_key, limit=None))
+        pages = [page for page, _ in client.get_posts(band_key, limit=None)]
+        self.assertTrue(all(isinstance(page, Unchanged) for page in pages))
+        self.assertEqual([page.count for page in pages], [20, 20, 5])
+        # callers that need the items anyway
+        self.assertEqual(len(pages[1].refetch()), 20)
+        pages = [page for page, _ in client.get_posts(band_key, limit=None,
+                                                      revalidate=False)]
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+
+        client.delete_post(band_key, self.simulator.posts[band_key][0]['post_key'])
+        pages = [page for page, _ in client.get_posts(band_key, limit=None)]
+        # every page shifted by one post
+        self.assertFalse(any(isinstance(page, Unchanged) for page in pages))
+        self.assertEqual([len(page) for page in pages], [20, 20, 4])
+        client.close()
+
+    def test_prefetch(self):
+        from bandapi.simulator import BandSimulator
+
+        client = APIClient(config=self.simulator.config(), output='dict',
+                           prefetch=2)
+        band_key = self.simulator.band_keys[0]
+        self.assertEqual(list(client.get_posts(band_key, limit=None)),
+                         list(self.client.get_posts(band_key, limit=None)))
+
+        client.close()
+
+        with BandSimulator(bands=1, posts_per_band=200) as simulator:
+            client = APIClient(config=simulator.config(), output='dict',
+                               prefetch=2)
+            pages = client.get_posts(simulator.band_keys[0], limit=None)
+            next(pages)
+            time.sleep(0.3)
+            pages.close()  # the read ahead stops with the consumer
+            time.sleep(0.3)
+            # the page taken, 2 waiting and 1 the reader holds, of 10
+            self.assertEqual(simulator.counts['/v2/band/posts'], 4)
+            client.close()
+
+    def test_write_cooldown(self):
+        band_key = self.simulator.band_keys[0]
+        post_key = self.simulator.posts[band_key][0]['post_key']
+        # client side cooldown just over the simulator's
+        self.client.write_scheduler = WriteScheduler(self.client, cooldown=0.25)
+        futures = [self.client.schedule_write('write_comment', band_key,
+                                              post_key, f'comment {i}')
+                   for i in range(2)]
+        results = [future.result() for future in futures]
+        self.assertEqual(results, [{'message': 'success'}] * 2)
+        self.assertNotIn('cooldown', self.simulator.counts)
+
+    def test_write_cooldown_refused(self):
+        band_key = self.simulator.band_keys[0]
+        post_key = self.simulator.posts[band_key][0]['post_key']
+        # client side cooldown shorter than the simulator's
+        self.client.rate_limits = ratelimit.RateLimits(write=1000)
+        self.client.write_scheduler = WriteScheduler(self.client, cooldown=0.05,
+                                                     cooldown_retries=10)
+        futures = [self.client.schedule_write('write_comment', band_key,
+                                              post_key, f'comment {i}')
+                   for i in range(2)]
+        results = [future.result() for future in futures]
+        self.assertEqual(results, [{'message': 'success'}] * 2)
+        self.assertGreater(self.simulator.counts['cooldown'], 0)
+        # one band's cooldown does not slow the other bands' writes
+        self.assertIsNone(self.client.rate_limits['write'].ceiling)
+
+    def test_write_shutdown_nowait(self):
+        band_key = self.simulator.band_keys[0]
+        post_key = self.simulator.posts[band_key][0]['post_key']
+        scheduler = WriteScheduler(self.client, cooldown=10)
+        futures = [scheduler.submit('write_comment', band_key, post_key,
+                                    f'comment {i}')
+                   for i in range(3)]
+        self.assertEqual(futures[0].result(), {'message': 'success'})
+
+        started = time.monotonic()
+        scheduler.shutdown(wait=False)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertFalse(scheduler._dispatcher.is_alive())
+        self.assertTrue(all(future.cancelled() for future in futures[1:]))
+        self.assertEqual(self.simulator.counts['/v2/band/post/comment/create'], 1)
+
+    def test_rate_limited_once(self):
+        limiter = ratelimit.AdaptiveRateLimiter(8, backoff_base=0.01)
+        sent_at = time.monotonic()
+        limiter.acquire()
+        for _ in range(4):  # answers to requests sent at once
+            limiter.on_rate_limited(sent_at)
+        self.assertEqual((limiter.rate, limiter.ceiling), (4, 8))
+
+        limiter.acquire()
+        limiter.on_rate_limited(time.monotonic())  # sent after the cut
+        self.assertEqual((limiter.rate, limiter.ceiling), (2, 4))
+
+    def test_metrics(self):
+        from bandapi.metrics import Metrics
+
+        metrics = Metrics()
+        events = []
+        client = APIClient(config=self.simulator.config(), output='dict',
+                           metrics=metrics,
+                           hooks={'post_request': [events.append]})
+        list(client.get_posts(self.simulator.band_keys[0], limit=None))
+        client.close()
+
+        self.assertEqual([event.status for event in events], ['ok'] * 3)
+        self.assertIn('dns', events[0].timings)  # first request connects
+        self.assertEqual(metrics.counter('bandapi_requests_total',
+                                         endpoint='/v2/band/posts',
+                                         method='get', status='ok'), 3)
+        exported = metrics.to_prometheus()
+        self.assertIn('bandapi_convert_seconds_count{output="dict"} 3',
+                      exported)
+
+    def test_metrics_address_fallback(self):
+        import socket
+        from unittest import mock
+
+        from bandapi.metrics import Metrics
+
+        getaddrinfo = socket.getaddrinfo
+
+        def resolve(host, *args, **kwargs):
+            if host != 'band.test':
+                return getaddrinfo(host, *args, **kwargs)
+            # an address nothing listens on, before the simulator's
+            return (getaddrinfo('127.0.0.2', *args, **kwargs)
+                    + getaddrinfo('127.0.0.1', *args, **kwargs))
+
+        port = urlsplit(self.simulator.url).port
+        client = APIClient(config=self.simulator.config(), output='dict',
+                           base_url=f'http://band.test:{port}', metrics=Metrics())
+        with mock.patch('socket.getaddrinfo', resolve):
+            self.assertEqual(client.get_profile()['user_key'],
+                             self.simulator.accounts[0].user_key)
+        client.close()
+
+    def test_download_photos(self):
+        import tempfile
+
+        from bandapi.media import MediaDownloader, album_photos
+
+        band_keys = self.simulator.band_keys[:1]
+        self.simulator.media_cut = 20000  # of 32768 bytes per photo
+        with tempfile.TemporaryDirectory() as directory:
+            downloader = MediaDownloader(directory, max_attempts=1)
+            report = downloader.download(album_photos(self.client, band_keys))
+            self.assertEqual(len(report.failed), 60)
+
+            self.simulator.media_cut = None
+            report = downloader.download(album_photos(self.client, band_keys))
+            summary = report.summary()
+            # the second album has the first's contents
+            self.assertEqual((summary['resumed'], summary['duplicate']), (30, 30))
+
+            report = downloader.download(album_photos(self.client, band_keys))
+            self.assertEqual(report.summary()['stored'], 60)
+
+    def test_download_photos_validators(self):
+        import tempfile
+
+        from bandapi.cache import ValidatorStore
+        from bandapi.media import MediaDownloader, album_photos
+
+        client = APIClient(config=self.simulator.config(), output='dict',
+                           validators=ValidatorStore(
+                               paths=['/v2/band/albums', '/v2/band/album/photos']))
+        band_keys = self.simulator.band_keys[:1]
+        self.simulator.media_cut = 20000
+        with tempfile.TemporaryDirectory() as directory:
+            downloader = MediaDownloader(directory, max_attempts=1)
+            report = downloader.download(album_photos(client, band_keys))
+            self.assertEqual(len(report.failed), 60)
+
+            # listed again although no page changed since
+            self.simulator.media_cut = None
+            report = downloader.download(album_photos(client, band_keys))
+            summary = report.summary()
+            self.assertEqual(summary['total'], 60)
+            self.assertEqual((summary['resumed'], summary['duplicate']), (30, 30))
+        client.close()
+
+    def test_index(self):
+        from bandapi.cache import ValidatorStore
+        from bandapi.crawler import Crawler
+        from bandapi.index import SQLiteIndex
+
+        client = APIClient(config=self.simulator.config(), output='dict',
+                           validators=ValidatorStore(), index=SQLiteIndex())
+        band_key = self.simulator.band_keys[0]
+        crawler = Crawler(client)
+        comments = list(crawler.crawl_comments(crawler.crawl([band_key])))
+
+        user_key = self.simulator.accounts[0].user_key
+        found = client.search_comments(author_key=user_key)
+        self.assertEqual(len(found), len(comments))
+        self.assertEqual(len(client.search_posts(band_key=band_key)), 45)
+        self.assertEqual(len(client.search_posts(text='post000044')), 1)
+
+        # post pages unchanged since: not indexed again, but their
+        # posts' comments are still crawled
+        crawler = Crawler(client)
+        again = list(crawler.crawl_comments(crawler.crawl([band_key])))
+        self.assertEqual(len(again), len(comments))
+        self.assertEqual(client.index.count('posts'), 45)
+        self.assertEqual(client.index.count('comments'), 45 * 25)
+        client.close()
+
+    def test_dataset_sink(self):
+        import os
+        import tempfile
+
+        try:
+            from bandapi.sink import FORMATS, DatasetSink, read_dataset
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+
+        first, second = self.simulator.band_keys[:2]
+        with tempfile.TemporaryDirectory() as directory:
+            for format in ('parquet', 'arrow'):
+                path = f'{directory}/{format}'
+                with DatasetSink(path, format=format, row_group_size=10) as sink:
+                    sink.consume(self.client.get_posts(first, limit=None),
+                                 band_key=first)
+                table = read_dataset(path, format=format)
+                self.assertEqual(table.column('post_key').to_pylist(),
+                                 [post['post_key']
+                                  for post in self.simulator.posts[first]])
+                self.assertEqual(set(table.column('band_key').to_pylist()),
+                                 {first})
+
+                # a resumed crawl appends after the highest part, also
+                # when a part in the middle was removed
+                os.remove(f'{path}/part-00001{FORMATS[format]}')
+                with DatasetSink(path, format=format, row_group_size=10) as sink:
+                    sink.consume(self.client.get_posts(second, limit=None),
+                                 band_key=second)
+                table = read_dataset(path, format=format)
+                # a part per page of 20 posts
+                self.assertEqual(sorted(os.listdir(path)),
+                                 [f'part-{i:05d}{FORMATS[format]}'
+                                  for i in (0, 2, 3, 4, 5)])
+                self.assertEqual(table.num_rows, 25 + 45)
+                self.assertEqual(table.column('post_key').to_pylist()[-45:],
+                                 [post['post_key']
+                                  for post in self.simulator.posts[second]])
+
+    def test_purge_resume(self):
+        import tempfile
+
+        from bandapi.purge import PurgeCheckpoint, PurgeRunner
+        from bandapi.simulator import BandSimulator
+
+        class Interrupted(Exception):
+            pass
+
+        def interrupt(event, data):
+            if event == 'progress' and data['deleted'] == 3:
+                raise Interrupted()
+
+        def runner(checkpoint, on_progress=None):
+            client = APIClient(config=simulator.config(), output='dict',
+                               rate_limits=ratelimit.RateLimits(write=1000))
+            client.write_scheduler = WriteScheduler(client, cooldown=0.06)
+            return PurgeRunner(client, simulator.accounts[1].user_key,
+                               checkpoint=checkpoint, on_progress=on_progress)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                BandSimulator(bands=2, posts_per_band=4, comments_per_post=2,
+                              accounts=2, cooldown=0.05) as simulator:
+            checkpoint = PurgeCheckpoint(f'{directory}/purge.db')
+            self.assertEqual(runner(checkpoint).plan()['comments'], 8)
+            with self.assertRaises(Interrupted):
+                runner(checkpoint, on_progress=interrupt).run()
+
+            posts = [(band_key, post['post_key'])
+                     for band_key in simulator.band_keys
+                     for post in simulator.posts[band_key]]
+            done = [post for post in posts
+                    if checkpoint.listing.get('comments', *post)]
+            self.assertGreater(len(done), 0)
+
+            # the restart fetches no comment page of a finished post
+            path = '/v2/band/post/comments'
+            fetched = simulator.counts[path]
+            results = runner(checkpoint).run()
+            self.assertLessEqual(simulator.counts[path] - fetched,
+                                 len(posts) - len(done))
+            self.assertFalse(results.failed)
+            # a delete in flight when interrupted is not in the checkpoint
+            self.assertIn(len(results.succeeded), (4, 5))
+            self.assertEqual(sum(map(len, simulator.comments.values())), 8)
+
+            # every band finished: nothing is listed at all
+            listed = simulator.counts['/v2/band/posts']
+            plan = runner(checkpoint).plan()
+            self.assertEqual(plan['comments'], 0)
+            self.assertEqual(simulator.counts['/v2/band/posts'], listed)
+            checkpoint.close()
+
+    def test_purge_token_file(self):
+        import tempfile
+
+        from application.purge import check_token_file, main
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/token.json'
+            with self.assertRaises(ValueError):
+                check_token_file(path)
+            with self.assertRaises(SystemExit):
+                main(['--user-key', 'user', '--token-file', path])
+            open(path, 'w').close()
+            with self.assertRaises(ValueError):
+                check_token_file(path)
+            tokens.FileTokenStore(path).save({'access_token': 'access',
+                                              'refresh_token': 'refresh',
+                                              'expires_at': None})
+            check_token_file(path)
+
+            with self.assertRaises(ValueError):
+                check_token_file(f'{directory}/token.db')
+            tokens.open_store(f'{directory}/token.db').close()  # no tokens yet
+            with self.assertRaises(ValueError):
+                check_token_file(f'{directory}/token.db')
+
+    def test_purge_validators(self):
+        from bandapi.cache import ValidatorStore
+        from bandapi.purge import PurgeRunner
+        from bandapi.simulator import BandSimulator
+
+        with BandSimulator(bands=1, posts_per_band=2, comments_per_post=2,
+                           accounts=2, cooldown=0.05) as simulator:
+            client = APIClient(config=simulator.config(), output='dict',
+                               rate_limits=ratelimit.RateLimits(write=1000),
+                               validators=ValidatorStore())
+            client.write_scheduler = WriteScheduler(client, cooldown=0.06)
+            runner = PurgeRunner(client, simulator.accounts[1].user_key)
+            self.assertEqual(runner.plan()['comments'], 2)
+            results = runner.run()
+            client.close()
+
+            self.assertEqual(len(results.succeeded), 2)
+            self.assertEqual(sum(map(len, simulator.comments.values())), 2)
+            # listed once by plan and once by run, no revalidation
+            self.assertEqual(simulator.counts['/v2/band/posts'], 2)
+
+    def test_purge_listing_errors(self):
+        from bandapi.purge import PurgeRunner
+
+        band_key = self.simulator.band_keys[0]
+        client = APIClient(config=self.simulator.config(), output='dict')
+        events = []
+        runner = PurgeRunner(client, self.simulator.accounts[0].user_key,
+                             on_progress=lambda event, data: events.append((event, data)))
+        plan = runner.plan([band_key, 'SIMbandBOGUS'])
+        self.assertEqual(list(plan['bands']), [band_key])
+        self.assertEqual([(error['band_key'], error['post_key'], error['code'])
+                          for error in plan['listing_errors']],
+                         [('SIMbandBOGUS', None, 60200)])
+        self.assertEqual(events[-1][0], 'listed')
+        self.assertEqual(events[-1][1]['listing_errors'], plan['listing_errors'])
+        client.close()
+
 
 if __name__ == '__main__':
     # unittest.main()
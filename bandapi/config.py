@@ -1,22 +1,159 @@
+"""
+Credentials and hosts of a Band app, read from the environment lazily.
+
+    client = APIClient()  # default_config(), BANDAPI_* env vars
+    client = APIClient(config=Config(client_id='...', client_secret='...',
+                                     access_token='...', refresh_token='...'))
+
+Nothing is read at import time. Every value not given to Config is
+looked up in its env var when it is used, so importing bandapi works
+without them, and one process can hold many Configs (apps, accounts).
+
+The module level names (CLIENT_ID, ACCESS_TOKEN, ...) still work and
+read default_config().
+"""
+
 import base64
 import os
 
 # Make app from https://developers.band.us/develop/myapps/list
-CLIENT_ID = os.environ['BANDAPI_CLIENT_ID']
-CLIENT_SECRET = os.environ['BANDAPI_CLIENT_SECRET']
+# env var and default of each Config field. No default -> required.
+ENV_VARS = {
+    'client_id': ('BANDAPI_CLIENT_ID', None),
+    'client_secret': ('BANDAPI_CLIENT_SECRET', None),
+    'redirect_url': ('BANDAPI_REDIRECT_URL', None),
+    'access_token': ('BANDAPI_ACCESS_TOKEN', ""),
+    'refresh_token': ('BANDAPI_REFRESH_TOKEN', ""),
+    # Hosts, overridable to point the client at a proxy or a local stub.
+    'api_url': ('BANDAPI_API_URL', "https://openapi.band.us"),
+    'auth_url': ('BANDAPI_AUTH_URL', "https://auth.band.us"),
+    # Optional json (or .db SQLite) file the rotated access / refresh
+    # tokens are kept in, shared by every client and process using it
+    # (see tokens.py).
+    'token_file': ('BANDAPI_TOKEN_FILE', ""),
+}
+
+# old module level name -> Config attribute
+_MODULE_NAMES = {
+    'CLIENT_ID': 'client_id',
+    'CLIENT_SECRET': 'client_secret',
+    'CLIENT_REDIRECT_URL': 'redirect_url',
+    'AUTH_SECRET_HEADER': 'auth_secret_header',
+    'ACCESS_TOKEN': 'access_token',
+    'REFRESH_TOKEN': 'refresh_token',
+    'API_URL': 'api_url',
+    'AUTH_URL': 'auth_url',
+    'TOKEN_FILE': 'token_file',
+}
+
 # this is from the web profile but
 # I have no idea where this is used for.
 # This does not work as access_token on actual api call.
 _ACCESS_TOKEN = ""
-CLIENT_REDIRECT_URL = os.environ['BANDAPI_REDIRECT_URL']
-
-# Auth Secret Header (ASH) - Not defined in band doc ( I named it )
-# Used when requesting access token
-_ash = f"{CLIENT_ID}:{CLIENT_SECRET}"
-_ash = bytes(_ash, "utf8")
-_ash = base64.b64encode(_ash)
-_ash = _ash.decode()
-AUTH_SECRET_HEADER = _ash
-
-ACCESS_TOKEN = os.environ.get('BANDAPI_ACCESS_TOKEN', "")
-REFRESH_TOKEN = os.environ.get('BANDAPI_REFRESH_TOKEN', "")
+
+
+def _field(name):
+    return property(lambda self: self._resolve(name))
+
+
+class Config:
+    """
+    Credentials and hosts of one Band app / account.
+
+    Description
+        Each field is the value given to __init__, or else read from
+        its env var (ENV_VARS) every time it is used. A required field
+        whose env var is missing raises KeyError when used, not before.
+    """
+
+    __slots__ = tuple(f'_{name}' for name in ENV_VARS) + ('__weakref__',)
+
+    def __init__(self,
+                 client_id: str = None,
+                 client_secret: str = None,
+                 redirect_url: str = None,
+                 access_token: str = None,
+                 refresh_token: str = None,
+                 api_url: str = None,
+                 auth_url: str = None,
+                 token_file: str = None,
+                 ):
+        """
+        Config init.
+
+        Parameter
+            client_id: str
+            client_secret: str
+            redirect_url: str
+                of the app, see https://developers.band.us/develop/myapps/list
+
+            access_token: str
+            refresh_token: str
+                first token pair, see get_token.py.
+                Rotated pairs go to the token store (tokens.py).
+
+            api_url: str
+            auth_url: str
+                hosts.
+
+            token_file: str
+                token store path, see tokens.default_manager.
+        """
+        for name, value in locals().items():
+            if name in ENV_VARS:
+                setattr(self, f'_{name}', value)
+
+    def _resolve(self, name):
+        value = getattr(self, f'_{name}')
+        if value is not None:
+            return value
+        env_var, default = ENV_VARS[name]
+        if default is None:
+            return os.environ[env_var]
+        return os.environ.get(env_var, default)
+
+    client_id = _field('client_id')
+    client_secret = _field('client_secret')
+    redirect_url = _field('redirect_url')
+    access_token = _field('access_token')
+    refresh_token = _field('refresh_token')
+    api_url = _field('api_url')
+    auth_url = _field('auth_url')
+    token_file = _field('token_file')
+
+    @property
+    def auth_secret_header(self):
+        return auth_secret_header(self.client_id, self.client_secret)
+
+    def __repr__(self):
+        given = [name for name in ENV_VARS
+                 if getattr(self, f'_{name}') is not None]
+        return f'Config(given={given})'
+
+
+def auth_secret_header(client_id, client_secret):
+    """
+    Auth Secret Header (ASH) - Not defined in band doc ( I named it )
+    Used when requesting access token
+    """
+    ash = f"{client_id}:{client_secret}"
+    ash = bytes(ash, "utf8")
+    ash = base64.b64encode(ash)
+    return ash.decode()
+
+
+_default_config = Config()
+
+
+def default_config():
+    """
+    The Config of the BANDAPI_* env vars, used where none is given.
+    """
+    return _default_config
+
+
+def __getattr__(name):
+    # CLIENT_ID, ACCESS_TOKEN, ... read on use, like before but lazily
+    if name in _MODULE_NAMES:
+        return getattr(_default_config, _MODULE_NAMES[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
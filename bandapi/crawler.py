@@ -0,0 +1,531 @@
+"""
+Crawls posts of many bands, and comments of many posts, at once.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+
+from bandapi.cache import Unchanged
+from bandapi.paging import page_size
+from bandapi.records import field_values, iter_items, take, to_record
+
+_DONE = object()
+
+
+class BandProgress:
+    """
+    Crawl progress of one band.
+
+    Attribute
+        band_key: str
+        pages: int
+            pages received so far.
+
+        items: int
+            posts received so far.
+
+        after: str
+            cursor of the next page, None when done.
+
+        done: bool
+        error: Exception
+            set if the band's crawl failed. Other bands go on.
+    """
+
+    def __init__(self, band_key):
+        self.band_key = band_key
+        self.pages = 0
+        self.items = 0
+        self.after = None
+        self.done = False
+        self.error = None
+
+    def __repr__(self):
+        state = 'error' if self.error else 'done' if self.done else 'running'
+        return (f'BandProgress({self.band_key!r}, pages={self.pages}, '
+                f'items={self.items}, {state})')
+
+
+class Crawler:
+    """
+    Fans get_posts out over bands with a bounded pool of threads.
+
+    Each band is paginated by one worker with its own after cursor,
+    and pages are streamed back as they arrive, so a full account crawl
+    takes about as long as its slowest band.
+
+    Sample
+        crawler = Crawler(client)
+        for band_key, post_df in crawler.crawl():
+            ...
+        crawler.progress  # {band_key: BandProgress}
+        crawler.comment_errors  # {(band_key, post_key): Exception}
+
+    With a checkpoint store (see checkpoint.py), the cursor of every
+    page is saved once the consumer asks for the next item, and the next
+    crawl resumes each band from there. Bands crawled to the end are
+    skipped until their checkpoint is deleted. crawl_comments marks each
+    post whose comments were consumed under ('comments', band_key,
+    post_key), and skips marked posts without a request.
+
+    With an index (see index.py), every post and comment crawled is
+    added to it as it arrives.
+
+    With validators on the client (see cache.ValidatorStore), crawl
+    yields pages unchanged since their last fetch as cache.Unchanged,
+    for callers that handled them then. crawl_comments needs the
+    items, so it fetches such pages again.
+    """
+
+    def __init__(self,
+                 client,
+                 max_workers: int = 8,
+                 max_pending_pages: int = 64,
+                 checkpoint=None,
+                 index=None,
+                 revalidate: bool = True,
+                 ):
+        """
+        Crawler init.
+
+        Parameter
+            client: APIClient
+                shared by every worker. Its pool_maxsize should be
+                at least max_workers.
+
+            max_workers: int
+                bands crawled at once.
+
+            max_pending_pages: int
+                pages buffered for the consumer before workers wait.
+
+            checkpoint: checkpoint.FileCheckpointStore
+                or checkpoint.SQLiteCheckpointStore, to resume from.
+
+            index: index.SQLiteIndex
+                if not index, client.index if the client has one.
+
+            revalidate: bool
+                if False, crawl fetches every page whole, also with
+                validators, and never yields cache.Unchanged.
+        """
+        self.client = client
+        self.max_workers = max_workers
+        self.max_pending_pages = max_pending_pages
+        self.checkpoint = checkpoint
+        self.index = index if index is not None else getattr(client, 'index', None)
+        self.revalidate = revalidate
+        self.progress = {}
+        self.comment_errors = {}
+
+    def crawl(self,
+              band_keys=None,
+              limit: int = None,
+              on_progress=None,
+              ):
+        """
+        Crawls posts of every band in band_keys.
+
+        Parameter
+            band_keys: iterable of str
+                if not band_keys, every band of client.get_bands().
+
+            limit: int
+                passed on to client.get_posts, None for all posts.
+
+            on_progress: callable
+                called with BandProgress after every page.
+
+        Return
+            generator of (band_key, page)
+                page as yielded by client.get_posts, in arrival order.
+        """
+        band_keys = self._band_keys(band_keys)
+        self.progress = {band_key: BandProgress(band_key)
+                         for band_key in band_keys}
+
+        start_after = {}
+        for band_key in band_keys:
+            saved = None
+            if self.checkpoint is not None:
+                saved = self.checkpoint.get('posts', band_key)
+            if saved is None:
+                start_after[band_key] = None
+            elif saved['done']:
+                self.progress[band_key].done = True
+            else:
+                start_after[band_key] = saved['after']
+                self.progress[band_key].after = saved['after']
+
+        def band_pages(band_key):
+            return self.client.get_posts(band_key,
+                                         after=start_after[band_key],
+                                         limit=limit,
+                                         revalidate=self.revalidate,
+                                         )
+
+        def on_page_done(band_key, page, after):
+            if self.checkpoint is not None:
+                self.checkpoint.set('posts', band_key, after,
+                                    done=after is None)
+
+        return self._fan_out(list(start_after), band_pages,
+                             on_page_done=on_page_done,
+                             on_progress=on_progress,
+                             )
+
+    def sync(self,
+             band_keys=None,
+             on_progress=None,
+             ):
+        """
+        Crawls only posts newer than the last sync of each band.
+
+        Description
+            Needs a checkpoint store, where the newest created_at of
+            each band, with the post_keys of that created_at, is kept as
+            high-water mark under endpoint 'posts_newest'. A post is new
+            if it is newer, or as new and not one of those post_keys.
+
+            Posts come newest first, so pagination stops at the first
+            page holding an already seen post, and only unseen posts are
+            yielded. A band with nothing new costs one request, which
+            with validators is not decoded again. The first sync of a
+            band fetches its pages whole, also with validators.
+
+            The mark moves once every new page of the band was consumed,
+            so an interrupted sync yields the same posts again next time.
+            The first sync of a band crawls all of it.
+
+        Parameter
+            band_keys: iterable of str
+                if not band_keys, every band of client.get_bands().
+
+            on_progress: callable
+                called with BandProgress after every page.
+
+        Return
+            generator of (band_key, page)
+                page holds new posts only. Bands with nothing new
+                yield nothing.
+        """
+        if self.checkpoint is None:
+            raise ValueError('sync needs Crawler(checkpoint=...)')
+
+        band_keys = self._band_keys(band_keys)
+        self.progress = {band_key: BandProgress(band_key)
+                         for band_key in band_keys}
+        newest = {}
+
+        def band_pages(band_key):
+            saved = self.checkpoint.get('posts_newest', band_key)
+            mark = saved['mark'] if saved is not None else None
+
+            seen_keys = set(_mark_keys(mark))
+            pages = self.client.get_posts(band_key, limit=None,
+                                          revalidate=mark is not None)
+            for number, (page, after) in enumerate(pages):
+                if isinstance(page, Unchanged):
+                    if number == 0:
+                        # same newest page as last time, nothing new
+                        return
+                    page = page.refetch()
+
+                created = field_values(page, 'created_at')
+                post_keys = field_values(page, 'post_key')
+                if band_key not in newest and created:
+                    top = max(created)
+                    keys = {post_key for post_key, created_at
+                            in zip(post_keys, created) if created_at == top}
+                    if mark is not None and top == mark['created_at']:
+                        keys |= seen_keys
+                    newest[band_key] = {'created_at': int(top),
+                                        'post_keys': sorted(keys)}
+
+                if mark is None:
+                    new_page = page
+                else:
+                    new_page = take(page, [
+                        i for i, (created_at, post_key)
+                        in enumerate(zip(created, post_keys))
+                        if created_at > mark['created_at']
+                        or (created_at == mark['created_at']
+                            and post_key not in seen_keys)])
+                seen = len(new_page) < len(page)
+
+                if len(new_page):
+                    yield new_page, None if seen else after
+                if seen:
+                    return
+
+        def on_band_done(band_key):
+            if band_key in newest:
+                self.checkpoint.set('posts_newest', band_key, None,
+                                    done=True, mark=newest[band_key])
+
+        return self._fan_out(band_keys, band_pages,
+                             on_band_done=on_band_done,
+                             on_progress=on_progress,
+                             )
+
+    def crawl_comments(self,
+                       posts,
+                       band_key: str = None,
+                       author_key: str = None,
+                       ):
+        """
+        Fetches every comment page of many posts concurrently.
+
+        Parameter
+            posts: iterable
+                any of
+                    (band_key, page) as crawl / sync yield
+                    (page, after) as client.get_posts yields, with band_key
+                    post_key str, with band_key
+
+            band_key: str
+                band of posts when posts do not carry it.
+
+            author_key: str
+                if given, only comments whose author['user_key'] is
+                author_key are yielded. An index still gets every
+                comment.
+
+        Description
+            posts is read lazily, so comments come while posts are still
+            being crawled. Post items without latest_comments (and
+            comment_count 0) are skipped without a request. Post pages
+            that are cache.Unchanged are fetched again for their items.
+
+            Each post's comment pages are followed to the end on the
+            worker pool, at most max_workers posts at once. They are
+            fetched whole, also with validators, so every comment is
+            yielded.
+
+            With a checkpoint store, a post is checkpointed as done once
+            the consumer asks for the comment after its last one, and
+            posts done before are skipped.
+
+            A post whose comments cannot be fetched (ex. deleted
+            meanwhile) yields none, and its error is kept in
+            comment_errors[(band_key, post_key)]. Other posts go on.
+
+        Return
+            generator of comment
+                dict, or records.Record if the client's output is 'record',
+                with band_key and post_key set. Comments of one post come
+                together, posts in completion order.
+        """
+        self.comment_errors = {}
+        results = queue.Queue(maxsize=self.max_pending_pages)
+        slots = threading.Semaphore(self.max_workers * 2)
+        stop = threading.Event()
+
+        def put(item):
+            # gives up once the consumer stopped iterating
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch(post_band_key, post_key):
+            comments = []
+            try:
+                pages = self.client.get_comments(post_band_key, post_key,
+                                                 revalidate=False)
+                for page, _after in pages:
+                    for comment in iter_items(page):
+                        comment.setdefault('band_key', post_band_key)
+                        comment.setdefault('post_key', post_key)
+                        comments.append(comment)
+                if self.index is not None:
+                    self.index.add_comments(comments)
+                if author_key is not None:
+                    comments = [comment for comment in comments
+                                if comment['author']['user_key'] == author_key]
+            except Exception as e:
+                # every post gives the consumer a result, or it waits forever
+                comments = e
+            put((post_band_key, post_key, comments))
+
+        def done_before(post_band_key, post_key):
+            if self.checkpoint is None:
+                return False
+            saved = self.checkpoint.get('comments', post_band_key, post_key)
+            return saved is not None and saved['done']
+
+        def submit_all():
+            submitted = 0
+            try:
+                for post_band_key, post_key in _posts_with_comments(posts, band_key):
+                    if done_before(post_band_key, post_key):
+                        continue
+                    while not slots.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    executor.submit(fetch, post_band_key, post_key)
+                    submitted += 1
+            except Exception as e:
+                put(e)
+            put((_DONE, submitted))
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                      thread_name_prefix='bandapi-comments',
+                                      )
+        producer = threading.Thread(target=submit_all,
+                                    name='bandapi-comments-posts',
+                                    daemon=True,
+                                    )
+        as_record = self.client.output == 'record'
+        try:
+            producer.start()
+            received = 0
+            submitted = None
+            while submitted is None or received < submitted:
+                item = results.get()
+                if isinstance(item, tuple) and item[0] is _DONE:
+                    submitted = item[1]
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                received += 1
+                slots.release()
+                post_band_key, post_key, comments = item
+                if isinstance(comments, Exception):
+                    self.comment_errors[post_band_key, post_key] = comments
+                    continue
+                for comment in comments:
+                    yield to_record(comment) if as_record else comment
+                if self.checkpoint is not None:
+                    self.checkpoint.set('comments', post_band_key, None,
+                                        done=True, parent_key=post_key)
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _band_keys(self, band_keys):
+        if band_keys is None:
+            band_keys = field_values(self.client.get_bands(), 'band_key')
+        return list(band_keys)
+
+    def _fan_out(self,
+                 band_keys,
+                 band_pages,
+                 on_page_done=None,
+                 on_band_done=None,
+                 on_progress=None,
+                 ):
+        """
+        Drains band_pages(band_key) of every band on the worker pool.
+
+        Parameter
+            band_pages: callable
+                band_key -> iterator of (page, after).
+
+            on_page_done: callable
+                (band_key, page, after), called in the consumer's thread
+                once the consumer asks for the item after page.
+
+            on_band_done: callable
+                (band_key), called in the consumer's thread once every
+                page of the band was consumed without error.
+
+        Return
+            generator of (band_key, page)
+        """
+        if not band_keys:
+            return
+
+        pages = queue.Queue(maxsize=self.max_pending_pages)
+        stop = threading.Event()
+
+        def put(item):
+            # gives up once the consumer stopped iterating
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def crawl_band(band_key):
+            progress = self.progress[band_key]
+            try:
+                for page, after in band_pages(band_key):
+                    if not put((band_key, page, after)):
+                        return
+            except Exception as e:
+                progress.error = e
+            put((band_key, _DONE, None))
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                      thread_name_prefix='bandapi-crawl',
+                                      )
+        try:
+            for band_key in band_keys:
+                executor.submit(crawl_band, band_key)
+
+            running = len(band_keys)
+            while running:
+                band_key, page, after = pages.get()
+                progress = self.progress[band_key]
+                if page is _DONE:
+                    running -= 1
+                    progress.done = progress.error is None
+                    if progress.done and on_band_done is not None:
+                        on_band_done(band_key)
+                else:
+                    progress.pages += 1
+                    progress.items += page_size(page)
+                    progress.after = after
+                    if self.index is not None and not isinstance(page, Unchanged):
+                        self.index.add_posts(page, band_key)
+                if on_progress is not None:
+                    on_progress(progress)
+                if page is not _DONE:
+                    yield band_key, page
+                    if on_page_done is not None:
+                        on_page_done(band_key, page, after)
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _mark_keys(mark):
+    # marks saved before post_keys was kept hold one post_key
+    if mark is None:
+        return []
+    return mark.get('post_keys') or [mark['post_key']]
+
+
+def _has_comments(post):
+    # posts without comments come without latest_comments
+    return bool(post.get('latest_comments') or post.get('comment_count'))
+
+
+def _posts_with_comments(posts, band_key):
+    """
+    Flattens the posts argument of Crawler.crawl_comments
+    into (band_key, post_key) of posts that have comments.
+    """
+    for entry in posts:
+        if isinstance(entry, str):
+            yield band_key, entry
+            continue
+
+        first, second = entry
+        if isinstance(first, str):
+            page_band_key, page = first, second
+        else:
+            page_band_key, page = band_key, first
+        if isinstance(page, Unchanged):
+            page = page.refetch()
+
+        for post in iter_items(page):
+            if _has_comments(post):
+                yield post.get('band_key', page_band_key), post['post_key']
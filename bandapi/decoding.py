@@ -0,0 +1,109 @@
+"""
+JSON decoders of API response bodies.
+
+    client = APIClient(decoder='auto')    # orjson if installed, else json
+    client = APIClient(decoder='stream')  # parse while downloading, ijson
+
+A decoder is any object with
+    decode(body: bytes) -> dict
+    streaming: bool
+        if True, also decode_stream(raw) -> dict, raw being the
+        undecoded file-like body (requests' response.raw).
+
+Bodies are parsed from bytes as received, never copied into a str first.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DECODERS = ('auto', 'json', 'orjson', 'stream')
+
+
+class JSONDecoder:
+    """
+    Standard library json.
+    """
+
+    name = 'json'
+    streaming = False
+
+    def decode(self, body):
+        return json.loads(body)
+
+
+class OrjsonDecoder:
+    """
+    orjson, several times faster than json on big pages.
+    """
+
+    name = 'orjson'
+    streaming = False
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('decoder orjson needs orjson: pip install orjson')
+
+    def decode(self, body):
+        return orjson.loads(body)
+
+
+class StreamingDecoder:
+    """
+    ijson, parses the body while it is read from the socket.
+
+    Description
+        The whole body is never held in memory next to its decoded
+        dict, which saves about the body's size in peak memory per
+        response. Worth it for very large items arrays only: it is
+        slower than json, and orjson's smaller objects often save as
+        much (see benchmark/bench_decode.py).
+
+        Responses that need their bytes whole (ex. with
+        cache.ValidatorStore) are decoded with decode as usual.
+    """
+
+    name = 'stream'
+    streaming = True
+
+    def __init__(self, chunk_size: int = 64 * 1024):
+        try:
+            import ijson
+        except ImportError:
+            raise ImportError('decoder stream needs ijson: pip install ijson')
+        self._ijson = ijson
+        self.chunk_size = chunk_size
+        self._fallback = OrjsonDecoder() if orjson is not None else JSONDecoder()
+
+    def decode(self, body):
+        return self._fallback.decode(body)
+
+    def decode_stream(self, raw):
+        return next(self._ijson.items(raw, '', use_float=True,
+                                      buf_size=self.chunk_size))
+
+
+def get_decoder(decoder='auto'):
+    """
+    Gets a decoder by name, or returns decoder as is if it is one.
+
+    Parameter
+        decoder: str or decoder
+            'auto': orjson if installed, else json.
+            'json', 'orjson' or 'stream'.
+    """
+    if not isinstance(decoder, str):
+        return decoder
+    if decoder not in DECODERS:
+        raise ValueError(f'Param decoder must be one of {list(DECODERS)}')
+
+    if decoder == 'auto':
+        return OrjsonDecoder() if orjson is not None else JSONDecoder()
+    if decoder == 'orjson':
+        return OrjsonDecoder()
+    if decoder == 'stream':
+        return StreamingDecoder()
+    return JSONDecoder()
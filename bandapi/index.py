@@ -0,0 +1,299 @@
+"""
+Local search index of crawled posts and comments, in SQLite.
+
+    index = SQLiteIndex('band.db')
+    client = APIClient(index=index)
+    for _ in Crawler(client).crawl_comments(Crawler(client).crawl()):
+        pass
+    client.search_comments(author_key=user_key)  # every band, no request
+
+Posts and comments are kept by key with their band_key, post_key,
+author user_key and created_at indexed, and their text in an FTS5
+table. Adding an item again updates it, so crawls and syncs can be fed
+in as often as they run.
+"""
+
+import datetime
+import json
+import sqlite3
+import threading
+
+from bandapi.cache import Unchanged
+from bandapi.records import iter_items
+
+# item fields kept in columns, besides the whole item as json
+_TABLES = {
+    'posts': ('post_key', ('band_key', 'author_key', 'created_at')),
+    'comments': ('comment_key', ('band_key', 'post_key', 'author_key',
+                                 'created_at')),
+}
+
+
+def _tokenizer(conn):
+    # trigram matches any substring, which word tokenizers do not do
+    # for Korean (particles are written onto words); SQLite >= 3.34
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.probe USING fts5(x, tokenize='trigram')")
+        conn.execute('DROP TABLE temp.probe')
+        return 'trigram'
+    except sqlite3.OperationalError:
+        return 'unicode61'
+
+
+def _millis(value):
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp() * 1000)
+    return value
+
+
+def _content(item):
+    # posts have content, comment pages content, latest_comments body
+    return item.get('content') or item.get('body') or ''
+
+
+class SQLiteIndex:
+    """
+    Posts and comments in a SQLite database, with FTS5 text search.
+
+    Description
+        Safe to share between threads: the crawler's workers add
+        comments while its consumer adds posts.
+    """
+
+    def __init__(self, path=':memory:'):
+        """
+        SQLiteIndex init.
+
+        Parameter
+            path: str
+                database file, ':memory:' for an index of this process only.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self.tokenizer = _tokenizer(self._conn)
+            for table, (key, columns) in _TABLES.items():
+                column_defs = ''.join(f'{column} {"INTEGER" if column == "created_at" else "TEXT"},\n'
+                                      for column in columns)
+                self._conn.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        id INTEGER PRIMARY KEY,
+                        {key} TEXT NOT NULL UNIQUE,
+                        {column_defs}
+                        content TEXT NOT NULL,
+                        item TEXT NOT NULL
+                    )''')
+                for column in columns:
+                    if column != 'created_at':
+                        self._conn.execute(
+                            f'CREATE INDEX IF NOT EXISTS {table}_{column} '
+                            f'ON {table} ({column}, created_at)')
+                self._conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS {table}_created_at '
+                    f'ON {table} (created_at)')
+
+                # external content fts table, kept in step by triggers
+                self._conn.execute(f'''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+                        content, content='{table}', content_rowid='id',
+                        tokenize='{self.tokenizer}'
+                    )''')
+                self._conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {table} BEGIN
+                        INSERT INTO {table}_fts (rowid, content)
+                        VALUES (new.id, new.content);
+                    END''')
+                self._conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {table} BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, content)
+                        VALUES ('delete', old.id, old.content);
+                    END''')
+                self._conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE ON {table} BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, content)
+                        VALUES ('delete', old.id, old.content);
+                        INSERT INTO {table}_fts (rowid, content)
+                        VALUES (new.id, new.content);
+                    END''')
+
+    def close(self):
+        self._conn.close()
+
+    def add_posts(self, page, band_key: str = None):
+        """
+        Adds or updates the posts of page.
+
+        Parameter
+            page: page of any output format, or iterable of post dicts.
+                cache.Unchanged pages are skipped.
+
+            band_key: str
+                band of posts that do not carry it.
+
+        Return
+            int
+                posts added or updated.
+        """
+        if isinstance(page, Unchanged):
+            return 0
+        rows = []
+        for post in iter_items(page):
+            rows.append((post['post_key'], post.get('band_key', band_key),
+                         (post.get('author') or {}).get('user_key'),
+                         post.get('created_at'), _content(post),
+                         json.dumps(post, ensure_ascii=False, default=str)))
+        return self._upsert('posts', rows)
+
+    def add_comments(self, comments, band_key: str = None, post_key: str = None):
+        """
+        Adds or updates comments.
+
+        Parameter
+            comments: page of any output format, or iterable of comment
+                dicts / records.Record, ex. as Crawler.crawl_comments yields.
+                cache.Unchanged pages are skipped.
+
+            band_key: str
+            post_key: str
+                of comments that do not carry them.
+
+        Return
+            int
+                comments added or updated.
+        """
+        if isinstance(comments, Unchanged):
+            return 0
+        rows = []
+        for comment in iter_items(comments):
+            rows.append((comment['comment_key'],
+                         comment.get('band_key', band_key),
+                         comment.get('post_key', post_key),
+                         (comment.get('author') or {}).get('user_key'),
+                         comment.get('created_at'), _content(comment),
+                         json.dumps(comment, ensure_ascii=False, default=str)))
+        return self._upsert('comments', rows)
+
+    def _upsert(self, table, rows):
+        if not rows:
+            return 0
+        key, columns = _TABLES[table]
+        names = (key, *columns, 'content', 'item')
+        updates = ', '.join(f'{name} = excluded.{name}' for name in names[1:])
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f'INSERT INTO {table} ({", ".join(names)}) '
+                f'VALUES ({", ".join("?" * len(names))}) '
+                f'ON CONFLICT ({key}) DO UPDATE SET {updates}',
+                rows)
+        return len(rows)
+
+    def remove_post(self, post_key: str):
+        """
+        Removes a post and its comments.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM comments WHERE post_key = ?', (post_key,))
+            self._conn.execute('DELETE FROM posts WHERE post_key = ?', (post_key,))
+
+    def remove_comment(self, comment_key: str):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM comments WHERE comment_key = ?',
+                               (comment_key,))
+
+    def search_posts(self,
+                     text: str = None,
+                     band_key: str = None,
+                     author_key: str = None,
+                     since=None,
+                     until=None,
+                     limit: int = None,
+                     ):
+        """
+        Finds posts, newest first.
+
+        Parameter
+            text: str
+                substring of the content. Matched as is, not as an FTS5
+                query.
+
+            band_key: str
+            author_key: str
+                author's user_key.
+
+            since, until: int or datetime.datetime
+                created_at range, milliseconds since epoch as the API
+                gives them. since is inclusive, until exclusive.
+
+            limit: int
+
+        Return
+            list of dict
+                the items as they were added.
+        """
+        return self._search('posts', text, limit, band_key=band_key,
+                            author_key=author_key, since=since, until=until)
+
+    def search_comments(self,
+                        text: str = None,
+                        band_key: str = None,
+                        post_key: str = None,
+                        author_key: str = None,
+                        since=None,
+                        until=None,
+                        limit: int = None,
+                        ):
+        """
+        Finds comments, newest first. See search_posts.
+        """
+        return self._search('comments', text, limit, band_key=band_key,
+                            post_key=post_key, author_key=author_key,
+                            since=since, until=until)
+
+    def _search(self, table, text, limit, since=None, until=None, **equal):
+        where = []
+        args = []
+        for column, value in equal.items():
+            if value is not None:
+                where.append(f'{table}.{column} = ?')
+                args.append(value)
+        if since is not None:
+            where.append(f'{table}.created_at >= ?')
+            args.append(_millis(since))
+        if until is not None:
+            where.append(f'{table}.created_at < ?')
+            args.append(_millis(until))
+
+        source = table
+        if text:
+            if self.tokenizer == 'trigram' and len(text) < 3:
+                # shorter than a trigram, scanned instead
+                where.append(f"{table}.content LIKE ? ESCAPE '\\'")
+                args.append('%' + text.replace('\\', '\\\\').replace('%', '\\%')
+                            .replace('_', '\\_') + '%')
+            else:
+                source = f'{table}_fts JOIN {table} ON {table}.id = {table}_fts.rowid'
+                where.append(f'{table}_fts MATCH ?')
+                args.append('"' + text.replace('"', '""') + '"')
+
+        sql = f'SELECT {table}.item FROM {source}'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {table}.created_at DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            args.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self, table: str = 'comments'):
+        """
+        Items in table, 'posts' or 'comments'.
+        """
+        if table not in _TABLES:
+            raise ValueError(f'Param table must be one of {list(_TABLES)}')
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
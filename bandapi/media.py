@@ -0,0 +1,479 @@
+"""
+Downloads album photos to disk.
+
+    downloader = MediaDownloader('archive')
+    report = downloader.download(album_photos(client))
+    print(report.summary())
+
+Photos are fetched concurrently over one pooled session and written in
+chunks, so no file is ever held in memory whole. Each is stored at
+{directory}/{band_key}/{photo_album_key}/{photo_key}{ext}:
+
+    - a photo whose file exists is not requested again, so a re-run
+      only fetches what is missing;
+    - a download cut off midway is kept as {file}.part and resumed with
+      a Range request, within the run or by the next one;
+    - a photo with the same content as one stored before is replaced
+      by a hard link to it. Content hashes are kept in
+      {directory}/.media.json.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+import hashlib
+import json
+import os
+import posixpath
+import queue
+import re
+import shutil
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from bandapi import util
+from bandapi.cache import Unchanged
+from bandapi.records import iter_items
+
+MANIFEST_NAME = '.media.json'
+
+# results saved to the manifest between two writes of it
+MANIFEST_EVERY = 100
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-\d+/(\d+|\*)$')
+
+
+def album_photos(client, band_keys=None, checkpoint=None):
+    """
+    Lists the photos of every album of every band.
+
+    Parameter
+        client: client.APIClient or pool.ClientPool
+        band_keys: iterable of str
+            if not band_keys, every band of client.get_bands().
+
+        checkpoint: checkpoint.FileCheckpointStore
+            or checkpoint.SQLiteCheckpointStore. The cursors of
+            ('albums', band_key) and ('photos', band_key,
+            photo_album_key) are saved once the photos of a page were
+            consumed, and the next listing resumes from them. Bands and
+            albums listed to the end are skipped.
+
+    Return
+        generator of dict
+            photo items with band_key set, read page by page. Pages are
+            listed whole also with validators (see cache.ValidatorStore):
+            a photo listed before may still have to be downloaded.
+    """
+    if band_keys is None:
+        band_keys = [band['band_key'] for band in iter_items(client.get_bands())]
+    for band_key in band_keys:
+        saved = checkpoint.get('albums', band_key) if checkpoint is not None else None
+        if saved is not None and saved['done']:
+            continue
+        start = saved['after'] if saved is not None else None
+        for albums, after in client.get_albums(band_key, after=start):
+            if isinstance(albums, Unchanged):
+                albums = albums.refetch()
+            for album in iter_items(albums):
+                yield from _photos(client, band_key, album['photo_album_key'],
+                                   checkpoint)
+            if checkpoint is not None:
+                checkpoint.set('albums', band_key, after, done=after is None)
+
+
+def _photos(client, band_key, album_key, checkpoint):
+    saved = (checkpoint.get('photos', band_key, album_key)
+             if checkpoint is not None else None)
+    if saved is not None and saved['done']:
+        return
+    start = saved['after'] if saved is not None else None
+    for photos, after in client.get_photos(band_key, album_key, after=start,
+                                           revalidate=False):
+        for photo in iter_items(photos):
+            photo.setdefault('band_key', band_key)
+            photo.setdefault('photo_album_key', album_key)
+            yield photo
+        if checkpoint is not None:
+            checkpoint.set('photos', band_key, after, done=after is None,
+                           parent_key=album_key)
+
+
+class MediaResult:
+    """
+    Outcome of one photo.
+
+    Attribute
+        photo_key: str
+        url: str
+        path: str
+        status: str
+            'downloaded', 'resumed' (a .part file was continued),
+            'stored' (the file existed, no request sent),
+            'duplicate' (linked to a stored file of the same content or
+            url) or 'failed'.
+
+        bytes: int
+            body bytes transferred for it.
+
+        sha256: str
+            hex digest of the content, None if stored or failed.
+
+        error: str
+        index: int
+            position of the photo in the input.
+    """
+
+    __slots__ = ('photo_key', 'url', 'path', 'status', 'bytes', 'sha256',
+                 'error', 'index')
+
+    def __init__(self, photo_key, url, path, status, bytes=0, sha256=None,
+                 error=None, index=None):
+        self.photo_key = photo_key
+        self.url = url
+        self.path = path
+        self.status = status
+        self.bytes = bytes
+        self.sha256 = sha256
+        self.error = error
+        self.index = index
+
+    @property
+    def ok(self):
+        return self.status != 'failed'
+
+    def __repr__(self):
+        error = f', error={self.error!r}' if self.error else ''
+        return (f'MediaResult({self.photo_key!r}, {self.status}, '
+                f'bytes={self.bytes}{error})')
+
+
+class DownloadReport:
+    """
+    MediaResults of a download, in input order.
+    """
+
+    def __init__(self, results, seconds):
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    def summary(self):
+        """
+        Return
+            dict
+                total, photos per status, bytes transferred, seconds
+                taken and MiB/s.
+        """
+        transferred = sum(result.bytes for result in self.results)
+        return {
+            'total': len(self.results),
+            **Counter(result.status for result in self.results),
+            'bytes': transferred,
+            'seconds': self.seconds,
+            'mib_per_second': (transferred / 2 ** 20 / self.seconds
+                               if self.seconds else 0.0),
+        }
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return f'DownloadReport({self.summary()})'
+
+
+class _Incomplete(Exception):
+    pass
+
+
+class MediaDownloader:
+    """
+    Downloads photo items into directory, see module doc.
+    """
+
+    def __init__(self,
+                 directory,
+                 session: requests.Session = None,
+                 max_workers: int = 8,
+                 chunk_size: int = 1 << 16,
+                 connect_timeout: float = 5,
+                 read_timeout: float = 60,
+                 max_attempts: int = 3,
+                 dedupe: bool = True,
+                 ):
+        """
+        MediaDownloader init.
+
+        Parameter
+            directory: str
+            session: requests.Session
+                if not session, a new pooled session with max_workers
+                connections per host.
+
+            max_workers: int
+                photos downloaded at once.
+
+            chunk_size: int
+                bytes read and written at a time.
+
+            connect_timeout: float
+            read_timeout: float
+                seconds, read_timeout between two chunks.
+
+            max_attempts: int
+                requests sent at most per photo. Connection errors,
+                timeouts, 5xx answers and cut off bodies are retried,
+                resuming from what was written.
+
+            dedupe: bool
+                hash contents and link photos of the same content or url
+                to one file.
+        """
+        self.directory = directory
+        self.session = session or util.new_session(pool_maxsize=max_workers)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_attempts = max_attempts
+        self.dedupe = dedupe
+        self._lock = threading.Lock()
+        self._manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self._hashes = {}  # sha256 -> path relative to directory
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path) as f:
+                self._hashes = json.load(f)['sha256']
+
+    def path_for(self, photo):
+        """
+        Gets the file path photo is stored at.
+        """
+        ext = posixpath.splitext(urlsplit(photo['url']).path)[1] or '.jpg'
+        parts = (photo.get('band_key') or 'band',
+                 photo.get('photo_album_key') or 'album',
+                 f'{photo["photo_key"]}{ext}')
+        return os.path.join(self.directory,
+                            *(re.sub(r'[^\w.-]', '_', part) for part in parts))
+
+    def download(self, photos, on_result=None):
+        """
+        Downloads every photo not stored yet.
+
+        Parameter
+            photos: iterable of dict or records.Record
+                photo items with photo_key and url, and band_key /
+                photo_album_key for the directory layout, ex. as
+                album_photos yields. Read lazily, while earlier photos
+                are already being downloaded.
+
+            on_result: callable
+                called with each MediaResult as it is known.
+
+        Return
+            DownloadReport
+        """
+        start = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        done = queue.Queue()
+        slots = threading.Semaphore(self.max_workers * 2)
+        results = []
+        first_of_url = {}  # url -> index of the photo downloading it
+        same_url = []  # (photo_key, url, path, index, first index)
+        pending = 0
+
+        def finish(result):
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+            if len(results) % MANIFEST_EVERY == 0:
+                self._save_manifest()
+
+        def collect(block):
+            nonlocal pending
+            while pending:
+                try:
+                    result = done.get(block=block)
+                except queue.Empty:
+                    return
+                pending -= 1
+                slots.release()
+                finish(result)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix='bandapi-media') as executor:
+            for index, photo in enumerate(photos):
+                if not isinstance(photo, dict):
+                    photo = photo._asdict()
+                url = photo['url']
+                path = self.path_for(photo)
+                if os.path.exists(path):
+                    finish(MediaResult(photo['photo_key'], url, path, 'stored',
+                                       index=index))
+                    continue
+                if self.dedupe and url in first_of_url:
+                    same_url.append((photo['photo_key'], url, path, index,
+                                     first_of_url[url]))
+                    continue
+                first_of_url[url] = index
+
+                while not slots.acquire(timeout=0.1):
+                    collect(block=False)
+                future = executor.submit(self._download_one, photo['photo_key'],
+                                         url, path, index)
+                future.add_done_callback(lambda future: done.put(future.result()))
+                pending += 1
+                collect(block=False)
+            collect(block=True)
+
+        by_index = {result.index: result for result in results}
+        for photo_key, url, path, index, first in same_url:
+            finish(self._link_same_url(photo_key, url, path, index,
+                                       by_index[first]))
+
+        self._save_manifest()
+        results.sort(key=lambda result: result.index)
+        return DownloadReport(results, time.monotonic() - start)
+
+    def _download_one(self, photo_key, url, path, index):
+        try:
+            status, transferred, digest = self._fetch(url, path)
+        except Exception as e:
+            return MediaResult(photo_key, url, path, 'failed', error=repr(e),
+                               index=index)
+        if self.dedupe and self._link_same_content(path, digest):
+            status = 'duplicate'
+        return MediaResult(photo_key, url, path, status, bytes=transferred,
+                           sha256=digest, index=index)
+
+    def _fetch(self, url, path):
+        """
+        Streams url into path + '.part', resuming it if it exists,
+        and renames it to path once complete.
+
+        Return
+            (status, bytes transferred, sha256 hex digest)
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part = path + '.part'
+        # hasher and offset always cover exactly what part holds
+        hasher, offset = _hash_file(part, self.chunk_size)
+        resumed = False
+        transferred = 0
+
+        for attempt in range(1, self.max_attempts + 1):
+            headers = {'Accept-Encoding': 'identity'}  # ranges of the file itself
+            if offset:
+                headers['Range'] = f'bytes={offset}-'
+            try:
+                with self.session.get(url, headers=headers, stream=True,
+                                      timeout=self.timeout) as response:
+                    if response.status_code == 416 and offset:
+                        # part may be whole already, else start over
+                        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                        if total == str(offset):
+                            break
+                        os.remove(part)
+                        hasher, offset = hashlib.sha256(), 0
+                        continue
+                    if response.status_code >= 500:
+                        raise _Incomplete(f'{response.status_code} {response.reason}')
+                    response.raise_for_status()
+
+                    match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+                    if offset and response.status_code == 206 \
+                            and match is not None and int(match.group(1)) == offset:
+                        resumed = True
+                    else:
+                        # the whole file is sent
+                        hasher, offset = hashlib.sha256(), 0
+                    expected = response.headers.get('Content-Length')
+                    expected = offset + int(expected) if expected else None
+
+                    # a cut off body is checked against expected below,
+                    # so its last chunk is written instead of raised on
+                    response.raw.enforce_content_length = False
+                    with open(part, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(self.chunk_size):
+                            f.write(chunk)
+                            hasher.update(chunk)
+                            offset += len(chunk)
+                            transferred += len(chunk)
+                    if expected is not None and offset < expected:
+                        raise _Incomplete(f'{offset} of {expected} bytes')
+                break
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, _Incomplete):
+                # what was written stays, the next attempt resumes it
+                if attempt == self.max_attempts:
+                    raise
+
+        os.replace(part, path)
+        return ('resumed' if resumed else 'downloaded'), transferred, hasher.hexdigest()
+
+    def _link_same_content(self, path, digest):
+        relative = os.path.relpath(path, self.directory)
+        with self._lock:
+            stored = self._hashes.get(digest)
+            if stored is None or stored == relative \
+                    or not os.path.exists(os.path.join(self.directory, stored)):
+                self._hashes[digest] = relative
+                return False
+        return _link(os.path.join(self.directory, stored), path)
+
+    def _link_same_url(self, photo_key, url, path, index, first):
+        if not first.ok:
+            return MediaResult(photo_key, url, path, 'failed', error=first.error,
+                               index=index)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _link(first.path, path)
+        return MediaResult(photo_key, url, path, 'duplicate',
+                           sha256=first.sha256, index=index)
+
+    def _save_manifest(self):
+        with self._lock:
+            hashes = dict(self._hashes)
+        util.atomic_write_json(self._manifest_path, {'sha256': hashes})
+
+
+def _hash_file(path, chunk_size):
+    """
+    Return
+        (sha256 of path's content, its size), of b'' if path is missing.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                hasher.update(chunk)
+                size += len(chunk)
+    return hasher, size
+
+
+def _link(stored, path):
+    """
+    Replaces path with a hard link to stored.
+
+    Return
+        bool
+            False if the file system has no hard links. path is then
+            kept, or made a copy of stored if it did not exist.
+    """
+    tmp_path = f'{path}.link'
+    try:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        os.link(stored, tmp_path)
+    except OSError:
+        if not os.path.exists(path):
+            shutil.copyfile(stored, path)
+        return False
+    os.replace(tmp_path, path)
+    return True
@@ -0,0 +1,450 @@
+"""
+Instrumentation of api_request: hooks, counters and latency histograms.
+
+    metrics = Metrics()
+    client = APIClient(metrics=metrics)
+    ...
+    print(metrics.to_prometheus())
+
+    client.hooks['post_request'].append(lambda event: print(event))
+
+Every request (cache hits included) makes one RequestEvent, passed to
+the client's pre_request hooks before it is sent and to its
+post_request hooks once it is done. Metrics.record is such a hook.
+
+Phases of RequestEvent.timings, in seconds:
+    dns, connect, tls   only when a new connection was opened, and only
+                        with TimedHTTPAdapter (APIClient(metrics=) mounts it)
+    ttfb                request sent until response headers
+    download            headers until the whole body
+    decode              body to dict
+    total               the whole api_request, retries included
+
+Turning result_data into the output format (ex. the DataFrame build) is
+timed apart, as bandapi_convert_seconds, since it happens after
+api_request returns.
+"""
+
+import socket
+import sys
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection as _HTTPConnection
+from urllib3.connection import HTTPSConnection as _HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import (ConnectTimeoutError, NameResolutionError,
+                                NewConnectionError)
+from urllib3.util.connection import allowed_gai_family, create_connection
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'download', 'decode', 'total')
+
+
+class RequestEvent:
+    """
+    One api_request call, as hooks see it.
+
+    Attribute
+        method: str
+        url: str
+        endpoint: str
+            url path, ex. '/v2/band/posts'.
+
+        params: dict
+            request parameters, access_token left out.
+
+        status: str
+            'ok', 'failed' (result_code other than 1), 'rate_limited'
+            (still after retries), 'unauthorized', 'cache_hit',
+            'unchanged' or 'error' (exception raised). None until done.
+
+        status_code: int
+        result_code: int
+        attempts: int
+            requests sent, rate limit retries and the retry after a
+            token refresh included.
+
+        refreshed: bool
+            the call was answered unauthorized and sent again after
+            token_manager.refresh.
+
+        bytes_out: int
+        bytes_in: int
+        timings: dict
+            phase -> seconds, see module doc.
+
+        error: BaseException
+    """
+
+    __slots__ = ('method', 'url', 'endpoint', 'params', 'status',
+                 'status_code', 'result_code', 'attempts', 'refreshed',
+                 'bytes_out', 'bytes_in', 'timings', 'error', 'started')
+
+    def __init__(self, method, url, endpoint, params):
+        self.method = method
+        self.url = url
+        self.endpoint = endpoint
+        self.params = {name: value for name, value in params.items()
+                       if name != 'access_token'}
+        self.status = None
+        self.status_code = None
+        self.result_code = None
+        self.attempts = 0
+        self.refreshed = False
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.timings = {}
+        self.error = None
+        self.started = time.perf_counter()
+        take_connection_timings()  # drop those of requests made outside
+
+    def add_timing(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+    def add_attempt(self, status_code, timings, bytes_out, bytes_in):
+        """
+        Adds the phases and sizes of one sent request.
+        """
+        self.attempts += 1
+        self.status_code = status_code
+        for phase, seconds in timings.items():
+            self.add_timing(phase, seconds)
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+
+    def add_response(self, response, sent, decoded):
+        """
+        add_attempt for a requests.Response.
+
+        Parameter
+            response: requests.Response
+            sent: float
+                time.perf_counter() the request was sent at.
+
+            decoded: float
+                seconds its body took to decode.
+        """
+        timings = take_connection_timings()
+        # elapsed: sent until headers parsed, a new connection included
+        connecting = sum(timings.values())
+        elapsed = response.elapsed.total_seconds()
+        timings['ttfb'] = max(0.0, elapsed - connecting)
+        timings['download'] = max(0.0, time.perf_counter() - sent - elapsed - decoded)
+        timings['decode'] = decoded
+
+        request = response.request
+        bytes_out = len(request.url) + len(request.body or b'')
+        # bytes read off the socket, before gzip is undone
+        bytes_in = (response.raw.tell() if response.raw is not None
+                    else len(response.content))
+        self.add_attempt(response.status_code, timings, bytes_out, bytes_in)
+
+    def finish(self, status, result_code=None, error=None):
+        self.status = status
+        self.result_code = result_code
+        self.error = error
+        self.timings['total'] = time.perf_counter() - self.started
+
+    def __repr__(self):
+        timings = ', '.join(f'{phase}={seconds * 1e3:.1f}ms'
+                            for phase, seconds in self.timings.items())
+        return (f'RequestEvent({self.method} {self.endpoint}, {self.status}, '
+                f'attempts={self.attempts}, {timings})')
+
+
+def call_hooks(hooks, name, event):
+    for hook in hooks.get(name, ()):
+        hook(event)
+
+
+class Metrics:
+    """
+    Counters and histograms of RequestEvents, labelled by endpoint.
+
+    Description
+        Thread-safe. record is a post_request hook, APIClient(metrics=)
+        adds it and times connection phases too.
+
+        Counters
+            bandapi_requests_total{endpoint, method, status}
+            bandapi_attempts_total{endpoint}
+            bandapi_bytes_out_total{endpoint}
+            bandapi_bytes_in_total{endpoint}
+            bandapi_token_refreshes_total
+        Histograms
+            bandapi_request_seconds{endpoint, phase}
+            bandapi_convert_seconds{output}
+
+        bandapi_token_refreshes_total counts refresh requests of the
+        token managers on_token_refresh is added to, whichever client
+        or call made them.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = [[0] * len(self.buckets), 0.0, 0]
+                self._histograms[key] = histogram
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def record(self, event):
+        """
+        Adds a finished RequestEvent.
+        """
+        endpoint = event.endpoint
+        self.inc('bandapi_requests_total', endpoint=endpoint,
+                 method=event.method, status=event.status)
+        if event.attempts:
+            self.inc('bandapi_attempts_total', event.attempts, endpoint=endpoint)
+            self.inc('bandapi_bytes_out_total', event.bytes_out, endpoint=endpoint)
+            self.inc('bandapi_bytes_in_total', event.bytes_in, endpoint=endpoint)
+        for phase, seconds in event.timings.items():
+            self.observe('bandapi_request_seconds', seconds,
+                         endpoint=endpoint, phase=phase)
+
+    def record_convert(self, output, seconds):
+        """
+        Adds the seconds one result took to turn into output format.
+        """
+        self.observe('bandapi_convert_seconds', seconds, output=output)
+
+    def on_token_refresh(self, profile):
+        """
+        tokens.TokenManager refresh hook.
+        """
+        self.inc('bandapi_token_refreshes_total')
+
+    def counter(self, name, **labels):
+        """
+        Value of a counter, 0 if never incremented.
+        """
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def summary(self):
+        """
+        Return
+            dict
+                endpoint -> {phase: (count, mean seconds)}
+        """
+        summary = {}
+        with self._lock:
+            for (name, labels), (_, total, count) in self._histograms.items():
+                labels = dict(labels)
+                if name != 'bandapi_request_seconds' or not count:
+                    continue
+                phases = summary.setdefault(labels['endpoint'], {})
+                phases[labels['phase']] = (count, total / count)
+        return summary
+
+    def to_prometheus(self):
+        """
+        Gets every metric in Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        for (name, labels), (bucket_counts, total, count) in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f'{name}_bucket{_labels(labels + (("le", repr(float(bound))),))} '
+                             f'{bucket_count}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"'
+                          for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class OpenTelemetryRecorder:
+    """
+    post_request hook recording RequestEvents as OpenTelemetry metrics.
+
+    Requires opentelemetry-api. Metrics go wherever the meter provider
+    set up by the application exports them.
+
+        recorder = OpenTelemetryRecorder()
+        client = APIClient(metrics=recorder)
+    """
+
+    def __init__(self, meter=None):
+        """
+        OpenTelemetryRecorder init.
+
+        Parameter
+            meter: opentelemetry.metrics.Meter
+                if not meter, opentelemetry.metrics.get_meter('bandapi').
+        """
+        if meter is None:
+            from opentelemetry import metrics as otel_metrics
+            meter = otel_metrics.get_meter('bandapi')
+        self._requests = meter.create_counter(
+            'bandapi.requests', unit='1', description='api_request calls')
+        self._attempts = meter.create_counter(
+            'bandapi.attempts', unit='1', description='requests sent')
+        self._bytes_in = meter.create_counter(
+            'bandapi.bytes_in', unit='By', description='response bytes')
+        self._bytes_out = meter.create_counter(
+            'bandapi.bytes_out', unit='By', description='request bytes')
+        self._refreshes = meter.create_counter(
+            'bandapi.token_refreshes', unit='1', description='token refreshes')
+        self._seconds = meter.create_histogram(
+            'bandapi.request.duration', unit='s',
+            description='api_request phases')
+        self._convert_seconds = meter.create_histogram(
+            'bandapi.convert.duration', unit='s',
+            description='result_data to output format')
+
+    def record(self, event):
+        attributes = {'endpoint': event.endpoint}
+        self._requests.add(1, {**attributes, 'method': event.method,
+                               'status': event.status})
+        self._attempts.add(event.attempts, attributes)
+        self._bytes_in.add(event.bytes_in, attributes)
+        self._bytes_out.add(event.bytes_out, attributes)
+        for phase, seconds in event.timings.items():
+            self._seconds.record(seconds, {**attributes, 'phase': phase})
+
+    def record_convert(self, output, seconds):
+        self._convert_seconds.record(seconds, {'output': output})
+
+    def on_token_refresh(self, profile):
+        """
+        tokens.TokenManager refresh hook.
+        """
+        self._refreshes.add(1)
+
+
+# Connection phases, timed by the connections of TimedHTTPAdapter and
+# taken by RequestEvent.add_response on the same thread.
+_connection_timings = threading.local()
+
+
+def _add_connection_timing(phase, seconds):
+    timings = getattr(_connection_timings, 'timings', None)
+    if timings is None:
+        timings = _connection_timings.timings = {}
+    timings[phase] = timings.get(phase, 0) + seconds
+
+
+def take_connection_timings():
+    timings = getattr(_connection_timings, 'timings', None) or {}
+    _connection_timings.timings = {}
+    return timings
+
+
+class _TimedConnectionMixin:
+    # Resolves the host itself to time DNS apart from the TCP connect,
+    # then tries every address in turn, as urllib3's create_connection
+    # does, with urllib3's socket setup and errors.
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self.host, self.port,
+                                           allowed_gai_family(),
+                                           socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        resolved = time.perf_counter()
+        _add_connection_timing('dns', resolved - start)
+
+        error = None
+        for *_, sockaddr in addresses:
+            try:
+                sock = create_connection((sockaddr[0], self.port), self.timeout,
+                                         source_address=self.source_address,
+                                         socket_options=self.socket_options)
+            except socket.timeout as e:
+                error = ConnectTimeoutError(
+                    self, f'Connection to {self.host} timed out. '
+                          f'(connect timeout={self.timeout})')
+                error.__cause__ = e
+            except OSError as e:
+                error = NewConnectionError(
+                    self, f'Failed to establish a new connection: {e}')
+                error.__cause__ = e
+            else:
+                _add_connection_timing('connect', time.perf_counter() - resolved)
+                sys.audit('http.client.connect', self, self.host, self.port)
+                return sock
+        if error is None:
+            error = NewConnectionError(self, f'No address found for {self.host}')
+        raise error
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, _HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, _HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        before = dict(getattr(_connection_timings, 'timings', None) or {})
+        super().connect()
+        timings = getattr(_connection_timings, 'timings', None) or {}
+        socket_seconds = sum(timings.get(phase, 0) - before.get(phase, 0)
+                             for phase in ('dns', 'connect'))
+        _add_connection_timing('tls',
+                               time.perf_counter() - start - socket_seconds)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose new connections record dns, connect and tls time.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
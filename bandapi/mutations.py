@@ -0,0 +1,264 @@
+"""
+Bulk writes with a result per item.
+
+    results = client.bulk_delete_comments(
+        (c['band_key'], c['post_key'], c['comment_key']) for c in comments)
+    print(results.summary())
+    for result in results.failed:
+        print(result.keys, result.code, result.message)
+
+Items go through the client's write scheduler as they come, so a
+generator (ex. crawler.Crawler.crawl_comments) is written while it is
+still being listed, and every band's cooldown slot is kept busy.
+"""
+
+from collections import Counter
+import json
+import queue
+import re
+import time
+
+import requests
+
+from bandapi.ratelimit import COOLDOWN_CODE, RATE_LIMIT_CODES
+
+# result_code worth sending the write again for, besides
+# connection errors and timeouts.
+TRANSIENT_CODES = RATE_LIMIT_CODES + (COOLDOWN_CODE,)
+
+# fields of each bulk method's items, in argument order
+BULK_FIELDS = {
+    'delete_comment': ('band_key', 'post_key', 'comment_key'),
+    'delete_post': ('band_key', 'post_key'),
+    'write_comment': ('band_key', 'post_key', 'body'),
+}
+
+_CODE_MESSAGE = re.compile(r'^code (-?\d+): (.*)$', re.DOTALL)
+
+
+def parse_message(message):
+    """
+    Splits result_data['message'] of a failed request.
+
+    Description
+        client.parse_result folds a failure's result_code into its
+        message as 'code {result_code}: {message}'.
+
+    Return
+        (code, message)
+            code is None, if message has no code (ex. 'success').
+    """
+    match = _CODE_MESSAGE.match(str(message))
+    if match is None:
+        return None, message
+    return int(match.group(1)), match.group(2)
+
+
+class MutationResult:
+    """
+    Outcome of one item of a bulk write.
+
+    Attribute
+        method: str
+        keys: tuple
+            the item's arguments, in BULK_FIELDS order.
+
+        ok: bool
+        code: int
+            result_code of a failure, None on success or on an exception.
+
+        message: str
+            'success', the API's failure message (without the code)
+            or the exception.
+
+        attempts: int
+            writes sent for the item, retries included.
+
+        result_data: dict
+            of the last attempt, None if it raised.
+
+        index: int
+            position of the item in the input.
+    """
+
+    __slots__ = ('method', 'keys', 'ok', 'code', 'message', 'attempts',
+                 'result_data', 'index')
+
+    def __init__(self, method, keys, ok, code, message, attempts,
+                 result_data=None, index=None):
+        self.method = method
+        self.keys = keys
+        self.ok = ok
+        self.code = code
+        self.message = message
+        self.attempts = attempts
+        self.result_data = result_data
+        self.index = index
+
+    @property
+    def transient(self):
+        """
+        Whether sending the write again may succeed.
+        """
+        return not self.ok and (self.code in TRANSIENT_CODES
+                                or self.code is None)
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'failed code={self.code}'
+        return (f'MutationResult({self.method}{self.keys}, {status}, '
+                f'message={self.message!r}, attempts={self.attempts})')
+
+
+class BulkResult:
+    """
+    MutationResults of a bulk write, in input order.
+    """
+
+    def __init__(self, method, results, seconds):
+        self.method = method
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    def summary(self):
+        """
+        Return
+            dict
+                method, total, succeeded, failed, retried (items that
+                needed more than one attempt), failure count per code
+                ('error' for exceptions) and seconds taken.
+        """
+        failed = self.failed
+        return {
+            'method': self.method,
+            'total': len(self.results),
+            'succeeded': len(self.results) - len(failed),
+            'failed': len(failed),
+            'retried': sum(1 for result in self.results if result.attempts > 1),
+            'failures': dict(Counter('error' if result.code is None else result.code
+                                     for result in failed)),
+            'seconds': self.seconds,
+        }
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return f'BulkResult({self.summary()})'
+
+
+def _keys(item, fields):
+    if isinstance(item, (tuple, list)):
+        if len(item) != len(fields):
+            raise ValueError(f'Items must have fields {list(fields)}')
+        return tuple(item)
+    if isinstance(item, dict):
+        return tuple(item[name] for name in fields)
+    return tuple(getattr(item, name) for name in fields)
+
+
+def _result(method, keys, index, attempts, future):
+    try:
+        result_data = future.result()
+    except (requests.RequestException, json.JSONDecodeError) as e:
+        # connection errors, timeouts and undecodable answers. Other
+        # errors, ex. auth's ValueError for a dead refresh token, are
+        # raised by run_bulk instead of being retried.
+        return MutationResult(method, keys, False, None, repr(e), attempts,
+                              index=index)
+
+    code, message = parse_message(result_data.get('message'))
+    # deletes answer {'message': 'success'}, creates the new keys
+    ok = code is None
+    return MutationResult(method, keys, ok, code, message, attempts,
+                          result_data=result_data, index=index)
+
+
+def run_bulk(client, method, items, max_attempts: int = 3, on_result=None):
+    """
+    Sends client.{method} for every item through client.schedule_write.
+
+    Parameter
+        client: client.APIClient or pool.ClientPool
+        method: str
+            one of BULK_FIELDS.
+
+        items: iterable
+            tuples of the method's arguments, or dicts / records.Record
+            with the BULK_FIELDS fields. Read lazily, while earlier
+            items are already being written.
+
+        max_attempts: int
+            writes sent at most per item. Transient failures (rate
+            limits, connection errors) are queued again until then.
+
+        on_result: callable
+            called with each final MutationResult as it is known, ex.
+            to checkpoint or log progress.
+
+    Raise
+        exceptions other than transient ones, ex. ConnectionRefusedError
+        when the token is refused after a refresh, or auth's ValueError
+        when the refresh token is invalid. Writes queued but not sent
+        yet are cancelled first.
+
+    Return
+        BulkResult
+    """
+    if method not in BULK_FIELDS:
+        raise ValueError(f'Param method must be one of {list(BULK_FIELDS)}')
+    fields = BULK_FIELDS[method]
+    start = time.monotonic()
+    done = queue.Queue()
+    results = []
+    pending = 0
+    futures = set()  # of writes not handled yet
+
+    def submit(keys, index, attempt):
+        future = client.schedule_write(method, *keys)
+        futures.add(future)
+        future.add_done_callback(
+            lambda future: done.put((keys, index, attempt, future)))
+
+    def handle(keys, index, attempt, future):
+        futures.discard(future)
+        result = _result(method, keys, index, attempt, future)
+        if result.transient and attempt < max_attempts:
+            submit(keys, index, attempt + 1)
+            return 0
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+        return 1
+
+    try:
+        for index, item in enumerate(items):
+            submit(_keys(item, fields), index, 1)
+            pending += 1
+            # collect what finished meanwhile, so retries are queued early
+            while True:
+                try:
+                    finished = done.get_nowait()
+                except queue.Empty:
+                    break
+                pending -= handle(*finished)
+
+        while pending:
+            pending -= handle(*done.get())
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+    results.sort(key=lambda result: result.index)
+    return BulkResult(method, results, time.monotonic() - start)
@@ -0,0 +1,228 @@
+"""
+Pagination engine shared by every list endpoint.
+
+Every list endpoint streams (page, after):
+    page: items of one response in the client's output format
+    after: cursor of the next page, None on the last page
+"""
+
+import asyncio
+import queue
+import threading
+
+from bandapi.cache import Unchanged
+from bandapi.mutations import parse_message
+
+_END = object()
+
+
+class PageError(ValueError):
+    """
+    A list endpoint answered a failure instead of a page.
+
+    Attribute
+        code: int
+            result_code of the answer, ex. 60400 for a post that does
+            not exist (anymore).
+
+        message: str
+    """
+
+    def __init__(self, code, message):
+        super().__init__(f'code {code}: {message}')
+        self.code = code
+        self.message = message
+
+
+def page_size(page):
+    """
+    Number of items in a page, also for cache.Unchanged pages.
+    """
+    if isinstance(page, Unchanged):
+        return page.count
+    return len(page)
+
+
+def next_after(result_data):
+    """
+    Gets 'after' cursor of the next page, None on the last page.
+
+    Raise
+        PageError
+            if result_data is a failure, which has no paging.
+    """
+    paging = result_data.get('paging')
+    if paging is None:
+        raise PageError(*parse_message(result_data.get('message')))
+    after = paging.get('next_params', None)
+    if after is not None:
+        after = after['after']
+    return after
+
+
+def _trim(page, remaining):
+    if isinstance(page, Unchanged) or page_size(page) <= remaining:
+        return page
+    return page[:remaining]
+
+
+def _pages(fetch, to_page, after, limit):
+    remaining = limit
+    while True:
+        result_data = fetch(after)
+        after = next_after(result_data)
+        page = to_page(result_data)
+        if remaining is not None:
+            page = _trim(page, remaining)
+            remaining -= page_size(page)
+
+        yield page, after
+
+        if after is None or (remaining is not None and remaining <= 0):
+            return
+
+
+def _read_ahead(pages, depth):
+    """
+    Runs pages generator in a background thread, at most depth pages
+    ahead of the consumer.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # gives up once the consumer stopped iterating
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in pages:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((None, e))
+            return
+        put((_END, None))
+
+    producer = threading.Thread(target=produce,
+                                name='bandapi-prefetch',
+                                daemon=True,
+                                )
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def paginate(fetch,
+             to_page,
+             after: str = None,
+             limit: int = None,
+             prefetch: int = 0,
+             ):
+    """
+    Follows 'after' cursors from after until the last page or limit.
+
+    Parameter
+        fetch: callable
+            after -> result_data of the page.
+
+        to_page: callable
+            result_data -> page.
+
+        after: str
+            cursor to start from, None for the first page.
+
+        limit: int
+            items to yield at most. No request is sent once it is
+            reached, and the last page is cut to fit.
+
+        prefetch: int
+            pages to read ahead. With prefetch, a background thread
+            requests (and converts) the next pages while the caller is
+            still processing the current one, and pauses once prefetch
+            pages are waiting, so a slow caller does not buffer more.
+            0 requests each page only when the caller asks for it.
+
+    Raise
+        PageError
+            while iterating, if a page request fails, ex. for a band
+            or post that does not exist.
+
+    Return
+        generator of (page, after)
+    """
+    pages = _pages(fetch, to_page, after, limit)
+    if prefetch:
+        return _read_ahead(pages, prefetch)
+    return pages
+
+
+async def _apages(fetch, to_page, after, limit):
+    remaining = limit
+    while True:
+        result_data = await fetch(after)
+        after = next_after(result_data)
+        page = to_page(result_data)
+        if remaining is not None:
+            page = _trim(page, remaining)
+            remaining -= page_size(page)
+
+        yield page, after
+
+        if after is None or (remaining is not None and remaining <= 0):
+            return
+
+
+async def _aread_ahead(pages, depth):
+    buffer = asyncio.Queue(maxsize=depth)
+
+    async def produce():
+        try:
+            async for item in pages:
+                await buffer.put((item, None))
+        except Exception as e:
+            await buffer.put((None, e))
+            return
+        await buffer.put((_END, None))
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item, error = await buffer.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        producer.cancel()
+
+
+def apaginate(fetch,
+              to_page,
+              after: str = None,
+              limit: int = None,
+              prefetch: int = 0,
+              ):
+    """
+    paginate for coroutine fetch, as async generator.
+    With prefetch, pages are read ahead by a task.
+    """
+    pages = _apages(fetch, to_page, after, limit)
+    if prefetch:
+        return _aread_ahead(pages, prefetch)
+    return pages
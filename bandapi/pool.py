@@ -0,0 +1,281 @@
+"""
+Many Band accounts behind one client.
+
+    pool = ClientPool([Config(access_token=..., refresh_token=...),
+                       Config(access_token=..., refresh_token=...)],
+                      output='dict')
+    pool.get_posts(band_key)  # sent with an account in band_key
+    Crawler(pool).crawl()     # every band of every account
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from bandapi import util
+from bandapi.client import APIClient
+from bandapi.metrics import TimedHTTPAdapter
+from bandapi.mutations import run_bulk
+from bandapi.records import check_output, iter_items, to_output
+
+# APIClient methods taking band_key first, routed to the band's account
+ROUTED_METHODS = (
+    'get_posts',
+    'get_specific_post',
+    'write_post',
+    'delete_post',
+    'get_comments',
+    'write_comment',
+    'delete_comment',
+    'check_permission',
+    'get_albums',
+    'get_photos',
+)
+
+
+class ClientPool:
+    """
+    Holds one APIClient per account and sends each band's requests
+    with an account that is a member of the band.
+
+    Description
+        Every account keeps its own token, rate limiters, write
+        scheduler (cooldowns) and worker threads, so accounts never
+        wait on each other's quota and a busy account cannot starve
+        the others. Throughput grows with the number of accounts.
+
+        A band several accounts are in is given to the one with the
+        fewest bands, so the load is spread evenly.
+
+        The pool has the endpoints of APIClient that take band_key,
+        plus get_profile(s) and get_bands over all accounts, so it can
+        stand in for a client, ex. in crawler.Crawler.
+    """
+
+    def __init__(self,
+                 configs=(),
+                 clients=(),
+                 output: str = 'dataframe',
+                 max_workers_per_account: int = 4,
+                 **client_kwargs,
+                 ):
+        """
+        ClientPool init.
+
+        Parameter
+            configs: iterable of config.Config
+                one per account, an APIClient is made for each.
+
+            clients: iterable of APIClient
+                clients made by the caller, added as they are.
+
+            output: str
+                output format of every client made and of get_bands.
+
+            max_workers_per_account: int
+                threads of each account's submit executor.
+
+            **client_kwargs
+                passed to every APIClient made. Made clients share one
+                pooled session unless session is given. Do not pass
+                rate_limits unless accounts share a quota. One metrics
+                passed here adds up every account's requests.
+        """
+        self.output = check_output(output)
+        self._own_session = None
+        if configs and 'session' not in client_kwargs:
+            adapter_kwargs = {}
+            if client_kwargs.get('metrics') is not None:
+                adapter_kwargs['adapter_class'] = TimedHTTPAdapter
+            self._own_session = util.new_session(
+                pool_connections=client_kwargs.pop('pool_connections', 4),
+                pool_maxsize=client_kwargs.pop('pool_maxsize', 16),
+                **adapter_kwargs,
+            )
+            client_kwargs['session'] = self._own_session
+
+        self.clients = list(clients)
+        self.clients += [APIClient(config=config, output=output, **client_kwargs)
+                         for config in configs]
+        if not self.clients:
+            raise ValueError('Param configs or clients must not be empty')
+
+        self._executors = [
+            ThreadPoolExecutor(max_workers=max_workers_per_account,
+                               thread_name_prefix=f'bandapi-account{i}')
+            for i in range(len(self.clients))
+        ]
+        self._lock = threading.Lock()
+        self._owners = None  # band_key -> client index
+        self._bands = None  # band items of every account, deduplicated
+
+    def close(self):
+        """
+        Waits for submitted calls and scheduled writes, then closes
+        every client.
+        """
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+        for client in self.clients:
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def refresh_bands(self):
+        """
+        Gets the bands of every account again and reassigns them.
+        """
+        pages = [client.get_bands() for client in self.clients]
+
+        members = {}  # band_key -> indexes of accounts in the band
+        bands = {}
+        for i, page in enumerate(pages):
+            for band in iter_items(page):
+                members.setdefault(band['band_key'], []).append(i)
+                bands.setdefault(band['band_key'], band)
+
+        owners = {}
+        load = [0] * len(self.clients)
+        # bands with fewest candidates first, so they get their pick
+        for band_key in sorted(members, key=lambda key: len(members[key])):
+            i = min(members[band_key], key=lambda i: load[i])
+            owners[band_key] = i
+            load[i] += 1
+
+        with self._lock:
+            self._owners = owners
+            self._bands = list(bands.values())
+
+    def client_for(self, band_key):
+        """
+        Gets the client of the account band_key is assigned to.
+
+        Raise
+            ValueError
+                if no account of the pool is a member of band_key,
+                also after getting the bands again.
+        """
+        index = self._owner(band_key)
+        if index is None:
+            # the band may have been joined since
+            self.refresh_bands()
+            index = self._owner(band_key)
+        if index is None:
+            raise ValueError(f'No account of the pool is in band {band_key}')
+        return self.clients[index]
+
+    def _owner(self, band_key):
+        if self._owners is None:
+            self.refresh_bands()
+        with self._lock:
+            return self._owners.get(band_key)
+
+    def call(self, method, band_key, *args, **kwargs):
+        """
+        Calls client.{method}(band_key, *args, **kwargs) with the
+        client of band_key's account.
+        """
+        if method not in ROUTED_METHODS:
+            raise ValueError(f'Param method must be one of {list(ROUTED_METHODS)}')
+        client = self.client_for(band_key)
+        return getattr(client, method)(band_key, *args, **kwargs)
+
+    def submit(self, method, band_key, *args, **kwargs):
+        """
+        Runs call(...) on the threads of band_key's account.
+
+        Description
+            Each account has its own executor, so calls queued for
+            one account do not hold up the other accounts' calls.
+            Write cooldowns are kept by schedule_write instead.
+
+        Return
+            concurrent.futures.Future
+        """
+        client = self.client_for(band_key)
+        executor = self._executors[self.clients.index(client)]
+        return executor.submit(self.call, method, band_key, *args, **kwargs)
+
+    def __getattr__(self, name):
+        if name in ROUTED_METHODS:
+            def routed(band_key, *args, **kwargs):
+                return self.call(name, band_key, *args, **kwargs)
+            routed.__name__ = name
+            routed.__doc__ = getattr(APIClient, name).__doc__
+            return routed
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def schedule_write(self, method, band_key, *args, **kwargs):
+        """
+        client.APIClient.schedule_write on band_key's account, so the
+        write waits for that account's cooldown only.
+        """
+        client = self.client_for(band_key)
+        return client.schedule_write(method, band_key, *args, **kwargs)
+
+    def bulk_delete_comments(self, comments, max_attempts: int = 3,
+                             on_result=None):
+        """
+        client.APIClient.bulk_delete_comments over every account, each
+        comment deleted by its band's account.
+        """
+        return run_bulk(self, 'delete_comment', comments,
+                        max_attempts=max_attempts, on_result=on_result)
+
+    def bulk_delete_posts(self, posts, max_attempts: int = 3,
+                          on_result=None):
+        """
+        client.APIClient.bulk_delete_posts over every account.
+        """
+        return run_bulk(self, 'delete_post', posts,
+                        max_attempts=max_attempts, on_result=on_result)
+
+    def bulk_write_comments(self, comments, max_attempts: int = 3,
+                            on_result=None):
+        """
+        client.APIClient.bulk_write_comments over every account.
+        """
+        return run_bulk(self, 'write_comment', comments,
+                        max_attempts=max_attempts, on_result=on_result)
+
+    def get_bands(self):
+        """
+        Gets bands of every account, each band once.
+
+        Return
+            bands in output format, see client.APIClient.get_bands.
+        """
+        self.refresh_bands()
+        with self._lock:
+            bands = self._bands
+        return to_output(bands, self.output)
+
+    def get_profiles(self):
+        """
+        Gets the profile of every account, in clients order.
+        """
+        return [client.get_profile() for client in self.clients]
+
+    def stats(self):
+        """
+        Return
+            list of dict
+                per account: bands assigned, current read rate and
+                writes waiting for their cooldown.
+        """
+        if self._owners is None:
+            self.refresh_bands()
+        with self._lock:
+            owners = list(self._owners.values())
+        stats = []
+        for i, client in enumerate(self.clients):
+            scheduler = client.write_scheduler
+            stats.append({
+                'bands': owners.count(i),
+                'read_rate': client.rate_limits['read'].rate,
+                'pending_writes': scheduler.pending() if scheduler else 0,
+            })
+        return stats
@@ -0,0 +1,451 @@
+"""
+Deletes every comment of one user, across bands and accounts.
+
+    runner = PurgeRunner(ClientPool(configs), user_key,
+                         checkpoint=PurgeCheckpoint('purge.db'))
+    print(runner.plan())   # dry run: what would be deleted, how long
+    runner.run()
+
+Listing and deleting run at once: posts and comment pages are crawled
+concurrently (crawler.Crawler) while found comments are fed to the
+write schedulers (mutations.run_bulk). Bands are deleted from in
+parallel, each at its cooldown, and with a pool.ClientPool every
+account deletes from the bands assigned to it with its own write
+quota. The purge takes about as long as the band with the most
+comments needs at one delete per cooldown.
+
+The checkpoint keeps deleted comment_keys, posts whose comments were
+all deleted and bands whose posts all were, so a restarted purge
+fetches no comment page of a finished post and lists no finished band.
+"""
+
+import sqlite3
+import threading
+import time
+
+from bandapi.checkpoint import SQLiteCheckpointStore
+from bandapi.crawler import Crawler
+from bandapi.scheduler import WRITE_COOLDOWN
+
+
+class PurgeCheckpoint:
+    """
+    Progress of a purge, in a SQLite database.
+
+    Description
+        comment_keys deleted go to add(). Finished posts and bands go
+        to listing, a checkpoint.SQLiteCheckpointStore in the same file,
+        as crawler.Crawler checkpoints: ('comments', band_key, post_key)
+        and ('posts', band_key), done.
+
+        Each add() is its own transaction, like SQLiteCheckpointStore,
+        so a crash loses at most the delete in flight.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.listing = SQLiteCheckpointStore(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS deleted (
+                    comment_key TEXT PRIMARY KEY,
+                    band_key TEXT NOT NULL,
+                    post_key TEXT NOT NULL,
+                    deleted_at REAL NOT NULL
+                )''')
+
+    def add(self, band_key, post_key, comment_key):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO deleted '
+                '(comment_key, band_key, post_key, deleted_at) '
+                'VALUES (?, ?, ?, ?)',
+                (comment_key, band_key, post_key, time.time()))
+
+    def keys(self):
+        """
+        Return
+            set of str
+                every comment_key deleted so far.
+        """
+        with self._lock:
+            return {row[0] for row in
+                    self._conn.execute('SELECT comment_key FROM deleted')}
+
+    def close(self):
+        self._conn.close()
+        self.listing.close()
+
+
+class _ListingCheckpoint:
+    """
+    Checkpoint store the purge's crawler.Crawler gets.
+
+    Description
+        The crawler marks a post done once its comments were listed.
+        For a purge, a post is done once they were deleted too, so its
+        mark is held back until every delete succeeded, and a band is
+        marked done once its last post page was listed and every post
+        of it is done. Posts with a failed delete or listing stay
+        undone, to be listed again by the next run.
+
+        Post page cursors are not kept: a restarted purge lists the
+        posts of an unfinished band again (a request per 20 posts), but
+        no comment page of its done posts.
+
+        With record False (plan), nothing is written.
+    """
+
+    def __init__(self, store, record=True):
+        self.store = store
+        self.record = record
+        self._lock = threading.Lock()
+        self._pending = {}  # (band_key, post_key) -> deletes without result
+        self._failed = set()  # (band_key, post_key)
+        self._listed = set()  # (band_key, post_key) with every comment listed
+        self._open = {}  # band_key -> post_keys not done
+        self._bands_listed = set()  # bands with every post page listed
+
+    def get(self, endpoint, band_key, parent_key=''):
+        saved = self.store.get(endpoint, band_key, parent_key)
+        if saved is not None and saved['done']:
+            return saved
+        if endpoint == 'comments':
+            with self._lock:
+                self._open.setdefault(band_key, set()).add(parent_key)
+        return None
+
+    def set(self, endpoint, band_key, after, done=False, parent_key='',
+            mark=None):
+        with self._lock:
+            if endpoint == 'posts' and done:
+                self._bands_listed.add(band_key)
+                self._check_band(band_key)
+            elif endpoint == 'comments':
+                self._listed.add((band_key, parent_key))
+                self._check_post(band_key, parent_key)
+
+    def add_listed(self, band_key, post_key):
+        with self._lock:
+            key = (band_key, post_key)
+            self._pending[key] = self._pending.get(key, 0) + 1
+
+    def add_result(self, result):
+        band_key, post_key = result.keys[:2]
+        with self._lock:
+            key = (band_key, post_key)
+            self._pending[key] -= 1
+            if not result.ok:
+                self._failed.add(key)
+            self._check_post(band_key, post_key)
+
+    def _check_post(self, band_key, post_key):
+        key = (band_key, post_key)
+        if (key not in self._listed or self._pending.get(key)
+                or key in self._failed):
+            return
+        if self.record:
+            self.store.set('comments', band_key, None, done=True,
+                           parent_key=post_key)
+        self._open.get(band_key, set()).discard(post_key)
+        self._check_band(band_key)
+
+    def _check_band(self, band_key):
+        if band_key not in self._bands_listed or self._open.get(band_key):
+            return
+        if self.record:
+            self.store.set('posts', band_key, None, done=True)
+
+
+class PurgeProgress:
+    """
+    Counts of a running purge, see to_dict.
+    """
+
+    def __init__(self, estimate=None):
+        """
+        PurgeProgress init.
+
+        Parameter
+            estimate: callable
+                (remaining comments per band, bands started) -> seconds,
+                for eta.
+        """
+        self.start = time.monotonic()
+        self.estimate = estimate
+        self.listed = 0
+        self.skipped = 0
+        self.deleted = 0
+        self.failed = 0
+        self.retried = 0
+        self.listing_done = False
+        self.failures = {}  # code -> count
+        self.listing_errors = []  # bands / posts that could not be listed
+        self.remaining = {}  # band_key -> comments listed, not handled
+        self.started = set()  # bands with a delete done
+
+    def add_listed(self, band_key):
+        self.listed += 1
+        self.remaining[band_key] = self.remaining.get(band_key, 0) + 1
+
+    def add_listing_error(self, band_key, post_key, error):
+        self.listing_errors.append({
+            'band_key': band_key,
+            'post_key': post_key,
+            'code': getattr(error, 'code', None),
+            'message': getattr(error, 'message', None) or repr(error),
+        })
+
+    def add(self, result):
+        band_key = result.keys[0]
+        self.started.add(band_key)
+        self.remaining[band_key] -= 1
+        if not self.remaining[band_key]:
+            del self.remaining[band_key]
+        if result.ok:
+            self.deleted += 1
+        else:
+            self.failed += 1
+            code = 'error' if result.code is None else result.code
+            self.failures[code] = self.failures.get(code, 0) + 1
+        if result.attempts > 1:
+            self.retried += 1
+
+    def to_dict(self):
+        """
+        Return
+            dict
+                listed (to delete, found so far), skipped (deleted by an
+                earlier run), deleted, failed, retried, remaining,
+                listing_done, failures per code, listing_errors (bands,
+                or posts with post_key, whose comments could not be
+                listed), elapsed seconds, deletes per second and eta
+                seconds of the remaining deletes (a lower bound until
+                listing is done).
+        """
+        elapsed = time.monotonic() - self.start
+        remaining = self.listed - self.deleted - self.failed
+        rate = self.deleted / elapsed if elapsed else 0.0
+        eta = None
+        if self.estimate is not None:
+            eta = round(self.estimate(dict(self.remaining), set(self.started)), 1)
+        return {
+            'listed': self.listed,
+            'skipped': self.skipped,
+            'deleted': self.deleted,
+            'failed': self.failed,
+            'retried': self.retried,
+            'remaining': remaining,
+            'listing_done': self.listing_done,
+            'failures': dict(self.failures),
+            'listing_errors': list(self.listing_errors),
+            'elapsed': round(elapsed, 1),
+            'rate': round(rate, 3),
+            'eta': eta,
+        }
+
+
+def estimate_seconds(client, counts, started=()):
+    """
+    Seconds deleting counts takes at best.
+
+    Parameter
+        client: client.APIClient or pool.ClientPool
+        counts: dict
+            band_key -> comments to delete.
+
+        started: collection of str
+            bands deleted from already, whose next delete waits for
+            the cooldown too.
+
+    Description
+        Bands are deleted from in parallel, one delete per cooldown
+        each, and an account sends at most its write rate limit.
+        The slower of the two, for the busiest account, is the estimate.
+        Request time is left out.
+    """
+    accounts = {}  # id(client) -> (client, [(count, waits), ...])
+    for band_key, count in counts.items():
+        account = (client.client_for(band_key) if hasattr(client, 'client_for')
+                   else client)
+        # the first delete of a band does not wait
+        waits = count if band_key in started else count - 1
+        accounts.setdefault(id(account), (account, []))[1].append((count, waits))
+
+    seconds = 0.0
+    for account, bands in accounts.values():
+        scheduler = account.write_scheduler
+        cooldown = scheduler.cooldown if scheduler is not None else WRITE_COOLDOWN
+        rate = account.rate_limits['write'].rate
+        seconds = max(seconds,
+                      max(waits for _, waits in bands) * cooldown,
+                      sum(count for count, _ in bands) / rate)
+    return seconds
+
+
+def _comment_keys(comment):
+    if isinstance(comment, dict):
+        return comment['band_key'], comment['post_key'], comment['comment_key']
+    return comment.band_key, comment.post_key, comment.comment_key
+
+
+class PurgeRunner:
+    """
+    Lists and deletes the comments of user_key, see module doc.
+    """
+
+    def __init__(self,
+                 client,
+                 user_key: str,
+                 checkpoint: PurgeCheckpoint = None,
+                 max_workers: int = 8,
+                 max_attempts: int = 3,
+                 on_progress=None,
+                 ):
+        """
+        PurgeRunner init.
+
+        Parameter
+            client: client.APIClient or pool.ClientPool
+                a pool shards bands across its accounts.
+
+            user_key: str
+                author whose comments are deleted.
+
+            checkpoint: PurgeCheckpoint
+                to skip comments, posts and bands a previous run
+                finished, and record this run's.
+
+            max_workers: int
+                bands / posts listed at once.
+
+            max_attempts: int
+                deletes sent at most per comment, see mutations.run_bulk.
+
+            on_progress: callable
+                called with (event, dict): ('result', {...}) per comment
+                handled, ('progress', PurgeProgress.to_dict()) after it,
+                and ('listed', ...) once listing is done.
+        """
+        self.client = client
+        self.user_key = user_key
+        self.checkpoint = checkpoint
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.on_progress = on_progress
+        self.progress = None
+
+    def _emit(self, event, data):
+        if self.on_progress is not None:
+            self.on_progress(event, data)
+
+    def _progress(self):
+        return PurgeProgress(
+            estimate=lambda counts, started: estimate_seconds(self.client, counts,
+                                                              started))
+
+    def _listing(self, record):
+        if self.checkpoint is None:
+            return None
+        return _ListingCheckpoint(self.checkpoint.listing, record=record)
+
+    def _comments(self, band_keys, progress, listing):
+        """
+        Comments of user_key not deleted yet, as they are crawled.
+
+        Bands and posts that fail to list are left out, and added to
+        progress.listing_errors once listing is done. Pages are listed
+        whole also with validators: a page unchanged since plan() still
+        has comments to delete.
+        """
+        done = self.checkpoint.keys() if self.checkpoint is not None else set()
+        crawler = Crawler(self.client, max_workers=self.max_workers,
+                          checkpoint=listing, revalidate=False)
+        comments = crawler.crawl_comments(crawler.crawl(band_keys),
+                                          author_key=self.user_key)
+        for comment in comments:
+            band_key, post_key, comment_key = _comment_keys(comment)
+            if comment_key in done:
+                progress.skipped += 1
+                continue
+            progress.add_listed(band_key)
+            if listing is not None:
+                listing.add_listed(band_key, post_key)
+            yield comment
+        for band_key, band in crawler.progress.items():
+            if band.error is not None:
+                progress.add_listing_error(band_key, None, band.error)
+        for (band_key, post_key), error in crawler.comment_errors.items():
+            progress.add_listing_error(band_key, post_key, error)
+        progress.listing_done = True
+        self._emit('listed', progress.to_dict())
+
+    def plan(self, band_keys=None):
+        """
+        Dry run: lists what run would delete, deletes nothing.
+
+        Parameter
+            band_keys: iterable of str
+                if not band_keys, every band of the client(s).
+
+        Return
+            dict
+                comments to delete, per band, skipped (deleted before),
+                listing_errors (see PurgeProgress.to_dict),
+                listing_seconds and estimated_seconds the deletes take.
+        """
+        self.progress = progress = self._progress()
+        for _ in self._comments(band_keys, progress, self._listing(record=False)):
+            pass
+        counts = progress.remaining
+        return {
+            'comments': progress.listed,
+            'bands': counts,
+            'skipped': progress.skipped,
+            'listing_errors': list(progress.listing_errors),
+            'listing_seconds': round(time.monotonic() - progress.start, 1),
+            'estimated_seconds': round(estimate_seconds(self.client, counts), 1),
+        }
+
+    def run(self, band_keys=None):
+        """
+        Deletes every comment of user_key in band_keys.
+
+        Parameter
+            band_keys: iterable of str
+                if not band_keys, every band of the client(s).
+
+        Return
+            mutations.BulkResult
+                of the comments listed. Bands and posts that could not
+                be listed are in self.progress.listing_errors.
+        """
+        self.progress = progress = self._progress()
+        listing = self._listing(record=True)
+
+        def on_result(result):
+            band_key, post_key, comment_key = result.keys
+            if result.ok and self.checkpoint is not None:
+                self.checkpoint.add(band_key, post_key, comment_key)
+            if listing is not None:
+                listing.add_result(result)
+            progress.add(result)
+            self._emit('result', {
+                'band_key': band_key,
+                'post_key': post_key,
+                'comment_key': comment_key,
+                'ok': result.ok,
+                'code': result.code,
+                'message': result.message,
+                'attempts': result.attempts,
+            })
+            self._emit('progress', progress.to_dict())
+
+        return self.client.bulk_delete_comments(
+            self._comments(band_keys, progress, listing),
+            max_attempts=self.max_attempts,
+            on_result=on_result,
+        )
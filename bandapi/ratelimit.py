@@ -0,0 +1,202 @@
+"""
+Client side rate limiting that adapts to band API's quota answers.
+"""
+
+import random
+import threading
+import time
+
+# result_code band API answers instead of 1 when a quota is hit.
+#   1001: app quota exceeded
+#   1002: user quota exceeded
+RATE_LIMIT_CODES = (1001, 1002)
+
+# result_code of a write sent within the cooldown of one band, which
+# says nothing about the family's rate. scheduler.WriteScheduler keeps
+# the cooldown and sends the write again.
+COOLDOWN_CODE = 1003
+
+
+def is_rate_limited(content_dict):
+    """
+    Checks if decoded API response is a rate limit rejection.
+    """
+    try:
+        code = int(content_dict.get('result_code', 1))
+    except (TypeError, ValueError):
+        return False
+    return code in RATE_LIMIT_CODES
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate follows server feedback.
+
+    Description
+        acquire() takes one token, waiting for it if the bucket is empty.
+
+        on_rate_limited() cuts the rate in half, remembers the rate the
+        server refused as ceiling, and holds back every caller for a
+        jittered exponential backoff. Refusals of requests sent before
+        that cut answer the same overload: they wait out its backoff
+        but leave rate and ceiling alone, so a burst of refusals halves
+        the rate once.
+
+        on_success() raises the rate again: quickly while far under the
+        ceiling, then by small steps, so sustained rate sits just under
+        the server's limit instead of bursting into it over and over.
+        Until the server first refuses, there is no ceiling, and the
+        rate grows by 10% per success as long as callers had to wait
+        for it, so it follows demand instead of capping it.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 burst: int = None,
+                 min_rate: float = 0.1,
+                 max_rate: float = None,
+                 backoff_base: float = 1,
+                 backoff_max: float = 60,
+                 ):
+        """
+        AdaptiveRateLimiter init.
+
+        Parameter
+            rate: float
+                requests per second to start with.
+
+            burst: int
+                bucket size. if not burst, max(1, rate).
+
+            min_rate: float
+            max_rate: float
+                bounds of the adapted rate. if not max_rate, the rate
+                is only bounded by the ceiling the server sets.
+
+            backoff_base: float
+            backoff_max: float
+                seconds, backoff after n rate limits in a row is
+                uniform(0, min(backoff_max, backoff_base * 2 ** n)).
+        """
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.ceiling = None  # rate the server last refused
+        self.failures = 0
+        self.waited = False  # a caller waited for a token since last raise
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._cut_at = None  # time.monotonic() of the last slow down
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._blocked_until - now,
+                           (1 - self._tokens) / self.rate)
+                self.waited = True
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.ceiling is None:
+                if not self.waited:
+                    # the limiter is not what holds callers back
+                    return
+                rate = self.rate * 1.1
+            elif self.rate < self.ceiling * 0.9:
+                rate = self.rate * 1.1
+            else:
+                # close to where the server said no, probe slowly
+                rate = self.rate + self.ceiling * 0.01
+            self.waited = False
+            if self.max_rate is not None:
+                rate = min(self.max_rate, rate)
+            self.rate = rate
+
+    def on_rate_limited(self, sent_at: float = None):
+        """
+        Slows down after a rate limit answer.
+
+        Parameter
+            sent_at: float
+                time.monotonic() the refused request was sent at.
+                if not sent_at, the refusal is taken as a new one.
+
+        Return
+            float
+                backoff in seconds. acquire() already waits for it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (sent_at is not None and self._cut_at is not None
+                    and sent_at < self._cut_at):
+                # sent at the rate already cut for, wait with the others
+                self._tokens = min(self._tokens, 0)
+                return max(0.0, self._blocked_until - now)
+
+            self.failures += 1
+            self.ceiling = self.rate
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+            self._cut_at = now
+
+            cap = min(self.backoff_max, self.backoff_base * 2 ** self.failures)
+            backoff = random.uniform(0, cap)
+            self._blocked_until = max(self._blocked_until, now + backoff)
+            return backoff
+
+
+class RateLimits:
+    """
+    One AdaptiveRateLimiter per endpoint family.
+
+    Families
+        read: every get request
+        write: every post request (create / remove)
+        auth: token requests
+    """
+
+    def __init__(self,
+                 read: float = 10,
+                 write: float = 1,
+                 auth: float = 1,
+                 ):
+        """
+        RateLimits init.
+
+        Parameter
+            read: float
+            write: float
+            auth: float
+                starting requests per second of each family. Rates rise
+                from there while the server does not refuse, see
+                AdaptiveRateLimiter.
+        """
+        self.limiters = {
+            'read': AdaptiveRateLimiter(read),
+            'write': AdaptiveRateLimiter(write),
+            'auth': AdaptiveRateLimiter(auth),
+        }
+
+    def __getitem__(self, family):
+        return self.limiters[family]
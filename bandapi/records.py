@@ -0,0 +1,151 @@
+"""
+Output formats of the clients' list and profile results.
+
+    'dataframe': pd.DataFrame, like before (pandas is imported on first use)
+    'dict': the decoded json dicts as they are
+    'record': Record objects, attribute access with __slots__
+
+Helpers at the bottom read pages of any format the same way.
+"""
+
+import keyword
+import re
+
+OUTPUT_FORMATS = ('dataframe', 'dict', 'record')
+
+
+def check_output(output):
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(f'Param output must be one of {list(OUTPUT_FORMATS)}')
+    return output
+
+
+class Record:
+    """
+    Base of the compact item classes made by record_type.
+
+    Fields missing from an item are not set, so reading them raises
+    AttributeError like a missing DataFrame column does on itertuples.
+    """
+
+    __slots__ = ()
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__
+                if hasattr(self, name)}
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return self._asdict() == other._asdict()
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={value!r}'
+                           for name, value in self._asdict().items())
+        return f'Record({fields})'
+
+
+_record_types = {}
+
+
+def _attr_name(key):
+    name = re.sub(r'\W', '_', str(key))
+    if not name.isidentifier() or keyword.iskeyword(name):
+        name = f'_{name}'
+    return name
+
+
+def record_type(keys):
+    """
+    Gets the Record subclass for items with keys, made once per key set.
+    """
+    keys = tuple(keys)
+    cls = _record_types.get(keys)
+    if cls is None:
+        slots = tuple(_attr_name(key) for key in keys)
+        cls = type('Record', (Record,), {'__slots__': slots})
+        _record_types[keys] = cls
+    return cls
+
+
+def to_record(item):
+    cls = record_type(item)
+    record = cls.__new__(cls)
+    for name, value in zip(cls.__slots__, item.values()):
+        object.__setattr__(record, name, value)
+    return record
+
+
+def to_output(items, output, index=None):
+    """
+    Converts a list of item dicts into output format.
+
+    Parameter
+        items: list of dict
+        output: str
+            one of OUTPUT_FORMATS.
+
+        index: list
+            DataFrame index, only for 'dataframe'.
+    """
+    if output == 'dict':
+        return items
+    if output == 'record':
+        return [to_record(item) for item in items]
+
+    import pandas as pd
+    return pd.DataFrame.from_records(items, index=index)
+
+
+def to_single_output(item, output):
+    """
+    Converts one item dict (ex. a profile) into output format.
+    """
+    if output == 'dict':
+        return item
+    if output == 'record':
+        return to_record(item)
+
+    import pandas as pd
+    return pd.DataFrame.from_records(item, index=[0])
+
+
+def is_dataframe(page):
+    # pandas is only loaded if a dataframe could exist
+    return hasattr(page, 'iloc') and hasattr(page, 'columns')
+
+
+def field_values(page, name):
+    """
+    Values of field name of every item in page, None where missing.
+    """
+    if is_dataframe(page):
+        if name not in page.columns:
+            return [None] * len(page)
+        return page[name].tolist()
+    if page and isinstance(page[0], dict):
+        return [item.get(name) for item in page]
+    return [getattr(item, name, None) for item in page]
+
+
+def take(page, positions):
+    """
+    Items of page at positions, in the page's format.
+    """
+    if is_dataframe(page):
+        return page.iloc[list(positions)]
+    return [page[position] for position in positions]
+
+
+def iter_items(page):
+    """
+    Iterates items of page as dicts, whatever the format.
+    """
+    if is_dataframe(page):
+        for item in page.to_dict('records'):
+            # absent fields are NaN after DataFrame.from_records
+            yield {key: value for key, value in item.items()
+                   if not (isinstance(value, float) and value != value)}
+    else:
+        for item in page:
+            yield item if isinstance(item, dict) else item._asdict()
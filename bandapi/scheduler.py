@@ -0,0 +1,236 @@
+"""
+Write scheduler that keeps band's write cooldown without sleeping
+the whole process.
+"""
+
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+from bandapi.mutations import parse_message
+from bandapi.ratelimit import COOLDOWN_CODE
+
+# Band API refuses another write within 10 seconds of the last one.
+WRITE_COOLDOWN = 10.1
+
+WRITE_METHODS = ('write_post', 'delete_post', 'write_comment', 'delete_comment')
+
+
+class WriteScheduler:
+    """
+    Queues write calls of an APIClient and runs each as soon as its
+    cooldown slot is free.
+
+    Cooldown is tracked per band_key (per='band') or per access token
+    (per='token'). Jobs of different bands are interleaved round-robin,
+    so while one band waits out its cooldown the others keep writing.
+    Reads do not go through the scheduler and are never held back.
+
+    A write the server still refuses for cooldown (ratelimit.COOLDOWN_CODE),
+    ex. after a write from elsewhere, is queued again first in line of
+    its key and sent once another cooldown passed.
+
+    Sample
+        s = WriteScheduler(client)
+        futures = [s.submit('delete_comment', band_key, post_key, key)
+                   for key in comment_keys]
+        results = [f.result() for f in futures]
+    """
+
+    def __init__(self,
+                 client,
+                 cooldown: float = WRITE_COOLDOWN,
+                 per: str = 'band',
+                 max_workers: int = 4,
+                 cooldown_retries: int = 3,
+                 ):
+        """
+        WriteScheduler init.
+
+        Parameter
+            client: APIClient
+            cooldown: float
+                seconds between the end of a write and the next write
+                with the same cooldown key.
+
+            per: str
+                'band' or 'token', what the cooldown is kept for.
+
+            max_workers: int
+                writes allowed to run at once (on different keys).
+
+            cooldown_retries: int
+                times a write refused for cooldown is sent again. After
+                that, its future resolves to the refusal.
+        """
+        per_list = ['band', 'token']
+        if per not in per_list:
+            raise ValueError(f'Param per must be one of {per_list}')
+
+        self.client = client
+        self.cooldown = cooldown
+        self.per = per
+        self.cooldown_retries = cooldown_retries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='bandapi-write',
+                                            )
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # key -> deque of jobs, in turn order
+        self._ready_at = {}  # key -> time.monotonic() cooldown ends
+        self._running = set()  # keys with a write in flight
+        self._dispatcher = None
+        self._closed = False
+        self._stopped = False
+
+    def cooldown_key(self, band_key):
+        if self.per == 'band':
+            return band_key
+        return self.client.access_token
+
+    def submit(self, method, band_key, *args, **kwargs):
+        """
+        Queues client.{method}(band_key, *args, **kwargs).
+
+        Parameter
+            method: str
+                one of WRITE_METHODS.
+
+        Return
+            concurrent.futures.Future
+                resolves to the method's return value.
+        """
+        if method not in WRITE_METHODS:
+            raise ValueError(f'Param method must be one of {list(WRITE_METHODS)}')
+
+        future = Future()
+        job = (future, getattr(self.client, method), band_key, args, kwargs,
+               0, None)
+        key = self.cooldown_key(band_key)
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('cannot submit to a shut down WriteScheduler')
+            self._queues.setdefault(key, deque()).append(job)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch,
+                                                    name='bandapi-write-dispatch',
+                                                    daemon=True,
+                                                    )
+                self._dispatcher.start()
+            self._cond.notify_all()
+
+        return future
+
+    def pending(self):
+        """
+        Number of queued writes that have not started yet.
+        """
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting writes. With wait, returns after queued writes ran.
+        Without, writes that have not started are cancelled (a write
+        waiting to be sent again resolves to its last refusal) and writes
+        in flight finish in the background.
+        """
+        queued = []
+        with self._cond:
+            self._closed = True
+            if not wait:
+                self._stopped = True
+                for queue in self._queues.values():
+                    queued.extend(queue)
+                self._queues.clear()
+            self._cond.notify_all()
+        for future, *_, refusal in queued:
+            if not future.cancel():
+                future.set_result(refusal)
+        # the dispatcher is done submitting before the executor shuts down
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        self._executor.shutdown(wait=wait)
+
+    def _next_job(self):
+        """
+        Pops a job whose key is off cooldown.
+
+        Return
+            (key, job, None) or (None, None, seconds to wait)
+                seconds to wait is None when nothing is waiting on cooldown.
+        """
+        now = time.monotonic()
+        wait = None
+        for key, queue in self._queues.items():
+            if key in self._running:
+                continue
+            ready_at = self._ready_at.get(key, 0)
+            if ready_at <= now:
+                job = queue.popleft()
+                if queue:
+                    # go to the back of the line so other keys get a turn
+                    self._queues.move_to_end(key)
+                else:
+                    del self._queues[key]
+                return key, job, None
+            if wait is None or ready_at - now < wait:
+                wait = ready_at - now
+        return None, None, wait
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    key, job, wait = self._next_job()
+                    if job is not None:
+                        break
+                    if self._closed and not self._queues and not self._running:
+                        return
+                    self._cond.wait(timeout=wait)
+                self._running.add(key)
+            # outside the lock, so _run and submit() are not held up
+            self._executor.submit(self._run, key, job)
+
+    def _run(self, key, job):
+        future, send, band_key, args, kwargs, retries, _ = job
+        retry = False
+        # a job sent again is running already
+        if future.running() or future.set_running_or_notify_cancel():
+            try:
+                result = send(band_key, *args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                retry = (_cooling_down(result)
+                         and retries < self.cooldown_retries)
+                if not retry:
+                    future.set_result(result)
+            finished = time.monotonic()
+        else:
+            # cancelled before it ran, no write was sent
+            finished = time.monotonic() - self.cooldown
+
+        with self._cond:
+            self._running.discard(key)
+            self._ready_at[key] = max(self._ready_at.get(key, 0),
+                                      finished + self.cooldown)
+            # after shutdown(wait=False) nothing would send it again
+            requeue = retry and not self._stopped
+            if requeue:
+                job = (future, send, band_key, args, kwargs, retries + 1, result)
+                self._queues.setdefault(key, deque()).appendleft(job)
+            self._cond.notify_all()
+        if retry and not requeue:
+            future.set_result(result)
+
+
+def _cooling_down(result):
+    """
+    Whether result_data is a refusal for cooldown.
+    """
+    return (isinstance(result, dict)
+            and parse_message(result.get('message'))[0] == COOLDOWN_CODE)
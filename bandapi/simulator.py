@@ -0,0 +1,556 @@
+"""
+Local stand-in for openapi.band.us and auth.band.us, for tests and
+benchmarks without network.
+
+    with BandSimulator(latency=0.02) as sim:
+        client = APIClient(config=sim.config())
+        pages = list(client.get_posts(sim.band_keys[0], limit=None))
+
+Serves every endpoint APIClient uses with the API's response shapes:
+list pages of 20 items with paging.next_params, token refresh with
+rotation, 401 for unknown or expired access tokens, the write cooldown
+(result_code 1003) and an optional request quota (result_code 1001).
+Photo urls point at /media on the same host, which answers Range
+requests like a CDN.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import functools
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from bandapi.config import Config
+
+PAGE_SIZE = 20  # the API ignores limit
+
+_RANGE = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+class _Account:
+    def __init__(self, index, expires_in):
+        self.user_key = f'SIMuser{index:04d}'
+        self.access_token = f'sim-access-{index}-0'
+        self.refresh_token = f'sim-refresh-{index}-0'
+        self.expires_in = expires_in
+        self.expires_at = time.time() + expires_in
+        self.rotations = 0
+
+    def rotate(self, index):
+        self.rotations += 1
+        self.access_token = f'sim-access-{index}-{self.rotations}'
+        self.refresh_token = f'sim-refresh-{index}-{self.rotations}'
+        self.expires_at = time.time() + self.expires_in
+
+
+class BandSimulator:
+    """
+    Band API served from memory on a local port.
+
+    Description
+        Data is generated from seed: bands of posts (newest first),
+        comments of posts, albums of photos. Every account is a member
+        of every band. Writes change the data, so deletes are visible
+        to later reads.
+
+    Attribute
+        url: str
+            base url of both hosts, set by start().
+
+        band_keys: list of str
+        counts: dict
+            requests served per path, and 'unauthorized',
+            'cooldown', 'quota' and 'refresh' answers, and
+            'media_bytes' of photos sent.
+
+        media_cut: int
+            if set, photo responses are cut off after this many bytes
+            of body, as by a dropped connection.
+    """
+
+    def __init__(self,
+                 bands: int = 3,
+                 posts_per_band: int = 45,
+                 comments_per_post: int = 25,
+                 albums_per_band: int = 2,
+                 photos_per_album: int = 30,
+                 photo_size: int = 32768,
+                 accounts: int = 1,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 cooldown: float = 10,
+                 quota_per_second: float = None,
+                 expires_in: int = 3600,
+                 seed: int = 0,
+                 ):
+        """
+        BandSimulator init.
+
+        Parameter
+            bands, posts_per_band, comments_per_post,
+            albums_per_band, photos_per_album: int
+                size of the generated data.
+
+            photo_size: int
+                bytes of each photo. Photos at the same position of
+                different albums have the same content.
+
+            accounts: int
+                accounts with their own tokens and cooldowns.
+
+            latency: float
+            jitter: float
+                seconds every response is delayed, plus a random
+                0 to jitter on top.
+
+            cooldown: float
+                seconds an account must wait between writes to a band.
+
+            quota_per_second: float
+                requests per second per account answered normally,
+                the rest get result_code 1001. None for no quota.
+
+            expires_in: int
+                seconds access tokens live.
+
+            seed: int
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.cooldown = cooldown
+        self.quota_per_second = quota_per_second
+        self.photo_size = photo_size
+        self.media_cut = None
+        self.accounts = [_Account(i, expires_in) for i in range(accounts)]
+        self.counts = {}
+        self.url = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._last_write = {}  # (user_key, band_key) -> time
+        self._quota = {}  # user_key -> (second, requests)
+        self._server = None
+        self._next_key = 0
+
+        self.bands = {}
+        self.posts = {}  # band_key -> list of posts, newest first
+        self.comments = {}  # post_key -> list of comments, oldest first
+        self.albums = {}  # band_key -> list of albums
+        self.photos = {}  # photo_album_key -> list of photos
+        now = 1600000000000
+        for b in range(bands):
+            band_key = f'SIMband{b:04d}'
+            self.bands[band_key] = {'band_key': band_key, 'name': f'band {b}',
+                                    'cover': '', 'member_count': accounts}
+            posts = []
+            for p in range(posts_per_band):
+                post_key = f'{band_key}post{p:06d}'
+                comments = [self._comment(band_key, post_key, c, now + p * 1000 + c)
+                            for c in range(comments_per_post)]
+                self.comments[post_key] = comments
+                posts.append(self._post(band_key, post_key, now + p * 1000,
+                                        comments))
+            posts.reverse()
+            self.posts[band_key] = posts
+
+            self.albums[band_key] = []
+            for a in range(albums_per_band):
+                album_key = f'{band_key}album{a:04d}'
+                self.albums[band_key].append({
+                    'photo_album_key': album_key, 'name': f'album {a}',
+                    'photo_count': photos_per_album, 'created_at': now + a,
+                    'author': self._author(a)})
+                self.photos[album_key] = [
+                    {'photo_album_key': album_key,
+                     'photo_key': f'{album_key}photo{i:06d}',
+                     'url': f'{{url}}/media/{album_key}/{i}.jpg',
+                     'width': 640, 'height': 480, 'created_at': now + i,
+                     'author': self._author(i), 'comment_count': 0,
+                     'emotion_count': 0, 'is_video_thumbnail': False}
+                    for i in range(photos_per_album)]
+
+    @property
+    def band_keys(self):
+        return list(self.bands)
+
+    def _author(self, i):
+        account = self.accounts[i % len(self.accounts)]
+        return {'name': f'user {i % len(self.accounts)}', 'description': '',
+                'role': 'member', 'profile_image_url': '',
+                'user_key': account.user_key}
+
+    def _comment(self, band_key, post_key, i, created_at):
+        return {'band_key': band_key, 'post_key': post_key,
+                'comment_key': f'{post_key}comment{i:06d}',
+                'content': f'comment {i} ' + 'lorem ipsum ' * self._random.randint(1, 8),
+                'author': self._author(i), 'created_at': created_at,
+                'emotion_count': 0, 'is_audio_included': False}
+
+    def _post(self, band_key, post_key, created_at, comments, content=None,
+              author=None):
+        post = {'band_key': band_key, 'post_key': post_key,
+                'content': content or f'post {post_key} ' + 'lorem ipsum ' * self._random.randint(1, 30),
+                'author': author or self._author(self._random.randrange(100)),
+                'created_at': created_at,
+                'comment_count': len(comments), 'emotion_count': 0,
+                'photos': []}
+        if comments:
+            post['latest_comments'] = [{'body': c['content'], 'author': c['author'],
+                                        'created_at': c['created_at']}
+                                       for c in comments[-3:]]
+        return post
+
+    def config(self, account: int = 0, **kwargs):
+        """
+        Gets a config.Config pointing at the simulator as account.
+        """
+        return Config(client_id='sim', client_secret='sim',
+                      redirect_url='http://localhost',
+                      access_token=self.accounts[account].access_token,
+                      refresh_token=self.accounts[account].refresh_token,
+                      api_url=self.url, auth_url=self.url, **kwargs)
+
+    def start(self):
+        """
+        Starts serving in a thread.
+
+        Return
+            str
+                base url
+        """
+        simulator = self
+
+        class Handler(_Handler):
+            sim = simulator
+
+        self._server = _Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever,
+                         kwargs={'poll_interval': 0.05},
+                         name='bandapi-simulator', daemon=True).start()
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _new_key(self, prefix):
+        with self._lock:
+            self._next_key += 1
+            return f'{prefix}new{self._next_key:06d}'
+
+    def _account(self, access_token):
+        for account in self.accounts:
+            if account.access_token == access_token:
+                if account.expires_at <= time.time():
+                    return None
+                return account
+        return None
+
+    def _over_quota(self, account):
+        if self.quota_per_second is None:
+            return False
+        second = int(time.time())
+        with self._lock:
+            start, n = self._quota.get(account.user_key, (second, 0))
+            if start != second:
+                start, n = second, 0
+            self._quota[account.user_key] = (start, n + 1)
+            return n >= self.quota_per_second
+
+    def _cooling_down(self, account, band_key):
+        now = time.monotonic()
+        with self._lock:
+            key = (account.user_key, band_key)
+            if now - self._last_write.get(key, -self.cooldown) < self.cooldown:
+                return True
+            self._last_write[key] = now
+            return False
+
+    def media(self, path):
+        """
+        Gets the bytes of the photo at path, None if there is none.
+        """
+        match = re.match(r'^/media/([^/]+)/(\d+)\.jpg$', path)
+        if match is None:
+            return None
+        album_key, i = match.group(1), int(match.group(2))
+        if i >= len(self.photos.get(album_key, ())):
+            return None
+        return _photo_bytes(i, self.photo_size)
+
+    def handle(self, path, query):
+        """
+        Answers one request.
+
+        Return
+            (status, reason, body dict)
+        """
+        self._count(path)
+        if path == '/oauth2/token':
+            return self._token(query)
+
+        account = self._account(query.get('access_token'))
+        if account is None:
+            self._count('unauthorized')
+            return 401, 'Unauthorized', {'result_code': 10401,
+                                         'result_data': {'message': 'Unauthorized'}}
+        if self._over_quota(account):
+            self._count('quota')
+            return 200, 'OK', _fail(1001, 'App quota has been exceeded')
+
+        band_key = query.get('band_key')
+        if band_key is not None and band_key not in self.bands:
+            return 200, 'OK', _fail(60200, 'Band does not exist')
+
+        write = path.endswith(('/create', '/remove'))
+        if write and self._cooling_down(account, band_key):
+            self._count('cooldown')
+            return 200, 'OK', _fail(1003, 'Cool down time restriction')
+
+        route = _ROUTES.get(path)
+        if route is None:
+            return 404, 'Not Found', _fail(3000, 'Invalid request')
+        return 200, 'OK', route(self, account, query)
+
+    def _token(self, query):
+        if query.get('grant_type') != 'refresh_token':
+            return 200, 'OK', {'error': 'unsupported_grant_type',
+                               'error_description': 'only refresh_token'}
+        for index, account in enumerate(self.accounts):
+            if account.refresh_token == query.get('refresh_token'):
+                with self._lock:
+                    account.rotate(index)
+                self._count('refresh')
+                return 200, 'OK', {
+                    'access_token': account.access_token,
+                    'token_type': 'bearer',
+                    'refresh_token': account.refresh_token,
+                    'expires_in': account.expires_in,
+                    'scope': 'READ_POST WRITE_POST DELETE_POST READ_COMMENT '
+                             'CREATE_COMMENT DELETE_COMMENT READ_ALBUM READ_PHOTO',
+                    'user_key': account.user_key,
+                }
+        return 200, 'OK', {'error': 'invalid_grant',
+                           'error_description': 'Invalid refresh token'}
+
+    def _profile(self, account, query):
+        return _ok({'user_key': account.user_key, 'profile_image_url': '',
+                    'name': account.user_key, 'is_app_member': True,
+                    'message_allowed': True})
+
+    def _bands(self, account, query):
+        return _ok({'bands': list(self.bands.values())})
+
+    def _posts(self, account, query):
+        return _page(self.posts[query['band_key']], query)
+
+    def _post_detail(self, account, query):
+        for post in self.posts[query['band_key']]:
+            if post['post_key'] == query.get('post_key'):
+                return _ok({'post': post})
+        return _fail(60400, 'Post does not exist')
+
+    def _post_create(self, account, query):
+        band_key = query['band_key']
+        post_key = self._new_key(f'{band_key}post')
+        post = self._post(band_key, post_key, int(time.time() * 1000), [],
+                          content=query.get('content'),
+                          author=self._author(self.accounts.index(account)))
+        with self._lock:
+            self.posts[band_key].insert(0, post)
+            self.comments[post_key] = []
+        return _ok({'band_key': band_key, 'post_key': post_key})
+
+    def _post_remove(self, account, query):
+        posts = self.posts[query['band_key']]
+        with self._lock:
+            for i, post in enumerate(posts):
+                if post['post_key'] == query.get('post_key'):
+                    del posts[i]
+                    return _ok({'message': 'success'})
+        return _fail(60400, 'Invalid response')
+
+    def _comments(self, account, query):
+        comments = self.comments.get(query.get('post_key'))
+        if comments is None:
+            return _fail(60400, 'Post does not exist')
+        if query.get('sortby', '+created_at').startswith('-'):
+            comments = comments[::-1]
+        return _page(comments, query)
+
+    def _comment_create(self, account, query):
+        comments = self.comments.get(query.get('post_key'))
+        if comments is None:
+            return _fail(60400, 'Post does not exist')
+        comment = self._comment(query['band_key'], query['post_key'], 0,
+                                int(time.time() * 1000))
+        comment['comment_key'] = self._new_key(f'{query["post_key"]}comment')
+        comment['content'] = query.get('body', '')
+        comment['author'] = self._author(self.accounts.index(account))
+        with self._lock:
+            comments.append(comment)
+        return _ok({'message': 'success'})
+
+    def _comment_remove(self, account, query):
+        comments = self.comments.get(query.get('post_key'), [])
+        with self._lock:
+            for i, comment in enumerate(comments):
+                if comment['comment_key'] == query.get('comment_key'):
+                    del comments[i]
+                    return _ok({'message': 'success'})
+        return _fail(60400, 'Invalid response')
+
+    def _permissions(self, account, query):
+        asked = query.get('permissions', '').split(',')
+        return _ok({'permissions': [name for name in asked if name]})
+
+    def _albums(self, account, query):
+        return _page(self.albums[query['band_key']], query)
+
+    def _photos(self, account, query):
+        photos = self.photos.get(query.get('photo_album_key'), [])
+        page = _page(photos, query)
+        for item in page['result_data']['items']:
+            item['url'] = item['url'].replace('{url}', self.url)
+        return page
+
+
+_ROUTES = {
+    '/v2/profile': BandSimulator._profile,
+    '/v2.1/bands': BandSimulator._bands,
+    '/v2/band/posts': BandSimulator._posts,
+    '/v2.1/band/post': BandSimulator._post_detail,
+    '/v2.2/band/post/create': BandSimulator._post_create,
+    '/v2/band/post/remove': BandSimulator._post_remove,
+    '/v2/band/post/comments': BandSimulator._comments,
+    '/v2/band/post/comment/create': BandSimulator._comment_create,
+    '/v2/band/post/comment/remove': BandSimulator._comment_remove,
+    '/v2/band/permissions': BandSimulator._permissions,
+    '/v2/band/albums': BandSimulator._albums,
+    '/v2/band/album/photos': BandSimulator._photos,
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _photo_bytes(i, size):
+    # a jpeg start of image marker, then noise
+    return b'\xff\xd8\xff\xe0' + random.Random(i).randbytes(max(0, size - 4))
+
+
+def _ok(result_data):
+    return {'result_code': 1, 'result_data': result_data}
+
+
+def _fail(code, message):
+    return {'result_code': code, 'result_data': {'message': message}}
+
+
+def _page(items, query):
+    start = int(query.get('after') or 0)
+    page = [dict(item) for item in items[start:start + PAGE_SIZE]]
+    next_params = None
+    if start + PAGE_SIZE < len(items):
+        next_params = {'after': str(start + PAGE_SIZE), 'limit': str(PAGE_SIZE)}
+        if 'band_key' in query:
+            next_params['band_key'] = query['band_key']
+    return _ok({'paging': {'previous_params': None, 'next_params': next_params},
+                'items': page})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default of 5 drops connects of concurrent clients,
+    # which then retry after a second and skew the latency measured
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    sim = None
+
+    def log_message(self, *args):
+        pass
+
+    def _serve(self, query):
+        url = urlparse(self.path)
+        query = {**{name: values[0] for name, values in parse_qs(url.query).items()},
+                 **query}
+        delay = self.sim.latency + random.uniform(0, self.sim.jitter)
+        if delay:
+            time.sleep(delay)
+
+        status, reason, body = self.sim.handle(url.path, query)
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status, reason)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _serve_media(self, path):
+        data = self.sim.media(path)
+        if data is None:
+            self.send_error(404)
+            return
+        delay = self.sim.latency + random.uniform(0, self.sim.jitter)
+        if delay:
+            time.sleep(delay)
+
+        start, end = 0, len(data) - 1
+        match = _RANGE.match(self.headers.get('Range', ''))
+        if match is not None:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(end, int(match.group(2)))
+            if start >= len(data):
+                self.send_response(416, 'Range Not Satisfiable')
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206, 'Partial Content')
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        else:
+            self.send_response(200, 'OK')
+        body = data[start:end + 1]
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if self.sim.media_cut is not None and self.sim.media_cut < len(body):
+            body = body[:self.sim.media_cut]
+            self.close_connection = True
+        self.wfile.write(body)
+        self.sim._count('media')
+        with self.sim._lock:
+            self.sim.counts['media_bytes'] = (self.sim.counts.get('media_bytes', 0)
+                                              + len(body))
+
+    def do_GET(self):
+        if self.path.startswith('/media/'):
+            self._serve_media(urlparse(self.path).path)
+            return
+        self._serve({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        self._serve({name: values[0] for name, values in parse_qs(body).items()})
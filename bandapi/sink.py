@@ -0,0 +1,280 @@
+"""
+Streams crawled pages into a columnar dataset on disk.
+
+Requires pyarrow.
+
+    with DatasetSink('out/posts', kind='posts') as sink:
+        sink.consume(client.get_posts(band_key, limit=None), band_key=band_key)
+
+    table = read_dataset('out/posts')  # memory-mapped, readable mid-crawl
+"""
+
+import json
+import os
+import re
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from bandapi.cache import Unchanged
+from bandapi.records import iter_items
+
+SCHEMAS = {
+    'posts': pa.schema([
+        ('band_key', pa.string()),
+        ('post_key', pa.string()),
+        ('author_user_key', pa.string()),
+        ('author_name', pa.string()),
+        ('content', pa.string()),
+        ('created_at', pa.int64()),
+        ('comment_count', pa.int64()),
+        ('emotion_count', pa.int64()),
+        ('photos', pa.string()),  # json
+        ('latest_comments', pa.string()),  # json
+    ]),
+    'comments': pa.schema([
+        ('band_key', pa.string()),
+        ('post_key', pa.string()),
+        ('comment_key', pa.string()),
+        ('author_user_key', pa.string()),
+        ('author_name', pa.string()),
+        ('content', pa.string()),
+        ('created_at', pa.int64()),
+        ('emotion_count', pa.int64()),
+    ]),
+    'photos': pa.schema([
+        ('band_key', pa.string()),
+        ('photo_album_key', pa.string()),
+        ('photo_key', pa.string()),
+        ('url', pa.string()),
+        ('width', pa.int64()),
+        ('height', pa.int64()),
+        ('created_at', pa.int64()),
+        ('author_user_key', pa.string()),
+        ('comment_count', pa.int64()),
+        ('emotion_count', pa.int64()),
+        ('is_video_thumbnail', pa.bool_()),
+    ]),
+}
+
+# fields kept as json strings instead of nested columns
+_JSON_FIELDS = ('photos', 'latest_comments')
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def _row(item, schema, defaults):
+    author = item.get('author') or {}
+    row = {}
+    for name in schema.names:
+        if name == 'author_user_key':
+            value = author.get('user_key')
+        elif name == 'author_name':
+            value = author.get('name')
+        else:
+            value = item.get(name, defaults.get(name))
+            if name in _JSON_FIELDS and value is not None:
+                value = json.dumps(value, ensure_ascii=False)
+        row[name] = value
+    return row
+
+
+class DatasetSink:
+    """
+    Appends pages of one kind (posts, comments, photos) to a directory
+    of Parquet or Arrow IPC part files with a fixed schema.
+
+    Description
+        Rows are buffered up to row_group_size and written as one row
+        group / record batch, and a new part file is started every
+        rows_per_file rows, so memory stays flat whatever the band size.
+
+        A part is written as a hidden temp file and renamed when it is
+        complete, so readers (read_dataset) only ever see whole files.
+        By default every row group completes its part, so rows become
+        readable every row_group_size rows while the crawl goes on.
+    """
+
+    def __init__(self,
+                 directory,
+                 kind: str = 'posts',
+                 format: str = 'parquet',
+                 row_group_size: int = 1000,
+                 rows_per_file: int = None,
+                 ):
+        """
+        DatasetSink init.
+
+        Parameter
+            directory: str
+                made if missing. Part files are numbered on from the
+                highest part already there.
+
+            kind: str
+                'posts', 'comments' or 'photos', picks the schema.
+
+            format: str
+                'parquet' or 'arrow' (IPC file, fastest to memory-map).
+
+            row_group_size: int
+            rows_per_file: int
+                if not rows_per_file, row_group_size: a part per row
+                group. More rows per part make fewer, bigger files, but
+                readers see them later.
+        """
+        if kind not in SCHEMAS:
+            raise ValueError(f'Param kind must be one of {list(SCHEMAS)}')
+        if format not in FORMATS:
+            raise ValueError(f'Param format must be one of {list(FORMATS)}')
+
+        self.directory = directory
+        self.kind = kind
+        self.format = format
+        self.schema = SCHEMAS[kind]
+        self.row_group_size = row_group_size
+        self.rows_per_file = rows_per_file or row_group_size
+        self.rows_written = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._part = max(map(_part_number, _part_paths(directory, format)),
+                         default=-1) + 1
+        self._buffer = []
+        self._writer = None
+        self._tmp_path = None
+        self._final_path = None
+        self._file_rows = 0
+
+    def write(self, page, **defaults):
+        """
+        Buffers one page.
+
+        Parameter
+            page: page of any output format (see records.py).
+                cache.Unchanged pages are skipped.
+
+            **defaults
+                values for fields the items lack, ex. band_key='...'.
+        """
+        if isinstance(page, Unchanged):
+            return
+        for item in iter_items(page):
+            self._buffer.append(_row(item, self.schema, defaults))
+        if len(self._buffer) >= self.row_group_size:
+            self._write_buffer()
+
+    def consume(self, pages, **defaults):
+        """
+        Writes every page of a page generator.
+
+        Parameter
+            pages: iterable
+                of (page, after) as get_posts yields, or of
+                (band_key, page) as crawler.Crawler yields.
+
+        Return
+            int
+                rows written in total.
+        """
+        for first, second in pages:
+            if isinstance(first, str):
+                self.write(second, **{'band_key': first, **defaults})
+            else:
+                self.write(first, **defaults)
+        self.flush()
+        return self.rows_written
+
+    def flush(self):
+        """
+        Writes buffered rows and completes the current part file.
+        """
+        self._write_buffer()
+        self._close_part()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+        table = pa.Table.from_pylist(self._buffer, schema=self.schema)
+        self._buffer = []
+
+        if self._writer is None:
+            self._open_part()
+        if self.format == 'parquet':
+            self._writer.write_table(table)
+        else:
+            for batch in table.to_batches():
+                self._writer.write_batch(batch)
+
+        self._file_rows += table.num_rows
+        self.rows_written += table.num_rows
+        if self._file_rows >= self.rows_per_file:
+            self._close_part()
+
+    def _open_part(self):
+        name = f'part-{self._part:05d}{FORMATS[self.format]}'
+        self._final_path = os.path.join(self.directory, name)
+        self._tmp_path = os.path.join(self.directory, f'.{name}.tmp')
+        if self.format == 'parquet':
+            self._writer = pq.ParquetWriter(self._tmp_path, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(self._tmp_path, self.schema)
+        self._file_rows = 0
+
+    def _close_part(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        os.replace(self._tmp_path, self._final_path)
+        self._writer = None
+        self._part += 1
+
+
+def _part_number(path):
+    return int(re.match(r'part-(\d+)', os.path.basename(path)).group(1))
+
+
+def _part_paths(directory, format):
+    """
+    Complete part files of a directory, in part number order.
+    """
+    if not os.path.isdir(directory):
+        return []
+    pattern = re.compile(rf'part-\d+{re.escape(FORMATS[format])}')
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+             if pattern.fullmatch(name)]
+    return sorted(paths, key=_part_number)
+
+
+def read_dataset(directory, format: str = 'parquet', kind: str = None):
+    """
+    Reads every complete part file of a DatasetSink directory.
+
+    Description
+        Files are memory-mapped, so Arrow IPC parts are read without
+        copying and only the pages touched are loaded. Parts still
+        being written are not visible yet.
+
+    Parameter
+        kind: str
+            schema of the empty table returned when there is no part yet.
+
+    Return
+        pyarrow.Table
+    """
+    tables = []
+    for path in _part_paths(directory, format):
+        if format == 'parquet':
+            tables.append(pq.read_table(path, memory_map=True))
+        else:
+            tables.append(pa.ipc.open_file(pa.memory_map(path)).read_all())
+    if not tables:
+        return SCHEMAS[kind].empty_table() if kind else pa.table({})
+    return pa.concat_tables(tables)
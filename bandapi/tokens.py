@@ -0,0 +1,361 @@
+"""
+Access token shared by every client and worker.
+
+    client = APIClient()  # uses tokens.default_manager()
+    client = APIClient(token_manager=TokenManager(FileTokenStore('token.json')))
+
+A token store is any object with
+    load() -> dict or None
+        the last saved token profile.
+
+    save(profile)
+        keeps profile, a dict with at least access_token, refresh_token
+        and expires_at (epoch seconds, None if unknown).
+
+    lock() -> context manager, optional
+        held around load, refresh and save so processes sharing the
+        store refresh one at a time and see each other's tokens.
+
+so a keyring or a database can back it as well as the stores here.
+"""
+
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, FileTokenStore only locks threads there
+    fcntl = None
+
+from bandapi import auth
+from bandapi import util
+from bandapi.config import default_config
+
+
+class MemoryTokenStore:
+    """
+    Keeps the token profile in memory, shared within one process.
+    """
+
+    def __init__(self):
+        self._profile = None
+
+    def load(self):
+        return dict(self._profile) if self._profile is not None else None
+
+    def save(self, profile):
+        self._profile = dict(profile)
+
+    def lock(self):
+        return contextlib.nullcontext()
+
+
+class FileTokenStore:
+    """
+    Keeps the token profile in a json file, so every process using the
+    same path picks up a rotated token.
+
+    The file is replaced atomically (util.atomic_write_json) and made
+    readable by its owner only. lock() takes an advisory fcntl.flock
+    on path + '.lock', which every process on the host honours.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f'{path}.lock'
+        self._thread_lock = threading.RLock()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, profile):
+        util.atomic_write_json(self.path, profile)
+
+    @contextlib.contextmanager
+    def lock(self):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class SQLiteTokenStore:
+    """
+    Keeps the token profile in a SQLite database.
+
+    lock() is a write transaction (BEGIN IMMEDIATE), so processes
+    queue on it for up to timeout seconds, also on hosts without fcntl.
+    """
+
+    def __init__(self, path, timeout: float = 30):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        # autocommit, lock() opens the transaction itself
+        self._conn = sqlite3.connect(path, timeout=timeout,
+                                     isolation_level=None,
+                                     check_same_thread=False,
+                                     )
+        with self._thread_lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS token (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    profile TEXT NOT NULL
+                )''')
+
+    def load(self):
+        with self._thread_lock:
+            row = self._conn.execute(
+                'SELECT profile FROM token WHERE id = 1').fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def save(self, profile):
+        with self._thread_lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO token (id, profile) VALUES (1, ?)',
+                (json.dumps(profile),))
+
+    @contextlib.contextmanager
+    def lock(self):
+        with self._thread_lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def close(self):
+        self._conn.close()
+
+
+class TokenManager:
+    """
+    Hands out the access token and refreshes it.
+
+    Description
+        Refresh is single-flight: callers that find the token stale at
+        the same time wait for one refresh and all get its result,
+        instead of each rotating the refresh token.
+
+        The token is refreshed ahead of time once it is within
+        refresh_margin seconds of expires_in, so workers do not have
+        to run into unauthorized answers first.
+
+        Every rotated access / refresh pair is saved to the store.
+        If the store is empty, the pair is taken from config
+        (BANDAPI_ACCESS_TOKEN / BANDAPI_REFRESH_TOKEN by default).
+
+        With a FileTokenStore or SQLiteTokenStore, this holds across
+        processes too: a refresh runs under the store's lock and first
+        reads the store again, so a process that waited on another's
+        refresh takes its token instead of rotating the refresh token
+        once more (which would invalidate the other's).
+    """
+
+    def __init__(self,
+                 store=None,
+                 refresh_margin: float = 300,
+                 config=None,
+                 ):
+        """
+        TokenManager init.
+
+        Parameter
+            store: token store (see module doc)
+                if not store, MemoryTokenStore().
+
+            refresh_margin: float
+                seconds before expiry to refresh at.
+
+            config: config.Config
+                credentials to refresh with and first token pair.
+                if not config, config.default_config().
+        """
+        self.store = store if store is not None else MemoryTokenStore()
+        self.refresh_margin = refresh_margin
+        self.config = config or default_config()
+        self._lock = threading.Lock()
+        self._profile = None
+        # called with the new profile after every refresh request
+        self.on_refresh = []
+
+    def _load(self):
+        profile = self.store.load()
+        if profile is None:
+            profile = {
+                'access_token': self.config.access_token,
+                'refresh_token': self.config.refresh_token,
+                'expires_at': None,
+            }
+        return profile
+
+    def _expiring(self, profile):
+        expires_at = profile.get('expires_at')
+        return (expires_at is not None
+                and expires_at - self.refresh_margin <= time.time())
+
+    def expiring(self):
+        """
+        Whether access_token would refresh (or load the store) first.
+        """
+        profile = self._profile
+        return profile is None or self._expiring(profile)
+
+    def access_token(self, session=None, timeout=None, limiter=None):
+        """
+        Gets the current access_token, refreshed first if it expires soon.
+
+        Parameter
+            session, timeout, limiter
+                see refresh.
+
+        Raise
+            KeyError
+                if there is no access token at all.
+        """
+        profile = self._profile
+        if profile is None or self._expiring(profile):
+            with self._lock:
+                if self._profile is None:
+                    self._profile = self._load()
+                if self._expiring(self._profile):
+                    self._refresh_shared(self._profile['access_token'],
+                                         session, timeout, limiter)
+                profile = self._profile
+
+        if not profile['access_token']:
+            raise KeyError('BANDAPI_ACCESS_TOKEN')
+        return profile['access_token']
+
+    def refresh(self, stale_token=None, session=None, timeout=None,
+                limiter=None):
+        """
+        Gets a new access_token with the refresh token.
+
+        Parameter
+            stale_token: str
+                the token that was refused. If the token has changed
+                since (another caller refreshed it), that one is
+                returned and no request is sent.
+
+            session: requests.Session
+            timeout: float or (connect, read) tuple
+                see auth.get_refreshed_auth_profile.
+
+            limiter: ratelimit.AdaptiveRateLimiter
+                acquired before the refresh request, if one is sent.
+
+        Raise
+            KeyError
+                if there is no refresh token.
+
+        Return
+            str
+                access_token
+        """
+        with self._lock:
+            return self._refresh_shared(stale_token, session, timeout, limiter)
+
+    def _store_lock(self):
+        lock = getattr(self.store, 'lock', None)
+        return lock() if lock is not None else contextlib.nullcontext()
+
+    def _refresh_shared(self, stale_token, session, timeout, limiter):
+        with self._store_lock():
+            # another client or process may have refreshed already
+            profile = self._load()
+            self._profile = profile
+            if (stale_token is not None
+                    and profile['access_token'] != stale_token
+                    and not self._expiring(profile)):
+                return profile['access_token']
+
+            return self._refresh(session, timeout, limiter)
+
+    def _refresh(self, session, timeout, limiter):
+        refresh_token = self._profile.get('refresh_token')
+        if not refresh_token:
+            raise KeyError('BANDAPI_REFRESH_TOKEN')
+
+        if limiter is not None:
+            limiter.acquire()
+        token_profile = auth.get_refreshed_auth_profile(refresh_token,
+                                                        session=session,
+                                                        timeout=timeout,
+                                                        config=self.config,
+                                                        )
+        profile = dict(token_profile)
+        # keep the old refresh token if the server did not rotate it
+        profile['refresh_token'] = token_profile.get('refresh_token',
+                                                     refresh_token)
+        expires_in = token_profile.get('expires_in')
+        profile['expires_at'] = (time.time() + float(expires_in)
+                                 if expires_in else None)
+
+        self.store.save(profile)
+        self._profile = profile
+        for hook in self.on_refresh:
+            hook(profile)
+        return profile['access_token']
+
+
+def open_store(path):
+    """
+    Token store at path: a SQLiteTokenStore for .db / .sqlite paths,
+    a FileTokenStore otherwise.
+    """
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SQLiteTokenStore(path)
+    return FileTokenStore(path)
+
+
+_default_managers = weakref.WeakKeyDictionary()  # Config -> TokenManager
+_default_lock = threading.Lock()
+
+
+def default_manager(config=None):
+    """
+    Gets the TokenManager every client of config uses unless given
+    another, one per Config.
+
+    Parameter
+        config: config.Config
+            if not config, config.default_config().
+
+    Description
+        Its store is open_store(config.token_file) if set, else a
+        MemoryTokenStore.
+    """
+    config = config or default_config()
+    with _default_lock:
+        manager = _default_managers.get(config)
+        if manager is None:
+            token_file = config.token_file
+            store = open_store(token_file) if token_file else MemoryTokenStore()
+            manager = TokenManager(store, config=config)
+            _default_managers[config] = manager
+        return manager
+
+
+def reset_default_managers():
+    """
+    Forgets the default managers, so the next ones read config again.
+    """
+    with _default_lock:
+        _default_managers.clear()
@@ -2,11 +2,13 @@
 Utility function
 """
 
-from requests import request
+import requests
+from requests.adapters import HTTPAdapter
 
 from bandapi import config
 import json
 import os
+import tempfile
 
 
 def print_json(string, indent=4, sort_keys=False):
@@ -18,9 +20,79 @@ def print_json(string, indent=4, sort_keys=False):
     print(string)
 
 
+def new_session(pool_connections=4, pool_maxsize=16, max_retries=0,
+                adapter_class=HTTPAdapter):
+    """
+    Makes requests.Session with keep-alive connection pools.
+
+    Parameter
+        pool_connections: int
+            number of per-host pools to cache.
+
+        pool_maxsize: int
+            connections kept alive in each host pool.
+            Should be at least the number of threads sharing the session.
+
+        max_retries: int
+            retries on connection failures (not on responses).
+
+        adapter_class: type
+            HTTPAdapter or a subclass, ex. metrics.TimedHTTPAdapter.
+
+    Return
+        requests.Session
+    """
+    session = requests.Session()
+    adapter = adapter_class(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          max_retries=max_retries,
+                          )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def atomic_write_json(path, obj):
+    """
+    Writes obj as json to path so that path always holds either the
+    old or the new content, even if the process dies midway.
+
+    Description
+        Writes a temp file next to path, fsyncs it, os.replace()s it
+        over path, and fsyncs the directory so the rename is durable.
+    """
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory,
+                                    prefix=f'.{os.path.basename(path)}-',
+                                    suffix='.tmp',
+                                    )
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
 def purge_env_var():
-    del os.environ['BANDAPI_CLIENT_ID']
-    del os.environ['BANDAPI_CLIENT_SECRET']
-    del os.environ['BANDAPI_REDIRECT_URL']
-    del os.environ['BANDAPI_ACCESS_TOKEN']
-    del os.environ['BANDAPI_REFRESH_TOKEN']
+    """
+    Removes the BANDAPI_* env vars and the token managers made from
+    them, so the next client reads its credentials anew.
+    """
+    # tokens imports this module
+    from bandapi import tokens
+
+    for env_var, _ in config.ENV_VARS.values():
+        os.environ.pop(env_var, None)
+    tokens.reset_default_managers()
@@ -0,0 +1,219 @@
+"""
+Load benchmark of every client mode against simulator.BandSimulator.
+
+Run from the repository root, no network needed:
+    python -m benchmark.bench_client [--latency 0.02] [--bands 4] ...
+
+Each mode crawls every post of every band, then the comments of every
+post that has any, and reports:
+    requests/sec, p50 / p99 latency of api_request, full-crawl wall
+    time, peak traced memory of the crawl (pages dropped as they are
+    consumed) and memory of one posts page kept in the output format.
+
+Client side rate limits are lifted, so the simulator's latency and
+the client's own overhead are what is measured.
+"""
+
+import argparse
+import asyncio
+import functools
+import statistics
+import time
+import tracemalloc
+
+from bandapi.client import APIClient
+from bandapi.crawler import Crawler
+from bandapi.pool import ClientPool
+from bandapi.ratelimit import RateLimits
+from bandapi.records import iter_items
+from bandapi.simulator import BandSimulator
+
+try:
+    from bandapi.async_client import AsyncAPIClient
+except ImportError:  # aiohttp not installed
+    AsyncAPIClient = None
+
+
+def unlimited():
+    return RateLimits(read=1e9, write=1e9, auth=1e9)
+
+
+def timed_requests(client, latencies):
+    """
+    Wraps client.api_request to record each call's seconds.
+    """
+    api_request = client.api_request
+    if asyncio.iscoroutinefunction(api_request):
+        @functools.wraps(api_request)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await api_request(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+    else:
+        @functools.wraps(api_request)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return api_request(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+    client.api_request = wrapper
+
+
+def has_comments(item):
+    return bool(item.get('latest_comments') or item.get('comment_count'))
+
+
+def crawl_sequential(client, band_keys):
+    for band_key in band_keys:
+        for page, _ in client.get_posts(band_key, limit=None):
+            for post in iter_items(page):
+                if has_comments(post):
+                    for _ in client.get_comments(band_key, post['post_key']):
+                        pass
+
+
+def crawl_threaded(client, band_keys):
+    crawler = Crawler(client, max_workers=8)
+    for _ in crawler.crawl_comments(crawler.crawl(band_keys)):
+        pass
+
+
+async def crawl_async(client, band_keys):
+    async def comments(band_key, post_key):
+        async for _ in client.get_comments(band_key, post_key):
+            pass
+
+    async def band(band_key):
+        tasks = []
+        async for page, _ in client.get_posts(band_key, limit=None):
+            tasks += [comments(band_key, post['post_key'])
+                      for post in iter_items(page) if has_comments(post)]
+        await asyncio.gather(*tasks)
+
+    async with client:
+        await asyncio.gather(*(band(band_key) for band_key in band_keys))
+
+
+def modes(sim):
+    """
+    name -> (make client, crawl(client, band_keys), page memory or not)
+    """
+    def sync(**kwargs):
+        return lambda: APIClient(config=sim.config(), rate_limits=unlimited(),
+                                 **kwargs)
+
+    found = {
+        'sync dataframe': (sync(output='dataframe'), crawl_sequential, True),
+        'sync dict': (sync(output='dict'), crawl_sequential, True),
+        'sync record': (sync(output='record'), crawl_sequential, True),
+        'sync prefetch=4': (sync(output='dict', prefetch=4), crawl_sequential, False),
+        'crawler 8 threads': (sync(output='dict'), crawl_threaded, False),
+    }
+    if len(sim.accounts) > 1:
+        found[f'pool {len(sim.accounts)} accounts'] = (
+            lambda: ClientPool([sim.config(i) for i in range(len(sim.accounts))],
+                               output='dict', rate_limits=None),
+            crawl_threaded, False)
+    if AsyncAPIClient is not None:
+        found['async'] = (
+            lambda: AsyncAPIClient(config=sim.config(), output='dict'),
+            lambda client, band_keys: asyncio.run(crawl_async(client, band_keys)),
+            False)
+    return found
+
+
+def page_memory(make_client, band_key):
+    """
+    Bytes one posts page takes, kept in the client's output format.
+    """
+    client = make_client()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    pages = [page for page, _ in client.get_posts(band_key, limit=None)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    client.close()
+    return size / len(pages)
+
+
+def close(client):
+    if AsyncAPIClient is not None and isinstance(client, AsyncAPIClient):
+        return  # closed by its crawl
+    client.close()
+
+
+def run(make_client, crawl, band_keys):
+    client = make_client()
+    latencies = []
+    if isinstance(client, ClientPool):
+        for member in client.clients:
+            member.rate_limits = unlimited()
+            timed_requests(member, latencies)
+    else:
+        timed_requests(client, latencies)
+
+    start = time.perf_counter()
+    crawl(client, band_keys)
+    wall = time.perf_counter() - start
+    close(client)
+    return wall, latencies
+
+
+def traced_peak(make_client, crawl, band_keys):
+    client = make_client()
+    tracemalloc.start()
+    crawl(client, band_keys)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    close(client)
+    return peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds the simulator delays each response')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--bands', type=int, default=4)
+    parser.add_argument('--posts', type=int, default=100,
+                        help='posts per band')
+    parser.add_argument('--comments', type=int, default=25,
+                        help='comments per post')
+    parser.add_argument('--accounts', type=int, default=2,
+                        help='simulated accounts, for the pool mode')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the traced memory runs')
+    args = parser.parse_args(argv)
+
+    with BandSimulator(bands=args.bands, posts_per_band=args.posts,
+                       comments_per_post=args.comments,
+                       accounts=args.accounts, latency=args.latency,
+                       jitter=args.jitter) as sim:
+        band_keys = sim.band_keys
+        print(f'{args.bands} bands x {args.posts} posts x {args.comments} '
+              f'comments, latency {args.latency * 1e3:.1f} ms')
+        print(f'{"mode":<20} {"requests":>8} {"req/s":>8} {"p50 ms":>8} '
+              f'{"p99 ms":>8} {"wall s":>8} {"peak MiB":>9} {"KiB/page":>9}')
+
+        for name, (make_client, crawl, per_page) in modes(sim).items():
+            wall, latencies = run(make_client, crawl, band_keys)
+            latencies.sort()
+            p50 = statistics.median(latencies)
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+
+            peak = page = '-'
+            if not args.no_memory:
+                peak = f'{traced_peak(make_client, crawl, band_keys) / 2 ** 20:.1f}'
+                if per_page:
+                    page = f'{page_memory(make_client, band_keys[0]) / 1024:.1f}'
+
+            print(f'{name:<20} {len(latencies):>8} {len(latencies) / wall:>8.0f} '
+                  f'{p50 * 1e3:>8.2f} {p99 * 1e3:>8.2f} {wall:>8.2f} '
+                  f'{peak:>9} {page:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Decode time and peak memory of each decoding.py decoder on list pages.
+
+Run from the repository root:
+    python -m benchmark.bench_decode [payload.json ...]
+
+Pass response bodies recorded from the API (ex. saved with
+curl 'https://openapi.band.us/v2/band/posts?...' > posts.json) to
+measure those. Without arguments, pages shaped like the API's posts and
+comments responses are made up: a normal 20 item page and a large one.
+
+'str + json' is what api_request did before decoders: decode the body
+to a str, then json.loads it. Peak memory counts reading the body too,
+which 'stream' does in chunks instead of whole.
+"""
+
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+from bandapi import decoding
+
+
+def make_page(n_items, kind='posts'):
+    items = []
+    for i in range(n_items):
+        item = {
+            'content': f'{kind} item {i} ' + 'lorem ipsum dolor sit amet ' * 8,
+            'author': {
+                'name': f'user{i % 50}',
+                'description': '',
+                'role': 'member',
+                'profile_image_url': f'https://coresos.phinf.naver.net/a/{i}.jpg',
+                'user_key': f'AAB{i % 50:05d}',
+            },
+            'created_at': 1600000000000 + i,
+            'emotion_count': i % 7,
+        }
+        if kind == 'posts':
+            item.update({
+                'post_key': f'AADpost{i:08d}',
+                'band_key': 'AADband0000',
+                'comment_count': i % 11,
+                'photos': [{'url': f'https://coresos.phinf.naver.net/p/{i}_{j}.jpg',
+                            'width': 1024, 'height': 768,
+                            'photo_key': f'AAJ{i}_{j}',
+                            'is_video_thumbnail': False}
+                           for j in range(i % 3)],
+                'latest_comments': [{'body': 'hi', 'author': {'name': 'x'},
+                                     'created_at': 1600000000000}],
+            })
+        else:
+            item['comment_key'] = f'AAFcomment{i:08d}'
+        items.append(item)
+
+    body = {
+        'result_code': 1,
+        'result_data': {
+            'paging': {'previous_params': None,
+                       'next_params': {'after': 'AABcursor', 'limit': '20',
+                                       'band_key': 'AADband0000'}},
+            'items': items,
+        },
+    }
+    return json.dumps(body, ensure_ascii=False).encode('utf-8')
+
+
+def whole(decode):
+    # reads the whole body first, like response.content
+    return lambda raw: decode(raw.read())
+
+
+def decoders():
+    """
+    name -> callable(raw), raw being a file-like body like response.raw
+    """
+    found = {'str + json': whole(lambda body: json.loads(body.decode('utf-8'))),
+             'json': whole(decoding.JSONDecoder().decode)}
+    if decoding.orjson is not None:
+        found['orjson'] = whole(decoding.OrjsonDecoder().decode)
+    try:
+        found['stream'] = decoding.StreamingDecoder().decode_stream
+    except ImportError:
+        pass
+    return found
+
+
+def timed(n, call):
+    start = time.perf_counter()
+    for _ in range(n):
+        call()
+    return (time.perf_counter() - start) / n
+
+
+class Socket(io.RawIOBase):
+    """
+    Body handed out in reads like a socket's, so it is only in memory
+    as a whole if the decoder reads it whole.
+    """
+
+    def __init__(self, body):
+        self._body = memoryview(body)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), len(self._body) - self._pos)
+        buffer[:n] = self._body[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+def peak_memory(call, body):
+    """
+    Peak bytes allocated while reading and decoding body.
+    """
+    tracemalloc.start()
+    result = call(Socket(body))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def main(*paths):
+    if paths:
+        payloads = {}
+        for path in paths:
+            with open(path, 'rb') as f:
+                payloads[path] = f.read()
+    else:
+        payloads = {
+            'posts, 20 items': make_page(20, 'posts'),
+            'comments, 20 items': make_page(20, 'comments'),
+            'posts, 5000 items': make_page(5000, 'posts'),
+        }
+
+    for name, body in payloads.items():
+        n = max(3, min(2000, 20000000 // len(body)))
+        print(f'{name}: {len(body) / 1024:.1f} KiB, {n} runs')
+        baseline = None
+        for decoder_name, call in decoders().items():
+            seconds = timed(n, lambda: call(Socket(body)))
+            peak = peak_memory(call, body)
+            baseline = baseline or seconds
+            print(f'  {decoder_name:<11}: {seconds * 1e3:9.3f} ms/page '
+                  f'({baseline / seconds:5.2f}x)  '
+                  f'peak {peak / 1024:9.1f} KiB')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
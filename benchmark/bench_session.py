@@ -0,0 +1,85 @@
+"""
+Per-request latency of one-off connections vs APIClient's pooled session.
+
+Run from the repository root:
+    python -m benchmark.bench_session [n_requests]
+
+A local keep-alive HTTP stub stands in for openapi.band.us, so the gain
+shown is only the TCP connect; on the real host every one-off request
+also pays DNS and the TLS handshake.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import threading
+import time
+
+import requests
+
+from bandapi import client
+from bandapi.config import Config
+from bandapi.ratelimit import RateLimits
+
+PROFILE = json.dumps({
+    "result_code": 1,
+    "result_data": {
+        "user_key": "bench_user",
+        "profile_image_url": "",
+        "name": "bench",
+        "is_app_member": True,
+        "message_allowed": True,
+    },
+}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(PROFILE)))
+        self.end_headers()
+        self.wfile.write(PROFILE)
+
+    def log_message(self, *args):
+        pass
+
+
+def timed(n, call):
+    start = time.perf_counter()
+    for _ in range(n):
+        call()
+    return (time.perf_counter() - start) / n
+
+
+def main(n=500):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    url = f'{base_url}/v2/profile'
+
+    one_off = timed(n, lambda: requests.get(url, params={'access_token': 'x'}))
+
+    config = Config(client_id='bench', client_secret='bench',
+                    redirect_url='http://localhost', access_token='bench',
+                    api_url=base_url)
+    # no client side throttling, only connection cost is measured
+    with client.APIClient(config=config,
+                          rate_limits=RateLimits(read=1e9)) as c:
+        c.get_profile()  # open the pooled connection once
+        pooled = timed(n, lambda: c.api_request('get', url, {}))
+
+    server.shutdown()
+
+    print(f'requests: {n}')
+    print(f'one-off connection : {one_off * 1e3:8.3f} ms/request')
+    print(f'pooled session     : {pooled * 1e3:8.3f} ms/request')
+    print(f'gain               : {(one_off - pooled) * 1e3:8.3f} ms/request '
+          f'({one_off / pooled:.2f}x)')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -1,4 +1,17 @@
+"""
+Gets a new token pair with a browser login.
+
+    python get_token.py [TOKEN_FILE]
+
+With TOKEN_FILE, the pair is also saved to that token store (see
+bandapi.tokens.open_store), ex. for application.purge --token-file.
+"""
+
+import sys
+import time
+
 from bandapi import auth
+from bandapi import tokens
 
 print("""
 I can get access_token for you, but I need you to follow my instructions.
@@ -30,3 +43,13 @@ or
 export BANDAPI_ACCESS_TOKEN={access_token}
 export BANDAPI_REFRESH_TOKEN={refresh_token}
 """)
+
+if len(sys.argv) > 1:
+    token_file = sys.argv[1]
+    store = tokens.open_store(token_file)
+    expires_in = auth_profile.get('expires_in')
+    store.save({
+        **auth_profile,
+        'expires_at': time.time() + float(expires_in) if expires_in else None,
+    })
+    print(f'saved to {token_file}')